@@ -1,42 +1,134 @@
-from flask import Flask,render_template,request,redirect,session,flash,g
-import sqlite3, os
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask,render_template,request,redirect,session,flash,g,jsonify,Response,stream_with_context
+import sqlite3, os, json, math
+from itertools import islice
+from recommender import RestaurantIndex, data_version, recommendation_key, precomputed_recommendations
+from cache import LRUCache
+from migrations import migrate
+from cuisines import cuisine_mask
+from db_pool import ConnectionPool
+from hashing import PasswordHasher, HashingBusy
+from instrumentation import Instrumentation
+from sessions import create_session_interface
+from assets import init_static_hashing
+from jinja2 import FileSystemBytecodeCache
 
 app = Flask(__name__)
 app.secret_key = "password123"
 
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
 
-app.config["TEMPLATES_AUTO_RELOAD"] = True
-app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
-
-
-DATABASE = "data/copy.db"
-
-def get_db():
-    if "db" not in g: #g is a special flask object that is created whenever a new request is loaded 
-        g.db = sqlite3.connect(DATABASE) #creating a key value pair 
-        g.db.row_factory = sqlite3.Row  # access columns by name
+#sessions live on the server, the cookie only holds a random id ("memory" keeps them per process instead)
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_DATABASE = os.environ.get("SESSION_DATABASE", "data/sessions.db")
+app.session_interface = create_session_interface(SESSION_BACKEND, SESSION_DATABASE)
+
+#PRODUCTION=1: templates compiled once (bytecode cached on disk), rendered anonymous pages cached,
+#static urls content-hashed and cached by browsers for a year. Otherwise templates/static reload on every change
+PRODUCTION = os.environ.get("PRODUCTION") == "1"
+TEMPLATE_CACHE_DIR = os.path.join("data", "template_cache")
+PAGE_CACHE_SIZE = 64
+
+if PRODUCTION:
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 3600 #static files reached without a hashed url (fonts linked from the css)
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name) #compile everything now instead of on the first request for each page
+    init_static_hashing(app)
+else:
+    app.config["TEMPLATES_AUTO_RELOAD"] = True
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
+
+
+DATABASE = os.environ.get("DATABASE", "data/copy.db") #benchmarks/ points this at a synthetic copy
+DB_POOL_SIZE = 4 #idle connections kept per pool, per process
+RECOMMENDATION_CACHE_SIZE = 2048 #distinct preference combinations kept
+RECOMMENDATION_CACHE_TTL = 600 #seconds
+NEARBY_DEFAULT_RADIUS = 1000 #metres
+NEARBY_MAX_RADIUS = 5000
+NEARBY_MAX_LIMIT = 200
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+HASH_WORKERS = 2 #processes doing scrypt, per server process
+HASH_MAX_PENDING = 16 #hashes running or queued before logins/signups are turned away
+SQL_METRICS = os.environ.get("SQL_METRICS") == "1" #per-route sql timing for /metrics, off by default
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 50)) #statements slower than this are logged with their query plan
+
+#restaurants are loaded into memory once at startup, recommend() checks if the scripts rewrote the db since
+restaurant_index = RestaurantIndex(DATABASE)
+if os.path.exists(DATABASE):
+    conn = sqlite3.connect(DATABASE)
+    migrate(conn) #bring an older copy.db up to the current schema/indexes
+    conn.close()
+    restaurant_index.load()
+
+#ranked results per normalized (region, cuisines, category, budget), emptied when data_version changes
+recommendation_cache = LRUCache(maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL)
+
+#fully rendered pages that only differ by logged in or not, templates never change while PRODUCTION is on
+page_cache = LRUCache(maxsize=PAGE_CACHE_SIZE, ttl=float("inf"))
+
+#connections are opened once and reused across requests instead of connect/close every time
+db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE)
+read_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, readonly=True) #mode=ro, never waits on the preferences inserts
+if os.path.exists(DATABASE):
+    db_pool.warm_up() #the first writer connection also switches the db to WAL
+    read_pool.warm_up()
+
+#password hashing runs in its own processes so a login burst can't pin every request thread
+password_hasher = PasswordHasher(workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING)
+
+#when SQL_METRICS is off this hooks nothing and get_db() hands out the plain pooled connections
+instrumentation = Instrumentation(enabled=SQL_METRICS, slow_ms=SLOW_QUERY_MS)
+instrumentation.init_app(app)
+instrumentation.add_gauge("recommendation_cache", "Recommendation LRU cache hits, misses and size.", recommendation_cache.stats)
+instrumentation.add_gauge("password_hasher", "Password hashing pool: pending, queue depth, rejections.", password_hasher.stats)
+instrumentation.add_gauge("db_pool_idle_connections", "Idle pooled sqlite connections.",
+                          lambda: {"rw": db_pool.idle(), "ro": read_pool.idle()}, label="pool")
+
+def get_db(readonly=False):
+    #g is a special flask object that is created whenever a new request is loaded
+    if readonly:
+        if "db_ro" not in g:
+            g.db_ro = instrumentation.acquire(read_pool)
+        return g.db_ro
+    if "db" not in g:
+        g.db = instrumentation.acquire(db_pool)
     return g.db
 
 @app.teardown_appcontext
 def close_db(e=None):
+    #hand the connections back to their pool, they stay open for the next request
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        db_pool.release(instrumentation.unwrap(db))
+    db_ro = g.pop("db_ro", None)
+    if db_ro is not None:
+        read_pool.release(instrumentation.unwrap(db_ro))
+
+def render_cached(template):
+    #the pages render the same for everyone apart from the navbar's login/logout button and flashed messages
+    if not PRODUCTION or session.get("_flashes"):
+        return render_template(template) #flashes are shown once, so that render can't be reused
+    key = (template, bool(session.get("username")))
+    html = page_cache.get(key)
+    if html is None:
+        html = render_template(template)
+        page_cache.set(key, html)
+    return html
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return render_cached("index.html")
 
 @app.route("/about")
 def about():
-    return render_template("about.html")
+    return render_cached("about.html")
 
 @app.route("/recommend", methods=["GET", "POST"])
 def recommend():
-    db = get_db()
+    db = get_db(readonly=True)
     user_id = session.get("user_id")
 
     if not user_id:
@@ -91,44 +183,102 @@ def recommend():
             flash("At least one vibe must be selected.", "danger")
             return redirect("/dashboard")
     
-        db.execute("INSERT INTO preferences (user_id, region, budget, cuisine, category) VALUES (?, ?, ?, ?, ?)",
-                (user_id, region, budget, cuisine_str, category))
-        db.commit()
+        writer = get_db()
+        writer.execute("INSERT INTO preferences (user_id, region, budget, cuisine, cuisine_mask, category) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, region, budget, cuisine_str, cuisine_mask(writer, cuisine_str), category))
+        writer.commit()
     
     prefs = db.execute("SELECT * FROM preferences WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
     cuisines = prefs["cuisine"].split(",")
     cuisines = [c.lower() for c in cuisines]
-    placeholders = ",".join(["?"] * len(cuisines))
-
-    q = f"""
-    SELECT * 
-    FROM(
-        SELECT *,
-            (CASE WHEN cuisine IN ({placeholders}) AND category = ? THEN 5 ELSE 0 END +
-             CASE WHEN price_range = ? THEN 2 ELSE 0 END 
-            ) AS score
-        FROM restaurants
-        WHERE cuisine != 'unknown'
-        AND region = ?
-    ) AS ranked
-    WHERE score >= 5
-    ORDER BY score DESC
-    LIMIT 50;
-        """
-    #parantheses are necessary due to SQL precedence, it will do AND first 
-    #with parantheses it works as intended, without parantheses it will be
-    #if cuisine matches OR (category and region matches)
-    #WHERE is evaluated before SELECT, cannot use something like SCORE that exists only after SELECT
-    #use HAVING as it is evaluated after SELECT
-    #max score is 8, each case is assessed individually 
-    #When creating a separate score column, must use a comma after SELECT to separate the columns
-    #Must use + when using multiple CASE
-    params = cuisines + [category, budget, region]
-    
-    filtered_restaurants = db.execute(q, params).fetchall()
+
+    version = data_version(db)
+    recommendation_cache.sync_version(version)
+    key = recommendation_key(prefs["region"], cuisines, prefs["category"], prefs["budget"])
+    filtered_restaurants = recommendation_cache.get(key)
+    if filtered_restaurants is None:
+        #then the table scripts/precompute_recommendations.py fills, live scoring only for combinations it hasn't seen
+        restaurant_index.refresh_if_stale(version)
+        ranked = precomputed_recommendations(db, key, version)
+        if ranked is not None:
+            filtered_restaurants = restaurant_index.rows_for(ranked)
+        else:
+            filtered_restaurants = restaurant_index.recommend(*key)
+        recommendation_cache.set(key, filtered_restaurants)
     return render_template("recommend.html", prefs=prefs, filtered_restaurants = filtered_restaurants)
+
+def request_cuisines():
+    #?cuisine=chinese&cuisine=thai and ?cuisine=chinese,thai mean the same, for every json route
+    return [c.strip().lower() for value in request.args.getlist("cuisine") for c in value.split(",") if c.strip()]
+
+def parse_cursor(cursor):
+    #"7:1234" -> (7, 1234), the (score, id) of the last row the client has seen
+    score, rest_id = cursor.split(":")
+    return int(score), int(rest_id)
+
+@app.route("/api/recommendations")
+def api_recommendations():
+    #same fields as the dashboard form: region, budget, category, cuisine (repeat it, or comma separate)
+    #?cursor=<next_cursor> gets the next page, ?format=ndjson streams every row after the cursor one line each
+    region = request.args.get("region")
+    budget = request.args.get("budget")
+    category = request.args.get("category")
+    cuisines = request_cuisines()
+    if not (region and budget and category and cuisines):
+        return jsonify(error="region, budget, category and at least one cuisine are required"), 400
+    try:
+        after = parse_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+        limit = int(request.args.get("limit", API_PAGE_SIZE))
+    except ValueError:
+        return jsonify(error="cursor must look like score:id and limit must be a number"), 400
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        return jsonify(error=f"limit must be between 1 and {API_MAX_PAGE_SIZE}"), 400
+
+    restaurant_index.refresh_if_stale(data_version(get_db(readonly=True)))
+    key = recommendation_key(region.capitalize(), cuisines, category, budget)
+    rows = restaurant_index.iter_recommendations(*key, after=after)
+
+    wants_ndjson = request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+    if wants_ndjson:
+        #nothing is built up in memory, each row is serialized as the generator produces it
+        lines = (json.dumps(row) + "\n" for row in rows)
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    page = list(islice(rows, limit + 1)) #one extra row tells us whether there is a next page
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = f"{page[-1]['score']}:{page[-1]['id']}"
+    return jsonify(restaurants=page, next_cursor=next_cursor)
+
+@app.route("/nearby")
+def nearby():
+    #/nearby?lat=1.3521&lon=103.8198&radius=800&category=Hawker&cuisine=chinese -> closest restaurants first, as json
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius = float(request.args.get("radius", NEARBY_DEFAULT_RADIUS))
+        limit = int(request.args.get("limit", 50))
+    except (KeyError, ValueError):
+        return jsonify(error="lat and lon are required, radius and limit must be numbers"), 400
+    #NaN fails every comparison, so radius=nan would slip past "radius <= 0" without the isfinite check
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or not math.isfinite(radius) or radius <= 0 or limit <= 0:
+        return jsonify(error="lat/lon out of range, or radius/limit not positive"), 400
+    radius = min(radius, NEARBY_MAX_RADIUS)
+    limit = min(limit, NEARBY_MAX_LIMIT)
+    cuisines = request_cuisines()
+
+    restaurant_index.refresh_if_stale(data_version(get_db(readonly=True)))
+    restaurants = restaurant_index.nearby(lat, lon, radius, limit=limit,
+                                          category=request.args.get("category"), cuisines=cuisines)
+    return jsonify(lat=lat, lon=lon, radius=radius, restaurants=restaurants)
     
 
+@app.route("/metrics")
+def metrics():
+    #prometheus text format, per-route counters only when SQL_METRICS=1
+    return Response(instrumentation.metrics_text(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/register", methods=["GET","POST"])
 def register():
     db = get_db()
@@ -151,14 +301,18 @@ def register():
             flash("Security answer is required.", "danger")
             return redirect("/register")
         
-        hashed_password = generate_password_hash(password)
-
         user = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
         #user is a tuple like (john, hashed_password, question, answer) or None if no such user
 
         if user:
             flash("Username already taken. Please choose a different one.", "danger")
             return redirect("/register")
+
+        try:
+            hashed_password = password_hasher.hash(password) #only hash once we know the username is free
+        except HashingBusy:
+            flash("Too many requests right now, please try again in a moment.", "warning")
+            return redirect("/register")
         
     
         db.execute("INSERT INTO users (username, password_hash, security_question, security_answer) VALUES (?, ?, ?, ?)", (username, hashed_password, security_question, security_answer))
@@ -171,7 +325,7 @@ def register():
 
 @app.route("/login", methods=["GET","POST"])
 def login():
-    db = get_db()
+    db = get_db(readonly=True)
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
@@ -189,9 +343,20 @@ def login():
             flash("Invalid username", "danger")
             return redirect("/login")
         
-        if not check_password_hash(user["password_hash"], password):
+        try:
+            matches, new_hash = password_hasher.verify(user["password_hash"], password)
+        except HashingBusy:
+            flash("Too many login attempts right now, please try again in a moment.", "warning")
+            return redirect("/login")
+
+        if not matches:
             flash("Invalid password", "danger")
             return redirect("/login")
+
+        if new_hash is not None: #stored with an older/weaker method, swap in the current one
+            writer = get_db()
+            writer.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user["id"]))
+            writer.commit()
         
         
         session["username"] = username
@@ -203,12 +368,12 @@ def login():
 
 @app.route("/dashboard")
 def dashboard():
-    return render_template("dashboard.html")
+    return render_cached("dashboard.html")
 
 
 @app.route("/forgot", methods = ["GET", "POST"])
 def forgot():
-    db = get_db()
+    db = get_db(readonly=True)
     if request.method == "POST":
         username = request.form.get("username")
 
@@ -249,7 +414,11 @@ def reset():
             flash("Security question or answer is incorrect.", "danger")
             return redirect("/reset")
         
-        hashed_new_password = generate_password_hash(new_password)
+        try:
+            hashed_new_password = password_hasher.hash(new_password)
+        except HashingBusy:
+            flash("Too many requests right now, please try again in a moment.", "warning")
+            return redirect("/reset")
         db.execute("UPDATE users SET password_hash = ? WHERE username = ?", (hashed_new_password, user))
         db.commit()
         flash("Password reset successful! Please log in with your new password.", "success")
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import re
+import threading
+
+from flask import send_from_directory
+from werkzeug.security import safe_join
+
+# content-hashed static urls for production: url_for('static', filename='app.css') becomes /static/app.<hash>.css,
+# which can be cached by the browser for a year because any change to the file changes its url
+
+ONE_YEAR = 365 * 24 * 3600
+HASHED_RE = re.compile(r"^(.*)\.([0-9a-f]{12})(\.[^./]*)?$")
+
+
+class StaticHasher:
+    """Works out hashed names lazily, there are thousands of icon files and only a few are ever linked.
+
+    Digests are kept for the life of the process, production only restarts on deploy.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, filename):
+        if filename in self._digests:
+            return self._digests[filename]
+        #safe_join is None for "..", absolute paths and the like, nothing outside static/ is ever read or hashed
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                md5.update(chunk)
+        with self._lock:
+            self._digests[filename] = md5.hexdigest()[:12]
+        return self._digests[filename]
+
+    def hashed_name(self, filename):
+        digest = self.digest(filename)
+        if digest is None: #missing file or a path outside static/, leave the url alone and let it 404
+            return filename
+        root, ext = os.path.splitext(filename)
+        return f"{root}.{digest}{ext}"
+
+    def original(self, filename):
+        #"css/app.0123456789ab.css" -> "css/app.css", only if that really is the current content hash
+        m = HASHED_RE.match(filename)
+        if m is None:
+            return None
+        original = m.group(1) + (m.group(3) or "")
+        return original if self.digest(original) == m.group(2) else None
+
+
+def init_static_hashing(app, max_age=ONE_YEAR):
+    hasher = StaticHasher(app.static_folder)
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = hasher.hashed_name(values["filename"])
+
+    def static(filename):
+        original = hasher.original(filename)
+        if original is None: #not a hashed url (e.g. fonts the css points at), normal SEND_FILE_MAX_AGE_DEFAULT caching
+            return app.send_static_file(filename)
+        response = send_from_directory(app.static_folder, original, max_age=max_age)
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions["static"] = static
+    return hasher
@@ -0,0 +1,76 @@
+#compares closest_element() with the original version (SequenceMatcher on every element, squared-degree distance)
+#on synthetic dense tiles: same answer for every restaurant, and how many restaurants per second each one matches
+#python benchmarks/bench_closest_element.py [--tiles 10] [--elements 400] [--restaurants 200]
+
+import argparse
+import os
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from geo import distance_m
+from overpass import closest_element, element_matchers, element_position
+from synthetic import overpass_tile
+
+
+def reference_closest_element(elements, lat, lon, name, min_name_ratio=0.65, metres=False):
+    #the original loop, optionally with metres instead of squared degrees to check the name logic on its own
+    best = None
+    best_d = float("inf")
+    for el in elements:
+        position = element_position(el)
+        if position is None:
+            continue
+        el_lat, el_lon = position
+        if metres:
+            d = distance_m(lat, lon, el_lat, el_lon)
+        else:
+            d = (el_lat - lat) ** 2 + (el_lon - lon) ** 2
+        el_name = el.get("tags", {}).get("name", "")
+        ratio = SequenceMatcher(None, name.lower(), el_name.lower()).ratio()
+        if d < best_d and ratio >= min_name_ratio:
+            best, best_d = el, d
+    return best
+
+
+def run(fn, tiles):
+    started = time.perf_counter()
+    answers = [fn(elements, lat, lon, name) for elements, queries in tiles for lat, lon, name in queries]
+    return answers, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity and throughput of closest_element() against the original")
+    parser.add_argument("--tiles", type=int, default=10)
+    parser.add_argument("--elements", type=int, default=400, help="Overpass elements per tile")
+    parser.add_argument("--restaurants", type=int, default=200, help="restaurants matched against each tile")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    tiles = [overpass_tile(rnd, args.elements, args.restaurants) for _ in range(args.tiles)]
+    total = args.tiles * args.restaurants
+    print(f"{args.tiles} tiles x {args.elements} elements, {total} restaurants")
+
+    original, original_s = run(reference_closest_element, tiles)
+    metres, _ = run(lambda *a: reference_closest_element(*a, metres=True), tiles)
+    element_matchers.get.cache_clear()
+    new, new_s = run(closest_element, tiles)
+
+    def ids(answers):
+        return [el["id"] if el is not None else None for el in answers]
+
+    same_metres = sum(a == b for a, b in zip(ids(metres), ids(new)))
+    same_original = sum(a == b for a, b in zip(ids(original), ids(new)))
+    matched = sum(el is not None for el in new)
+    print(f"original        {original_s:7.2f}s  {total / original_s:9.0f} restaurants/s")
+    print(f"closest_element {new_s:7.2f}s  {total / new_s:9.0f} restaurants/s  ({original_s / new_s:.1f}x)")
+    print(f"{matched} of {total} matched; same answer as the original loop in metres: {same_metres}/{total}, "
+          f"in squared degrees: {same_original}/{total}")
+    if same_metres != total:
+        raise SystemExit("PARITY FAILED")
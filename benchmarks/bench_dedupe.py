@@ -0,0 +1,113 @@
+#compares the original seed.sql cleanup (one DELETE with NOT IN (SELECT MIN(id) ... GROUP BY name, address))
+#with the per-rule window function version in seed.sql / dedupe.py, and with deduplicating at ingest time
+#python benchmarks/bench_dedupe.py [--rows 1000000] [--duplicates 0.1] [--invalid 0.05]
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from dedupe import clean, load_rules
+from import_ee import INSERT_SQL, UPSERT_SQL, keyed
+from synthetic import empty_database, establishment_rows
+
+ORIGINAL_SEED = """DELETE FROM restaurants
+    WHERE name IS NULL
+    OR id NOT IN (
+        SELECT MIN(id)
+        FROM restaurants
+        GROUP BY name,address
+    )
+    OR lower(NAME) LIKE '%nil'
+    OR lower(NAME) LIKE '-%'
+    OR LENGTH(name) < 3
+    OR LOWER(name) LIKE 'halal%'
+    OR name LIKE '-%'
+    OR LOWER(name) LIKE 'vegetarian%'
+    OR unit_no = ''
+    OR unit_no = '0'
+    OR unit_no IS NULL
+    OR level = ''
+    OR level = '0'
+    OR level IS NULL
+    OR latitude IS NULL
+    OR longitude IS NULL
+    OR address is NULL
+    OR address = '';"""
+
+
+def build(path, sql, args, migrated=False):
+    #migrated: with the unique dedup_key index from migration 5, otherwise duplicates go in like they used to
+    conn = empty_database(path, migrated)
+    conn.close()
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(sql, map(keyed, establishment_rows(args.rows, args.duplicates, args.invalid)))
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed
+
+
+def surviving(path):
+    conn = sqlite3.connect(path)
+    count = conn.execute("SELECT count(*) FROM restaurants").fetchone()[0]
+    conn.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the seed.sql cleanup against the per-rule window function version")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of rows repeating an earlier one")
+    parser.add_argument("--invalid", type=float, default=0.05, help="share of rows one of the rules removes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base.db")
+        elapsed = build(base, INSERT_SQL, args)
+        print(f"{args.rows} rows inserted in {elapsed:.2f}s")
+
+        #1. the original single DELETE
+        path = os.path.join(tmp, "original.db")
+        shutil.copy(base, path)
+        conn = sqlite3.connect(path)
+        started = time.perf_counter()
+        with conn:
+            removed = conn.execute(ORIGINAL_SEED).rowcount
+        original = time.perf_counter() - started
+        conn.close()
+        print(f"original seed.sql   {original:8.2f}s  {removed} removed, {surviving(path)} left")
+
+        #2. one DELETE per rule, duplicates by ROW_NUMBER() over the normalized key
+        path = os.path.join(tmp, "rules.db")
+        shutil.copy(base, path)
+        conn = sqlite3.connect(path, isolation_level=None)
+        started = time.perf_counter()
+        removed = clean(conn, load_rules())
+        rules = time.perf_counter() - started
+        conn.close()
+        print(f"per-rule seed.sql   {rules:8.2f}s  {sum(removed.values())} removed, {surviving(path)} left "
+              f"({original / rules:.1f}x)")
+        for name, count in removed.items():
+            print(f"    {name}: {count}")
+
+        #3. migration 5 (unique index), then the same rows upserted so duplicates never get in, then the rules
+        path = os.path.join(tmp, "ingest.db")
+        upsert = build(path, UPSERT_SQL, args, migrated=True)
+        conn = sqlite3.connect(path, isolation_level=None)
+        started = time.perf_counter()
+        removed = clean(conn, load_rules())
+        cleanup = time.perf_counter() - started
+        conn.close()
+        print(f"upsert at ingest    {upsert:8.2f}s  insert ({upsert - elapsed:+.2f}s vs plain INSERT), "
+              f"cleanup {cleanup:.2f}s, {sum(removed.values())} removed, {surviving(path)} left")
+        for name, count in removed.items():
+            print(f"    {name}: {count}")
@@ -0,0 +1,88 @@
+#compares the streaming import_ee.py with the original json.load + BeautifulSoup + INSERT per row version
+#python benchmarks/bench_import_ee.py [eatingestablishments.geojson]    or    python benchmarks/bench_import_ee.py --synthetic 50000
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from import_ee import EATING_PATH, INSERT_SQL, import_establishments, keyed
+from synthetic import empty_database, establishments_geojson
+
+
+def reference_import(conn, path):
+    #the original script
+    from bs4 import BeautifulSoup
+
+    with open(path, "r", encoding="utf-8") as f:
+        eating_data = json.load(f)
+
+    count = 0
+    for feature in eating_data["features"]:
+        props = feature["properties"]
+        geom = feature.get("geometry", {})
+        coords = geom.get("coordinates", [None, None])
+        soup = BeautifulSoup(props.get("Description", ""), "html.parser")
+        attributes = {}
+        for row in soup.find_all("tr"):
+            headers = row.find_all("th")
+            cols = row.find_all("td")
+            if len(headers) == 1 and len(cols) == 1:
+                attributes[headers[0].get_text(strip=True)] = cols[0].get_text(strip=True)
+
+        address_parts = [attributes.get("BLK_HOUSE", ""), attributes.get("STR_NAME", ""), attributes.get("UNIT_NO", "")]
+        address = " ".join(part for part in address_parts if part).strip()
+        conn.execute(INSERT_SQL, keyed((attributes.get("BUSINESS_NAME", "N.A"), attributes.get("LIC_NAME", "N.A"), address,
+                                        attributes.get("UNIT_NO", "N.A"), attributes.get("LEVEL_NO", "N.A"),
+                                        attributes.get("POSTCODE", "N.A"), coords[0], coords[1])))
+        count += 1
+    conn.commit()
+    return count
+
+
+def measure(label, directory, run, path):
+    conn = empty_database(os.path.join(directory, label + ".db"))
+    started = time.perf_counter()
+    count = run(conn, path)
+    elapsed = time.perf_counter() - started
+    rows = conn.execute("SELECT name, license_name, address, unit_no, level, postal, longitude, latitude FROM restaurants ORDER BY id").fetchall()
+    conn.close()
+
+    conn = empty_database(os.path.join(directory, label + "_mem.db"))
+    tracemalloc.start()
+    run(conn, path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    conn.close()
+
+    print(f"{label:10} {count} rows in {elapsed:.2f}s ({count / elapsed:.0f} rows/s), peak python memory {peak / 1e6:.1f}MB")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=EATING_PATH)
+    parser.add_argument("--synthetic", type=int, help="generate a file with this many features instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path
+        if args.synthetic:
+            path = os.path.join(tmp, "synthetic.geojson")
+            establishments_geojson(path, args.synthetic)
+        print(f"{path} ({os.path.getsize(path) / 1e6:.1f}MB)")
+
+        streaming = measure("streaming", tmp, lambda conn, p: import_establishments(conn, p, progress_every=0), path)
+        try:
+            original = measure("original", tmp, reference_import, path)
+        except ImportError:
+            print("bs4 not installed, skipping the original version")
+        else:
+            print("rows identical" if original == streaming else "ROWS DIFFER")
@@ -0,0 +1,88 @@
+#"near me" search: grid index in RestaurantIndex vs scanning every restaurant, checks both return the same rows
+#python benchmarks/bench_nearby.py [--db path/to/copy.db] [--restaurants 30000] [--queries 500] [--radius 1000]
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from geo import distance_m
+from recommender import RestaurantIndex
+from synthetic import SG_BOUNDS, build_database
+
+
+def scan_nearby(rows, lat, lon, radius_m, limit=50):
+    #the naive version: distance to every row, then sort
+    found = []
+    for rest_id, r_lat, r_lon in rows:
+        if r_lat is None or r_lon is None:
+            continue
+        d = distance_m(lat, lon, r_lat, r_lon)
+        if d <= radius_m:
+            found.append((d, rest_id))
+    found.sort()
+    return [rest_id for _, rest_id in found[:limit]]
+
+
+def timed(fn, points):
+    times = []
+    results = []
+    for lat, lon in points:
+        started = time.perf_counter()
+        results.append(fn(lat, lon))
+        times.append((time.perf_counter() - started) * 1000)
+    return results, times
+
+
+def summary(times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1]
+    return f"mean {statistics.mean(times):.3f}ms  p50 {statistics.median(times):.3f}ms  p95 {p95:.3f}ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the grid index \"near me\" search with a full scan")
+    parser.add_argument("--db", help="existing database, a synthetic one is built when omitted")
+    parser.add_argument("--restaurants", type=int, default=30000, help="rows in the synthetic database")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--radius", type=float, default=1000, help="metres")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = None
+    database = args.db
+    if database is None:
+        tmp = tempfile.TemporaryDirectory()
+        database = build_database(os.path.join(tmp.name, "bench.db"), args.restaurants)
+
+    index = RestaurantIndex(database)
+    started = time.perf_counter()
+    index.load()
+    print(f"index loaded in {time.perf_counter() - started:.2f}s")
+
+    conn = sqlite3.connect(database)
+    rows = conn.execute("SELECT id, latitude, longitude FROM restaurants").fetchall()
+    conn.close()
+
+    rnd = random.Random(1)
+    south, west, north, east = SG_BOUNDS
+    points = [(rnd.uniform(south, north), rnd.uniform(west, east)) for _ in range(args.queries)]
+
+    expected, scan_times = timed(lambda lat, lon: scan_nearby(rows, lat, lon, args.radius, args.limit), points)
+    got, grid_times = timed(lambda lat, lon: [r["id"] for r in index.nearby(lat, lon, args.radius, args.limit)], points)
+
+    mismatches = sum(1 for e, g in zip(expected, got) if e != g)
+    print(f"{len(rows)} restaurants, {len(points)} queries, radius {args.radius:.0f}m")
+    print(f"naive scan  {summary(scan_times)}")
+    print(f"grid index  {summary(grid_times)}")
+    print(f"{mismatches} mismatches")
+    if tmp is not None:
+        tmp.cleanup()
+    sys.exit(1 if mismatches else 0)
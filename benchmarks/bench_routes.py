@@ -0,0 +1,237 @@
+#latency/throughput of the flask routes against a synthetic copy.db
+#   1. flask's test client, one request at a time (no network, shows the cost of the route itself)
+#   2. a real threaded WSGI server with --clients concurrent clients, each logged in as its own user
+#   3. the hot SQL statements on their own, so a regression can be pinned on sqlite or on python
+#python benchmarks/bench_routes.py [--restaurants 10000] [--users 200] [--requests 200] [--clients 8] [--out results.json]
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import PASSWORD, build_database, preference_form
+
+
+def percentiles(times):
+    #times in ms -> summary dict, nearest-rank percentiles
+    if not times:
+        return {"count": 0}
+    times = sorted(times)
+
+    def pct(p):
+        return round(times[min(len(times) - 1, max(0, int(round(p / 100 * len(times))) - 1))], 3)
+
+    return {"count": len(times), "mean": round(sum(times) / len(times), 3),
+            "p50": pct(50), "p95": pct(95), "p99": pct(99), "max": round(times[-1], 3)}
+
+
+def form_data(form):
+    #the dashboard posts cuisine once per ticked box
+    return [(k, v) for k, values in form.items() for v in (values if isinstance(values, list) else [values])]
+
+
+def scenario(rnd, user, run):
+    #one simulated visit: log in, look at the recommendations, change preferences, look again
+    #plus a fresh signup now and then, the username has to be unique per run
+    steps = [("login", "POST", "/login", [("username", user), ("password", PASSWORD)]),
+             ("recommend GET", "GET", "/recommend", None),
+             ("recommend POST", "POST", "/recommend", form_data(preference_form(rnd))),
+             ("recommend GET", "GET", "/recommend", None)]
+    if rnd.random() < 0.1:
+        steps.append(("register", "POST", "/register", [("username", f"new-{run}-{rnd.getrandbits(48):x}"),
+                                                       ("password", PASSWORD), ("security_question", "q"),
+                                                       ("security_answer", "a")]))
+    return steps
+
+
+def run_test_client(app, users, requests, seed=0):
+    from werkzeug.datastructures import MultiDict
+
+    rnd = random.Random(seed)
+    timings = {}
+    done = 0
+    started = time.perf_counter()
+    while done < requests:
+        client = app.test_client() #new cookie jar per visit
+        for label, method, path, data in scenario(rnd, rnd.choice(users), "tc"):
+            t = time.perf_counter()
+            response = client.open(path, method=method, data=MultiDict(data) if data else None)
+            timings.setdefault(label, []).append((time.perf_counter() - t) * 1000)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{method} {path} returned {response.status_code}")
+            done += 1
+    return timings, done / (time.perf_counter() - started)
+
+
+class HttpClient:
+    #minimal client that keeps the session cookie and does not follow redirects (the test client doesn't either)
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        conn.close()
+        return response.status
+
+
+def run_server(app, users, requests, clients, seed=0):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) #no access log line per request
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    timings = {}
+    lock = threading.Lock()
+    per_client = max(1, requests // clients)
+
+    def worker(n):
+        rnd = random.Random(seed + n)
+        mine = {}
+        done = 0
+        while done < per_client:
+            client = HttpClient(host, port)
+            for label, method, path, data in scenario(rnd, rnd.choice(users), f"srv{n}"):
+                t = time.perf_counter()
+                status = client.request(method, path, data)
+                mine.setdefault(label, []).append((time.perf_counter() - t) * 1000)
+                if status >= 500:
+                    raise RuntimeError(f"{method} {path} returned {status}")
+                done += 1
+        with lock:
+            for label, times in mine.items():
+                timings.setdefault(label, []).extend(times)
+        return done
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            total = sum(pool.map(worker, range(clients)))
+    finally:
+        server.shutdown()
+    return timings, total / (time.perf_counter() - started)
+
+
+def sqlite_query_times(database, repeats=200, seed=0):
+    #the statements the routes run, timed straight against sqlite (execute + fetch)
+    from migrations import HOT_QUERIES
+    from recommender import recommendation_key, recommendation_key_text, sql_recommendations_query
+
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(database)
+    users = conn.execute("SELECT count(*) FROM users").fetchone()[0] or 1
+    timings = {}
+    for _ in range(repeats):
+        form = preference_form(rnd)
+        cuisines = [c.lower() for c in form["cuisine"]]
+        queries = dict(HOT_QUERIES)
+        queries["login: user by username"] = ("SELECT * FROM users WHERE username = ?", (f"user{rnd.randrange(users)}",))
+        queries["recommend: latest preferences"] = (HOT_QUERIES["recommend: latest preferences"][0], (rnd.randint(1, users),))
+        queries["recommend: ranked restaurants"] = sql_recommendations_query(form["region"], cuisines, form["category"], form["budget"])
+        key = recommendation_key(form["region"], cuisines, form["category"], form["budget"])
+        queries["recommend: precomputed results"] = (HOT_QUERIES["recommend: precomputed results"][0], (recommendation_key_text(key),))
+        for label, (sql, params) in queries.items():
+            t = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.setdefault(label, []).append((time.perf_counter() - t) * 1000)
+    conn.close()
+    return {label: percentiles(times) for label, times in timings.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(title, summary, throughput=None):
+    print(f"\n{title}" + (f"  ({throughput:.1f} req/s)" if throughput else ""))
+    for label, s in summary.items():
+        if s.get("count"):
+            print(f"  {label:<32} n={s['count']:<6} p50 {s['p50']:>9.3f}ms  p95 {s['p95']:>9.3f}ms  p99 {s['p99']:>9.3f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the flask routes against a synthetic database")
+    parser.add_argument("--db", help="use this database instead of building one (its users need the synthetic password)")
+    parser.add_argument("--restaurants", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="requests per mode")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients against the WSGI server")
+    parser.add_argument("--skip-server", action="store_true")
+    parser.add_argument("--out", help="write the results here as JSON")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database = args.db
+    if database is None:
+        from hashing import PASSWORD_HASH_METHOD
+        from werkzeug.security import generate_password_hash
+
+        started = time.perf_counter()
+        database = build_database(os.path.join(tmp.name, "copy.db"), args.restaurants, args.users,
+                                  password_hash=generate_password_hash(PASSWORD, method=PASSWORD_HASH_METHOD))
+        print(f"built {args.restaurants} restaurants / {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    conn = sqlite3.connect(database)
+    users = [r[0] for r in conn.execute("SELECT username FROM users WHERE username LIKE 'user%'")]
+    conn.close()
+    if not users:
+        sys.exit("the database has no synthetic users (user0, user1, ...)")
+
+    os.environ["DATABASE"] = database #read when app.py is imported
+    import app as flask_app
+    app = flask_app.app
+
+    results = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "config": {"restaurants": args.restaurants if args.db is None else None, "users": len(users),
+                          "requests": args.requests, "clients": args.clients, "database": args.db}}
+
+    timings, throughput = run_test_client(app, users, args.requests)
+    results["test_client"] = {"throughput": round(throughput, 2), "routes": {k: percentiles(v) for k, v in timings.items()}}
+    print_table("test client", results["test_client"]["routes"], throughput)
+
+    if not args.skip_server:
+        timings, throughput = run_server(app, users, args.requests, args.clients)
+        results["server"] = {"throughput": round(throughput, 2), "routes": {k: percentiles(v) for k, v in timings.items()}}
+        print_table(f"WSGI server, {args.clients} clients", results["server"]["routes"], throughput)
+
+    results["sqlite"] = sqlite_query_times(database)
+    print_table("sqlite statements", results["sqlite"])
+    results["password_hasher"] = flask_app.password_hasher.stats()
+    flask_app.password_hasher.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nresults written to {args.out}")
+    tmp.cleanup()
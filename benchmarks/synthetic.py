@@ -0,0 +1,200 @@
+import json
+import os
+import random
+import sqlite3
+import string
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cuisines import sync_preference_masks, sync_restaurant_cuisines
+from migrations import fill_dedup_keys, migrate
+
+# a throwaway copy.db with the real schema and made up restaurants, for benchmarking without the real data
+# restaurants are clustered around a few dozen "town centres" like the real establishments are
+
+SCHEMA_PATH = os.path.join(ROOT, "schema.sql")
+
+REGIONS = ["North", "South", "East", "West", "Central"]
+CATEGORIES = ["Restaurant", "Cafe", "Hawker", "Fast Food", "Bakery", "Dessert", "Bubble Tea", "Supermarket Food", "Food Court"]
+CUISINES = ["japanese", "korean", "chinese", "thai", "indian", "italian", "western", "malay", "vietnamese", "mexican", "local", "unknown",
+            "chinese;japanese", "thai;vietnamese", "western;italian"] # OSM style multi-cuisine values
+PRICES = ["cheap", "medium", "expensive"]
+
+BUDGETS = ["cheap", "medium"] # what the dashboard form offers
+DASHBOARD_CUISINES = ["Japanese", "Korean", "Chinese", "Thai", "Indian", "Italian", "Western", "Malay", "Vietnamese", "Mexican", "Local"]
+
+SG_BOUNDS = (1.22, 103.60, 1.47, 104.05) # south, west, north, east
+STREETS = ["ANG MO KIO AVE 3", "ORCHARD ROAD", "TAMPINES ST 11", "JURONG WEST ST 52", "BEDOK NORTH RD"]
+CLUSTERS = 40
+PASSWORD = "benchmark" # every synthetic user has this password
+
+
+def restaurant_rows(count, seed=0):
+    rnd = random.Random(seed)
+    south, west, north, east = SG_BOUNDS
+    centres = [(rnd.uniform(south, north), rnd.uniform(west, east)) for _ in range(CLUSTERS)]
+    for i in range(count):
+        c_lat, c_lon = rnd.choice(centres)
+        lat = min(max(rnd.gauss(c_lat, 0.01), south), north)
+        lon = min(max(rnd.gauss(c_lon, 0.01), west), east)
+        yield (f"Restaurant {i}", f"{rnd.randint(1, 999)} Synthetic Street", f"{rnd.randint(10000, 829999):06d}",
+               rnd.choice(REGIONS), rnd.choice(CATEGORIES), rnd.choice(CUISINES), rnd.choice(PRICES), lat, lon)
+
+
+def preference_form(rnd):
+    #one dashboard submission, same field names as the form in templates/dashboard.html
+    return {"region": rnd.choice(REGIONS), "budget": rnd.choice(BUDGETS), "category": rnd.choice(CATEGORIES),
+            "cuisine": rnd.sample(DASHBOARD_CUISINES, rnd.randint(1, 3))}
+
+
+def user_rows(count, password_hash, seed=0):
+    rnd = random.Random(seed + 1)
+    for i in range(count):
+        form = preference_form(rnd)
+        yield (f"user{i}", password_hash), (form["region"], form["budget"], ",".join(form["cuisine"]), form["category"])
+
+
+def empty_database(path, migrated=True):
+    #schema.sql, and the migrations unless migrated=False (no unique dedup_key index, duplicates can be inserted)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+    if migrated:
+        migrate(conn)
+    return conn
+
+
+def build_database(path, restaurants=30000, users=0, seed=0, password_hash=None):
+    #password_hash is the hash of PASSWORD, computed once by the caller and shared by every user (hashing is slow on purpose)
+    conn = empty_database(path)
+    with conn:
+        conn.executemany("""INSERT INTO restaurants (name, address, postal, region, category, cuisine, price_range, latitude, longitude)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", restaurant_rows(restaurants, seed))
+        for user_id, (user, prefs) in enumerate(user_rows(users, password_hash, seed), start=1):
+            conn.execute("""INSERT INTO users (id, username, password_hash, security_question, security_answer)
+                            VALUES (?, ?, ?, 'What is your favourite food?', 'rice')""", (user_id, *user))
+            conn.execute("INSERT INTO preferences (user_id, region, budget, cuisine, category) VALUES (?, ?, ?, ?, ?)",
+                         (user_id, *prefs))
+    #rows were inserted after migrations 5 and 7 ran, fill their keys, join table and masks
+    with conn:
+        fill_dedup_keys(conn)
+    sync_restaurant_cuisines(conn)
+    sync_preference_masks(conn)
+    conn.close()
+    return path
+
+
+# raw inputs of the scripts: rows as import_ee.py inserts them, the data.gov.sg geojson, Overpass answers for one tile
+
+def establishment_rows(count, duplicates=0.0, invalid=0.0, seed=0):
+    #import_ee.py rows: (name, license_name, address, unit_no, level, postal, longitude, latitude)
+    #duplicates repeat an earlier establishment, half of them with different case/spacing like re-exports have,
+    #invalid ones break one of the seed.sql rules (name, unit_no, address or coordinates)
+    rnd = random.Random(seed)
+    south, west, north, east = SG_BOUNDS
+    made = []
+    for i in range(count):
+        if made and rnd.random() < duplicates:
+            name, license_name, address, unit_no, level, postal, lon, lat = rnd.choice(made)
+            if rnd.random() < 0.5:
+                name, address = name.upper(), address.replace(" ", "  ", 1)
+            yield (name, license_name, address, unit_no, level, postal, lon, lat)
+            continue
+        row = (f"Stall {i}", f"LICENSEE {i}", f"{rnd.randint(1, 999)} {rnd.choice(STREETS)}",
+               f"{rnd.randint(1, 99):02d}", f"{rnd.randint(1, 12):02d}", f"{rnd.randint(10000, 829999):06d}",
+               rnd.uniform(west, east), rnd.uniform(south, north))
+        if rnd.random() < invalid:
+            broken = rnd.randrange(4)
+            if broken == 0:
+                row = ("-",) + row[1:]
+            elif broken == 1:
+                row = row[:3] + ("0",) + row[4:]
+            elif broken == 2:
+                row = row[:2] + ("",) + row[3:]
+            else:
+                row = row[:6] + (None, None)
+        elif len(made) < 100000:
+            made.append(row)
+        yield row
+
+
+def establishments_geojson(path, count, seed=0):
+    #same shape as the data.gov.sg file: attributes in an HTML table inside properties.Description
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"type": "FeatureCollection", "name": "EatingEstablishments", "features": [\n')
+        for i, (name, license_name, address, unit_no, level, postal, lon, lat) in enumerate(establishment_rows(count, seed=seed)):
+            block, street = address.split(" ", 1)
+            cells = {"BUSINESS_NAME": f"{name} &amp; Co", "LIC_NAME": license_name, "BLK_HOUSE": block, "STR_NAME": street,
+                     "UNIT_NO": unit_no, "LEVEL_NO": level, "POSTCODE": postal}
+            rows = "".join(f"<tr bgcolor=\"#E3E3F3\"> <th>{k}</th> <td>{v}</td> </tr>" for k, v in cells.items())
+            description = f"<center><table><tr> <th colspan='2' align='center'><em>Attributes</em></th> </tr>{rows}</table></center>"
+            feature = {"type": "Feature", "properties": {"Name": f"kml_{i}", "Description": description},
+                       "geometry": {"type": "Point", "coordinates": [lon, lat, 0.0]}}
+            f.write(("," if i else "") + json.dumps(feature) + "\n")
+        f.write("]}\n")
+    return path
+
+
+WORDS = ["kopi", "toast", "box", "ya", "kun", "kaya", "chicken", "rice", "noodle", "mee", "pok", "bak", "kut", "teh",
+         "sushi", "ramen", "tei", "express", "house", "kitchen", "cafe", "bistro", "bar", "grill", "thai", "express",
+         "curry", "prata", "nasi", "lemak", "dim", "sum", "hot", "pot", "bubble", "tea", "bakery", "western", "food"]
+TILE = (1.30, 103.80, 0.0055, 0.011) # south, west, height, width in degrees, about a geohash-6 tile
+
+
+def place_name(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))).title()
+
+
+def misspell(rnd, name):
+    #what the licence register does to the OSM name: case, a suffix, a dropped or swapped letter
+    roll = rnd.random()
+    if roll < 0.3:
+        return name.upper()
+    if roll < 0.5:
+        return f"{name} ({rnd.choice(['Tampines', 'Bedok', 'Orchard'])})"
+    if roll < 0.7 and len(name) > 4:
+        i = rnd.randrange(len(name) - 1)
+        return name[:i] + name[i + 1:]
+    if roll < 0.8:
+        return name + " " + rnd.choice(string.ascii_uppercase)
+    return place_name(rnd) #a different place altogether
+
+
+def overpass_tile(rnd, n_elements, n_restaurants):
+    #a dense tile of Overpass elements (nodes, and ways with a center) and restaurants near some of them,
+    #as (lat, lon, name) with the name the way the licence register spells it
+    south, west, height, width = TILE
+    elements = []
+    positions = []
+    for i in range(n_elements):
+        el = {"type": rnd.choice(["node", "way"]), "id": i, "tags": {"name": place_name(rnd)} if rnd.random() < 0.95 else {}}
+        lat, lon = south + rnd.random() * height, west + rnd.random() * width
+        if el["type"] == "way":
+            el["center"] = {"lat": lat, "lon": lon}
+        else:
+            el["lat"], el["lon"] = lat, lon
+        elements.append(el)
+        positions.append((lat, lon))
+    queries = []
+    for _ in range(n_restaurants):
+        i = rnd.randrange(n_elements)
+        lat, lon = positions[i]
+        name = misspell(rnd, elements[i]["tags"].get("name", place_name(rnd)))
+        queries.append((lat + rnd.gauss(0, 0.0003), lon + rnd.gauss(0, 0.0003), name))
+    return elements, queries
+
+
+if __name__ == "__main__":
+    #python benchmarks/synthetic.py path/to/bench.db [restaurants] [users]
+    from hashing import PASSWORD_HASH_METHOD
+    from werkzeug.security import generate_password_hash
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "data", "bench.db")
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 30000
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    build_database(path, count, users, password_hash=generate_password_hash(PASSWORD, method=PASSWORD_HASH_METHOD))
+    print(f"Wrote {count} synthetic restaurants and {users} users to {path} (password {PASSWORD!r})")
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded dict that drops the least recently used entry once it holds `maxsize` items.
+
+    Entries older than `ttl` seconds count as misses. `version` is the
+    data_version the entries were computed from, sync_version() empties the
+    cache as soon as the scripts have changed the data underneath it.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict() # key -> (stored_at, value), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def expire(self):
+        #drop every entry older than ttl in one go, get() only notices them one key at a time
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            stale = [key for key, (stored_at, _) in self._data.items() if stored_at < cutoff]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def sync_version(self, version):
+        if version != self.version:
+            with self._lock:
+                self._data.clear()
+                self.version = version
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
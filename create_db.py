@@ -1,5 +1,6 @@
 import sqlite3
 import os
+from migrations import migrate
 
 # Get the base directory of the script
 BASE_DIR = os.path.dirname(__file__)
@@ -24,6 +25,10 @@ with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
     cursor.executescript(schema_sql)
 
 conn.commit()
+
+# --- Step 4: Apply migrations (indexes, later schema changes) ---
+migrate(conn)
+
 conn.close()
 
 print("Database created successfully!")
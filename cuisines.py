@@ -0,0 +1,147 @@
+import os
+import re
+import sqlite3
+import sys
+
+from migrations import add_missing_columns
+
+# restaurants.cuisine is free text ("chinese;japanese" straight from OSM, "Japanese,Korean" in preferences),
+# this normalizes it into cuisines / restaurant_cuisines and keeps a cuisine_mask per restaurant and preference:
+# every cuisine with a bit sets 1 << bit, so "serves any of these cuisines" is a single cuisine_mask & wanted != 0.
+# cuisines past the first MAX_BITS all share OVERFLOW_BIT, a hit on that bit alone is only a candidate and is
+# confirmed by name (restaurant_cuisines in SQL, the cuisine text in memory, see mask_matches)
+
+# the dashboard checkboxes always get bits 0..10, in this order, whatever the data holds
+DASHBOARD_CUISINES = ("japanese", "korean", "chinese", "thai", "indian", "italian", "western", "malay", "vietnamese",
+                      "mexican", "local")
+MAX_BITS = 62 # bits 0..61 are one cuisine each
+OVERFLOW_BIT = 62 # shared by all the others, bit 63 would make the mask a negative sqlite integer
+OVERFLOW = 1 << OVERFLOW_BIT
+SEPARATORS_RE = re.compile(r"[;,]")
+CHUNK_SIZE = 500 # ids per IN (...), under sqlite's bound variable limit
+
+
+def split_cuisines(text):
+    #"Chinese; japanese,noodle" -> ["chinese", "japanese", "noodle"], blanks, duplicates and 'unknown' dropped
+    names = []
+    for part in SEPARATORS_RE.split(text or ""):
+        name = part.strip().lower()
+        if name and name != "unknown" and name not in names:
+            names.append(name)
+    return names
+
+
+def ensure_tables(conn):
+    #cuisines / restaurant_cuisines come from schema.sql, bit and the mask columns from migration 7
+    conn.execute("CREATE TABLE IF NOT EXISTS cuisines (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS restaurant_cuisines (
+                        restaurant_id INTEGER,
+                        cuisine_id INTEGER,
+                        PRIMARY KEY (restaurant_id, cuisine_id))""")
+    add_missing_columns(conn, "cuisines", {"bit": "INTEGER"})
+    add_missing_columns(conn, "restaurants", {"cuisine_mask": "INTEGER NOT NULL DEFAULT 0"})
+    add_missing_columns(conn, "preferences", {"cuisine_mask": "INTEGER NOT NULL DEFAULT 0"})
+    #ALTER TABLE can't add a UNIQUE column, the index does the same for databases older than schema.sql's bit
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_cuisines_bit ON cuisines (bit);")
+    add_cuisines(conn, DASHBOARD_CUISINES)
+
+
+def cuisine_bits(conn):
+    #name -> bit, cuisines past the first MAX_BITS have no bit and set OVERFLOW_BIT instead
+    try:
+        return dict(conn.execute("SELECT name, bit FROM cuisines WHERE bit IS NOT NULL"))
+    except sqlite3.OperationalError: #database from before migration 7
+        return {}
+
+
+def mask_for(bits, names):
+    mask = 0
+    for name in names:
+        bit = bits.get(name.lower())
+        mask |= 1 << (bit if bit is not None else OVERFLOW_BIT)
+    return mask
+
+
+def overflow_names(bits, names):
+    #the names mask_for() could only give OVERFLOW_BIT
+    return {name.lower() for name in names if name.lower() not in bits}
+
+
+def mask_matches(mask, wanted, overflow, cuisine):
+    #whether a restaurant (cuisine_mask, cuisine text) serves one of the wanted cuisines,
+    #wanted = mask_for(bits, names) and overflow = overflow_names(bits, names) of the same names
+    hit = mask & wanted
+    return bool(hit & ~OVERFLOW) or bool(hit) and not overflow.isdisjoint(split_cuisines(cuisine))
+
+
+def cuisine_mask(conn, text):
+    #mask of a cuisine text as stored ("Japanese,Korean"), for a single row, bulk updates reuse one cuisine_bits()
+    return mask_for(cuisine_bits(conn), split_cuisines(text))
+
+
+def add_cuisines(conn, names):
+    #inserts the names that aren't there yet, each new one takes the next free bit while there are bits left
+    #returns name -> id for all of them
+    ids = {}
+    next_bit = conn.execute("SELECT coalesce(max(bit) + 1, 0) FROM cuisines").fetchone()[0]
+    for name in names:
+        row = conn.execute("SELECT id FROM cuisines WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            bit = next_bit if next_bit < MAX_BITS else None
+            next_bit += bit is not None
+            row = (conn.execute("INSERT INTO cuisines (name, bit) VALUES (?, ?)", (name, bit)).lastrowid,)
+        ids[name] = row[0]
+    return ids
+
+
+def sync_restaurant_cuisines(conn, ids=None):
+    """Rebuilds restaurant_cuisines and cuisine_mask from restaurants.cuisine.
+
+    ids=None does every restaurant, otherwise only those (the enrichment scripts pass the rows they wrote).
+    Returns how many masks changed.
+    """
+    ensure_tables(conn)
+    sql = "SELECT id, cuisine, cuisine_mask FROM restaurants"
+    if ids is None:
+        rows = conn.execute(sql).fetchall()
+    else:
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            rows += conn.execute(f"{sql} WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+
+    parsed = [(rest_id, split_cuisines(cuisine), mask) for rest_id, cuisine, mask in rows]
+    cuisine_ids = add_cuisines(conn, sorted({name for _, names, _ in parsed for name in names}))
+    bits = cuisine_bits(conn)
+
+    links = [(rest_id, cuisine_ids[name]) for rest_id, names, _ in parsed for name in names]
+    masks = [(mask_for(bits, names), rest_id) for rest_id, names, old in parsed if mask_for(bits, names) != old]
+    with conn:
+        if ids is None:
+            conn.execute("DELETE FROM restaurant_cuisines")
+        else:
+            conn.executemany("DELETE FROM restaurant_cuisines WHERE restaurant_id = ?", [(r[0],) for r in rows])
+        conn.executemany("INSERT OR IGNORE INTO restaurant_cuisines (restaurant_id, cuisine_id) VALUES (?, ?)", links)
+        conn.executemany("UPDATE restaurants SET cuisine_mask = ? WHERE id = ?", masks)
+    return len(masks)
+
+
+def sync_preference_masks(conn):
+    bits = cuisine_bits(conn)
+    rows = conn.execute("SELECT id, cuisine FROM preferences").fetchall()
+    with conn:
+        conn.executemany("UPDATE preferences SET cuisine_mask = ? WHERE id = ?",
+                         [(mask_for(bits, split_cuisines(cuisine)), pref_id) for pref_id, cuisine in rows])
+    return len(rows)
+
+
+if __name__ == "__main__":
+    #python cuisines.py [path/to/copy.db] -> full rebuild of the join table and every mask
+    database = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "copy.db")
+    conn = sqlite3.connect(database)
+    changed = sync_restaurant_cuisines(conn)
+    prefs = sync_preference_masks(conn)
+    count = conn.execute("SELECT count(*), count(bit) FROM cuisines").fetchone()
+    conn.close()
+    print(f"{count[0]} cuisines ({count[1]} with a bit), {changed} restaurant masks changed, {prefs} preferences updated")
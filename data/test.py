@@ -1,18 +1,21 @@
 import sqlite3
 import os
+import sys
+
+sys.path.insert(0, "..")
+sys.path.insert(0, os.path.join("..", "scripts"))
+from dedupe import clean
+from migrations import migrate
 
 DB = "copy.db"
-SEED_PATH = os.path.join("..", "seed.sql")
 
-with sqlite3.connect(DB) as conn:  # auto commits and closes connection
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    with open(SEED_PATH, "r") as f:
-        sql_script = f.read()
-    
-    cursor.executescript(sql_script)
+conn = sqlite3.connect(DB, isolation_level=None)  # clean() handles the transaction itself
+migrate(conn)  # the duplicate rule in seed.sql needs restaurants.dedup_key (migration 5)
+removed = clean(conn)  # seed.sql one rule at a time, also moves/deletes the rows that belonged to removed restaurants
+conn.close()
 
+for name, count in removed.items():
+    print(f"{name}: {count}")
 print("success")
 
 
@@ -0,0 +1,70 @@
+import os
+import queue
+import sqlite3
+
+# applied to every connection the pool opens
+PRAGMAS = {
+    "synchronous": "NORMAL",   # safe with WAL, only the checkpoint fsyncs
+    "cache_size": -20000,      # negative = KiB, so ~20MB of page cache per connection
+    "mmap_size": 268435456,    # 256MB, reads come straight from the page cache
+    "temp_store": "MEMORY",    # ORDER BY / DISTINCT temp b-trees stay off disk
+}
+
+
+class ConnectionPool:
+    """Keeps opened and configured sqlite connections around between requests.
+
+    Connections are handed out with acquire() and given back with release(),
+    anything over `size` idle connections is closed instead of kept. A pool
+    created with readonly=True opens the file with a mode=ro URI, so it can
+    never take the write lock the preferences inserts need.
+    """
+
+    def __init__(self, database, size=4, readonly=False, pragmas=PRAGMAS):
+        self.database = database
+        self.size = size
+        self.readonly = readonly
+        self.pragmas = pragmas
+        self._idle = queue.LifoQueue(maxsize=size) #LIFO so the most recently used (warmest) connection goes out first
+
+    def connect(self):
+        if self.readonly:
+            uri = f"file:{os.path.abspath(self.database)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+            #WAL is stored in the db file itself, readers and the writer stop blocking each other
+            conn.execute("PRAGMA journal_mode = WAL;")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        conn.row_factory = sqlite3.Row  # access columns by name
+        return conn
+
+    def warm_up(self):
+        #open the connections now instead of on the first requests
+        while not self._idle.full():
+            self._idle.put_nowait(self.connect())
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if conn.in_transaction: #never hand the next request a half finished transaction
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def idle(self):
+        return self._idle.qsize()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
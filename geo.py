@@ -0,0 +1,126 @@
+import math
+
+# small geometry helpers shared by the app and the scripts, good enough at Singapore's scale (no projections needed)
+
+EARTH_RADIUS_M = 6371000
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    #equirectangular approximation, within a few cm of haversine over a few km
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def geohash(lat, lon, precision=6):
+    #precision 6 is a ~1.2km x 0.6km cell, 7 is ~150m x 150m
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    ch = 0
+    even = True #geohash alternates longitude and latitude bits, starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = ch * 2 + 1
+                lon_lo = mid
+            else:
+                ch = ch * 2
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = ch * 2 + 1
+                lat_lo = mid
+            else:
+                ch = ch * 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[ch])
+            bits = ch = 0
+    return "".join(chars)
+
+
+def geohash_bbox(cell):
+    #returns (south, west, north, east) of a geohash cell
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in cell:
+        ch = BASE32.index(c)
+        for shift in range(4, -1, -1):
+            bit = (ch >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def geohash_neighbours(cell):
+    #the cell itself and the 8 cells around it, same precision
+    south, west, north, east = geohash_bbox(cell)
+    lat, lon = (south + north) / 2, (west + east) / 2
+    dlat, dlon = north - south, east - west
+    return {geohash(lat + i * dlat, lon + j * dlon, len(cell)) for i in (-1, 0, 1) for j in (-1, 0, 1)}
+
+
+def expand_bbox(bbox, margin_m):
+    #grow a (south, west, north, east) box by margin_m on every side
+    south, west, north, east = bbox
+    dlat = math.degrees(margin_m / EARTH_RADIUS_M)
+    dlon = dlat / math.cos(math.radians((south + north) / 2))
+    return south - dlat, west - dlon, north + dlat, east + dlon
+
+
+class GridIndex:
+    """Points bucketed into square cells of roughly cell_m metres.
+
+    A radius search only looks at the cells the circle overlaps, so lookups stay
+    cheap however many points are indexed (no pairwise distance loops).
+    """
+
+    def __init__(self, cell_m=100):
+        self.cell_deg = math.degrees(cell_m / EARTH_RADIUS_M)
+        self.cells = {}
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def insert(self, lat, lon, item):
+        self.cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+
+    def within(self, lat, lon, radius_m):
+        #[(distance in metres, item), ...] closest first
+        reach_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+        reach_lon = reach_lat / math.cos(math.radians(lat))
+        y0, x0 = self._cell(lat - reach_lat, lon - reach_lon)
+        y1, x1 = self._cell(lat + reach_lat, lon + reach_lon)
+        found = []
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                for p_lat, p_lon, item in self.cells.get((y, x), ()):
+                    d = distance_m(lat, lon, p_lat, p_lon)
+                    if d <= radius_m:
+                        found.append((d, item))
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def nearest(self, lat, lon, max_m):
+        #(distance, item) of the closest point within max_m, or None
+        found = self.within(lat, lon, max_m)
+        return found[0] if found else None
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# werkzeug method string, "scrypt:N:r:p" or "pbkdf2:sha256:iterations", i.e. the work factor
+# hashes stored with a different method are upgraded the next time their owner logs in
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+
+class HashingBusy(Exception):
+    """Raised when max_pending hashes are already queued or running."""
+
+
+def hash_method(pwhash):
+    #"scrypt:32768:8:1$salt$hash" -> "scrypt:32768:8:1"
+    return pwhash.split("$", 1)[0]
+
+
+def full_method(method):
+    #werkzeug fills in missing parameters and stores the full string: "scrypt" -> "scrypt:32768:8:1",
+    #"pbkdf2" -> "pbkdf2:sha256:<default iterations>", compare in that form or every login looks outdated
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        args = ["32768", "8", "1"]
+    elif name == "pbkdf2":
+        args = (args or ["sha256"])[:2]
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ":".join([name, *args])
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password, method):
+    #runs in the worker process: check, and hash again with the current method while the password is at hand
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if full_method(hash_method(pwhash)) != full_method(method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class PasswordHasher:
+    """Runs scrypt/pbkdf2 in a small process pool instead of on the request thread.
+
+    At most `max_pending` hashes are accepted at once (running or waiting for a
+    worker), a request that can't get a slot within `wait` seconds gets
+    HashingBusy instead of queueing behind a login burst. With workers=0
+    everything runs inline, which is handy for scripts and debugging.
+    """
+
+    def __init__(self, workers=2, max_pending=16, wait=2.0, method=PASSWORD_HASH_METHOD):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.wait = wait
+        self.method = method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0      # accepted and not finished yet
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.busy_seconds = 0.0
+
+    def _pool(self):
+        #created on first use, so every (forked) server worker gets its own pool
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy(f"{self.max_pending} password hashes already pending")
+        with self._lock:
+            self.pending += 1
+        started = time.perf_counter()
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._pool().submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.busy_seconds += time.perf_counter() - started
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """(matches, new_hash): new_hash is set when pwhash used an older method and should be stored instead."""
+        ok, new_hash = self._run(_verify, pwhash, password, self.method)
+        if new_hash is not None:
+            with self._lock:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self):
+        pending = self.pending
+        return {
+            "pending": pending,
+            "queue_depth": max(0, pending - self.workers) if self.workers else 0, # waiting for a free worker
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
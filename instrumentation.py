@@ -0,0 +1,197 @@
+import logging
+import re
+import threading
+import time
+
+from flask import before_render_template, g, request, template_rendered
+
+logger = logging.getLogger("sql")
+
+# where a request's time goes, per route: connect (pool acquire), query (execute/commit), fetch, render
+PHASES = ("connect", "query", "fetch", "render")
+
+
+class InstrumentedCursor:
+    #times fetchone/fetchall/iteration, everything else goes straight to the real cursor
+    __slots__ = ("_cursor", "_stats")
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._stats["fetch"] += time.perf_counter() - started
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        return self._timed(self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Proxy around a pooled sqlite3 connection that times every statement.
+
+    Statements slower than the threshold are logged together with their
+    EXPLAIN QUERY PLAN. `raw` is the real connection, which is what goes
+    back to the pool.
+    """
+
+    __slots__ = ("raw", "_stats", "_owner")
+
+    def __init__(self, raw, stats, owner):
+        self.raw = raw
+        self._stats = stats
+        self._owner = owner
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self.raw.execute(sql, params)
+        elapsed = time.perf_counter() - started
+        self._stats["query"] += elapsed
+        self._stats["statements"] += 1
+        if elapsed * 1000 >= self._owner.slow_ms:
+            self._stats["slow"] += 1
+            self._owner.log_slow(self.raw, sql, params, elapsed)
+        return InstrumentedCursor(cursor, self._stats)
+
+    def commit(self):
+        started = time.perf_counter()
+        self.raw.commit()
+        self._stats["query"] += time.perf_counter() - started
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Instrumentation:
+    """Per-route request/SQL counters, exported by metrics_text() in Prometheus format.
+
+    When disabled nothing is hooked into flask and acquire() hands out the
+    pool's connections as they are, so the only cost left is one attribute check.
+    """
+
+    def __init__(self, enabled=False, slow_ms=100):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.gauges = {} # name -> (help, label name, callable returning {label value: number} or a number)
+        self._routes = {} # route -> {"requests": n, "seconds": s, "statements": n, "slow": n, phase: s, ...}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _stats(self):
+        stats = g.get("sql_stats")
+        if stats is None:
+            stats = g.sql_stats = dict.fromkeys(PHASES, 0.0)
+            stats.update(statements=0, slow=0, started=time.perf_counter())
+        return stats
+
+    def acquire(self, pool):
+        if not self.enabled:
+            return pool.acquire()
+        stats = self._stats()
+        started = time.perf_counter()
+        conn = pool.acquire()
+        stats["connect"] += time.perf_counter() - started
+        return InstrumentedConnection(conn, stats, self)
+
+    @staticmethod
+    def unwrap(conn):
+        return conn.raw if isinstance(conn, InstrumentedConnection) else conn
+
+    def log_slow(self, conn, sql, params, elapsed):
+        statement = re.sub(r"\s+", " ", sql).strip()
+        try:
+            plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        except Exception as e: #the plan is a nice to have, never fail the request over it
+            plan = [f"(no plan: {e})"]
+        logger.warning("slow query %.1fms on %s: %s\n    %s", elapsed * 1000, request.path, statement, "\n    ".join(plan))
+
+    def _start(self):
+        self._stats()
+
+    def _render_started(self, sender, **extra):
+        g.render_started = time.perf_counter()
+
+    def _render_finished(self, sender, **extra):
+        started = g.pop("render_started", None)
+        if started is not None:
+            self._stats()["render"] += time.perf_counter() - started
+
+    def _finish(self, exc=None):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.pop("started")
+        route = request.url_rule.rule if request.url_rule is not None else "(unmatched)"
+        with self._lock:
+            totals = self._routes.get(route)
+            if totals is None:
+                totals = self._routes[route] = dict.fromkeys(PHASES, 0.0)
+                totals.update(requests=0, seconds=0.0, statements=0, slow=0)
+            totals["requests"] += 1
+            totals["seconds"] += elapsed
+            for key, value in stats.items():
+                totals[key] += value
+
+    def add_gauge(self, name, help_text, fn, label="stat"):
+        #fn() -> {label value: number}, or a plain number for an unlabelled gauge
+        self.gauges[name] = (help_text, label, fn)
+
+    def metrics_text(self):
+        with self._lock:
+            routes = {route: dict(totals) for route, totals in self._routes.items()}
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        if routes:
+            metric("http_requests_total", "counter", "Requests handled, per route.",
+                   [((("route", r),), t["requests"]) for r, t in routes.items()])
+            metric("http_request_seconds_total", "counter", "Wall time spent in requests, per route.",
+                   [((("route", r),), round(t["seconds"], 6)) for r, t in routes.items()])
+            metric("http_request_phase_seconds_total", "counter", "Time per phase (connect, query, fetch, render), per route.",
+                   [((("route", r), ("phase", p)), round(t[p], 6)) for r, t in routes.items() for p in PHASES])
+            metric("sqlite_statements_total", "counter", "SQL statements executed, per route.",
+                   [((("route", r),), t["statements"]) for r, t in routes.items()])
+            metric("sqlite_slow_statements_total", "counter", "Statements over the slow query threshold, per route.",
+                   [((("route", r),), t["slow"]) for r, t in routes.items()])
+
+        for name, (help_text, label, fn) in self.gauges.items():
+            values = fn()
+            if isinstance(values, dict):
+                samples = [(((label, k),), v) for k, v in values.items()]
+            else:
+                samples = [((), values)]
+            metric(name, "gauge", help_text, samples)
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,288 @@
+import os
+import re
+import sqlite3
+import sys
+
+#schema changes for databases that already exist, schema.sql is only used for brand new ones
+#the version that has been applied is kept in PRAGMA user_version, every step is also safe to re-run
+
+
+def table_columns(conn, table):
+    #table_xinfo also lists generated columns, which table_info leaves out
+    return [r[1] for r in conn.execute(f"PRAGMA table_xinfo({table});")] #r[1] is the column name
+
+
+def add_missing_columns(conn, table, columns):
+    #same idea as ensure_columns() in scripts/overpass.py, only ALTER when the column isn't there yet
+    cols = table_columns(conn, table)
+    if not cols: #table doesn't exist in this database
+        return
+    for name, decl in columns.items():
+        if name not in cols:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl};")
+
+
+def canonical_columns(conn):
+    #region and category used to be bolted on by assign_region.py / assign_categories.py
+    add_missing_columns(conn, "restaurants", {"region": "TEXT", "category": "TEXT"})
+    add_missing_columns(conn, "preferences", {"category": "TEXT"})
+
+
+def create_index(conn, name, table, columns):
+    if not table_columns(conn, table):
+        return
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)});")
+
+
+def recommendation_indexes(conn):
+    #recommend(): WHERE region = ? AND category = ? AND cuisine IN (...), score needs price_range
+    create_index(conn, "idx_restaurants_region_category_cuisine", "restaurants", ["region", "category", "cuisine", "price_range"])
+    #recommend(): latest preferences row, WHERE user_id = ? ORDER BY id DESC LIMIT 1
+    create_index(conn, "idx_preferences_user_id", "preferences", ["user_id", "id"])
+    #login(): users.username is UNIQUE so sqlite already keeps an index for it
+
+
+def data_version_table(conn):
+    #single row counter the enrichment scripts bump whenever they rewrite restaurants,
+    #the app compares it to drop its cached recommendations and reload the restaurant index
+    conn.execute("""CREATE TABLE IF NOT EXISTS data_version (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL DEFAULT 0)""")
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+
+def recommendation_cache_table(conn):
+    #top-N per preference combination, written by scripts/precompute_recommendations.py
+    #rows are only used while their data_version matches the current one, WITHOUT ROWID makes the key lookup one b-tree
+    conn.execute("""CREATE TABLE IF NOT EXISTS recommendation_cache (
+                        key TEXT PRIMARY KEY,
+                        data_version INTEGER NOT NULL,
+                        ids TEXT NOT NULL) WITHOUT ROWID""")
+
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+DUPLICATES_SQL = """SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY dedup_key ORDER BY id) AS rn
+                                   FROM restaurants WHERE dedup_key IS NOT NULL)
+                    WHERE rn > 1"""
+
+
+def dedup_key(name, address, postal):
+    #name|address|postal lowercased, trimmed and with every run of whitespace (tabs, newlines too) made one space,
+    #None when name or address is missing. computed here rather than in SQL, which has no regex to collapse runs
+    if name is None or address is None:
+        return None
+    name, address = (WHITESPACE_RE.sub(" ", text).strip().lower() for text in (name, address))
+    return f"{name}|{address}|{(postal or '').strip()}"
+
+
+def fill_dedup_keys(conn, everything=False):
+    #rows written without a key (anything but scripts/import_ee.py), or every row with everything=True
+    sql = "SELECT id, name, address, postal, dedup_key FROM restaurants"
+    rows = conn.execute(sql if everything else sql + " WHERE dedup_key IS NULL").fetchall()
+    keys = [(key, rest_id) for rest_id, name, address, postal, old in rows
+            if (key := dedup_key(name, address, postal)) != old]
+    conn.executemany("UPDATE restaurants SET dedup_key = ? WHERE id = ?", keys)
+    return len(keys)
+
+
+def dedup_index(conn):
+    #the unique index scripts/import_ee.py upserts on, it can only be built once no two rows share a key,
+    #removing duplicates is scripts/dedupe.py's job (it reports them and moves what belongs to them). returns whether it exists
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_restaurants_dedup_key'").fetchone():
+        return True
+    if conn.execute(f"SELECT 1 FROM ({DUPLICATES_SQL}) LIMIT 1").fetchone():
+        return False
+    conn.execute("CREATE UNIQUE INDEX idx_restaurants_dedup_key ON restaurants (dedup_key);")
+    return True
+
+
+def restaurant_dedup_key(conn):
+    #only adds and fills the key, the index follows once duplicates are gone (dedup_index), nothing is deleted here
+    if not table_columns(conn, "restaurants"):
+        return
+    add_missing_columns(conn, "restaurants", {"dedup_key": "TEXT"})
+    fill_dedup_keys(conn)
+    dedup_index(conn)
+
+
+def stored_dedup_key(conn):
+    #databases that ran the first version of migration 5 have dedup_key as a generated column computed in SQL,
+    #which only collapsed short runs of spaces. swap it for the stored column dedup_key() fills
+    generated = [r for r in conn.execute("PRAGMA table_xinfo(restaurants);") if r[1] == "dedup_key" and r[6] in (2, 3)]
+    if not generated: #r[6] is 2 for virtual and 3 for stored generated columns
+        return
+    conn.execute("DROP INDEX IF EXISTS idx_restaurants_dedup_key;")
+    conn.execute("ALTER TABLE restaurants DROP COLUMN dedup_key;")
+    restaurant_dedup_key(conn)
+
+
+def restaurant_clusters_table(conn):
+    #near-duplicate establishments found by scripts/resolve_entities.py, one row per member of a cluster of 2 or more,
+    #cluster_id is the id of the member that is shown (restaurant_id = cluster_id), the others are hidden from /recommend
+    conn.execute("""CREATE TABLE IF NOT EXISTS restaurant_clusters (
+                        restaurant_id INTEGER PRIMARY KEY,
+                        cluster_id INTEGER NOT NULL,
+                        similarity REAL)""")
+    create_index(conn, "idx_restaurant_clusters_cluster_id", "restaurant_clusters", ["cluster_id"])
+
+
+def cuisine_masks(conn):
+    #restaurants.cuisine split into cuisines / restaurant_cuisines, plus cuisine_mask on restaurants and preferences
+    #(cuisines.py), recommend() then matches cuisines with cuisine_mask & wanted != 0 instead of cuisine IN (...),
+    #which missed every multi-cuisine value like "chinese;japanese"
+    if not table_columns(conn, "restaurants"):
+        return
+    from cuisines import sync_preference_masks, sync_restaurant_cuisines
+
+    sync_restaurant_cuisines(conn)
+    if table_columns(conn, "preferences"):
+        sync_preference_masks(conn)
+    conn.execute("DROP INDEX IF EXISTS idx_restaurants_region_category_cuisine;")
+    create_index(conn, "idx_restaurants_region_category_mask", "restaurants", ["region", "category", "cuisine_mask", "price_range"])
+
+
+def cuisine_overflow(conn):
+    #migration 7 handed out bits up to 62 and left the cuisines after those out of every mask. bit 62 is now the
+    #bit they all share (cuisines.OVERFLOW_BIT), so the cuisine holding it joins them and every mask is rebuilt
+    if not table_columns(conn, "cuisines") or "bit" not in table_columns(conn, "cuisines"):
+        return
+    from cuisines import MAX_BITS, sync_preference_masks, sync_restaurant_cuisines
+
+    if conn.execute("SELECT 1 FROM cuisines WHERE bit IS NULL OR bit >= ?", (MAX_BITS,)).fetchone() is None:
+        return
+    conn.execute("UPDATE cuisines SET bit = NULL WHERE bit >= ?", (MAX_BITS,))
+    sync_restaurant_cuisines(conn)
+    if table_columns(conn, "preferences"):
+        sync_preference_masks(conn)
+
+
+def hawker_centres_table(conn):
+    #NEA hawker centres loaded by scripts/import_hawker.py, restaurants.hawker_centre_id is the centre a stall is in
+    conn.execute("""CREATE TABLE IF NOT EXISTS hawker_centres (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        object_id INTEGER UNIQUE,
+                        name TEXT NOT NULL,
+                        building_name TEXT,
+                        address TEXT,
+                        postal TEXT,
+                        status TEXT,
+                        cooked_food_stalls INTEGER,
+                        latitude REAL,
+                        longitude REAL)""")
+    add_missing_columns(conn, "restaurants", {"hawker_centre_id": "INTEGER REFERENCES hawker_centres(id)"})
+
+
+def category_columns(conn):
+    #scripts/assign_categories.py, category_name is the name the category was computed from,
+    #rows whose name hasn't changed since are skipped
+    add_missing_columns(conn, "restaurants", {"category": "TEXT", "category_name": "TEXT"})
+
+
+def pipeline_tables(conn):
+    #scripts/pipeline.py: input hashes of each row a row stage last saw, and of the last run of every table stage
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_state (
+                        stage TEXT NOT NULL,
+                        restaurant_id INTEGER NOT NULL,
+                        input_hash BLOB NOT NULL,
+                        PRIMARY KEY (stage, restaurant_id)) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_runs (
+                        stage TEXT PRIMARY KEY,
+                        input_hash BLOB NOT NULL,
+                        finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+
+
+def overpass_checkpoint_table(conn):
+    #scripts/overpass_pipeline.py, rows that matched (or didn't) are already marked osm_checked = 1, this only remembers failures
+    conn.execute("""CREATE TABLE IF NOT EXISTS overpass_checkpoint (
+                        restaurant_id INTEGER PRIMARY KEY,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+
+
+MIGRATIONS = [
+    (1, canonical_columns),
+    (2, recommendation_indexes),
+    (3, data_version_table),
+    (4, recommendation_cache_table),
+    (5, restaurant_dedup_key),
+    (6, restaurant_clusters_table),
+    (7, cuisine_masks),
+    (8, stored_dedup_key),
+    (9, cuisine_overflow),
+    (10, hawker_centres_table),
+    (11, category_columns),
+    (12, pipeline_tables),
+    (13, overpass_checkpoint_table),
+]
+
+
+def migrate(conn):
+    current = conn.execute("PRAGMA user_version;").fetchone()[0]
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {version};") #pragmas can't take ? parameters
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+# queries the routes run on every request, checked with EXPLAIN QUERY PLAN below
+HOT_QUERIES = {
+    "login: user by username": (
+        "SELECT * FROM users WHERE username = ?",
+        ("someone",)),
+    "recommend: latest preferences": (
+        "SELECT * FROM preferences WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (1,)),
+    "recommend: precomputed results": (
+        "SELECT data_version, ids FROM recommendation_cache WHERE key = ?",
+        ("Central|chinese|Restaurant|cheap",)),
+}
+
+
+def query_plan(conn, sql, params=()):
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)] #last column is the readable detail
+
+
+def full_scans(plan):
+    #"SCAN restaurants" reads every row, "SEARCH ... USING INDEX" doesn't
+    return [detail for detail in plan if detail.startswith("SCAN") and "CONSTANT ROW" not in detail]
+
+
+def check_query_plans(conn):
+    from recommender import sql_recommendations_query
+
+    queries = dict(HOT_QUERIES)
+    queries["recommend: ranked restaurants"] = sql_recommendations_query("Central", ["chinese", "japanese"], "Restaurant", "cheap")
+
+    ok = True
+    for label, (sql, params) in queries.items():
+        plan = query_plan(conn, sql, params)
+        scans = full_scans(plan)
+        print(f"{'FAIL' if scans else 'ok  '} {label}")
+        for detail in plan:
+            print(f"       {detail}")
+        if scans:
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    #python migrations.py [path/to/copy.db] [--check]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    database = args[0] if args else os.path.join("data", "copy.db")
+
+    conn = sqlite3.connect(database)
+    applied = migrate(conn)
+    print(f"Applied migrations: {applied}" if applied else "Database already up to date")
+
+    if "--check" in sys.argv:
+        passed = check_query_plans(conn)
+        conn.close()
+        sys.exit(0 if passed else 1)
+    conn.close()
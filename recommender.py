@@ -0,0 +1,364 @@
+import heapq
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from cuisines import OVERFLOW, cuisine_bits, mask_for, mask_matches, overflow_names
+from geo import EARTH_RADIUS_M, distance_m
+
+# columns kept in memory for the recommendation page, everything else stays in sqlite
+INDEX_COLUMNS = ("id", "name", "address", "postal", "region", "category", "cuisine", "price_range", "latitude", "longitude")
+
+CUISINE_MATCH_SCORE = 5  # cuisine AND category match
+BUDGET_MATCH_SCORE = 2   # price_range matches the budget
+
+GRID_CELL_DEG = 0.0025   # ~280m square cells for the "near me" search, a 1km radius touches ~64 of them
+
+
+class _Snapshot:
+    #one immutable copy of the restaurants table, swapped in whole on reload so readers never see half a load
+    __slots__ = ("ids", "columns", "masks", "bits", "postings", "by_price", "grid", "extent", "stamp")
+
+    def __init__(self, stamp):
+        self.ids = array("q")
+        self.columns = {}   # column name -> list (or array for lat/lon), one entry per row position
+        self.masks = array("q") # cuisine_mask per row position
+        self.bits = {}      # cuisine name -> bit in the masks (cuisines.bit)
+        self.postings = {}  # (region, category) -> array of row positions in id order, rows without a cuisine left out
+        self.by_price = {}  # price_range -> set of row positions
+        self.grid = {}      # (lat cell, lon cell) -> array of row positions, rows without coordinates are left out
+        self.extent = None  # (min lat cell, min lon cell, max lat cell, max lon cell) of the grid, None when it's empty
+        self.stamp = stamp  # data_version() the rows were loaded at
+
+    def row(self, pos, **extra):
+        row = {name: values[pos] for name, values in self.columns.items()}
+        row["id"] = self.ids[pos]
+        if row["latitude"] != row["latitude"]: #NaN stands in for NULL in the arrays, hand back None like sqlite would
+            row["latitude"] = row["longitude"] = None
+        row.update(extra)
+        return row
+
+
+class RestaurantIndex:
+    """In-memory copy of restaurants keyed by (region, category).
+
+    Gives the same ranking as sql_recommendations() without scanning the table:
+    the candidates are the postings whose cuisine_mask shares a bit with the
+    chosen cuisines, and the ones that also match the budget are found by
+    intersecting with the price_range set.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._snapshot = None
+        self._lock = threading.RLock() #refresh_if_stale() holds it around load(), which takes it again to swap
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def load(self):
+        columns = {name: [] for name in INDEX_COLUMNS if name not in ("id", "latitude", "longitude")}
+        columns["latitude"] = array("d")
+        columns["longitude"] = array("d")
+        intern = sys.intern
+
+        conn = sqlite3.connect(self.database)
+        try:
+            #the version is read in the same transaction as the rows, so they always belong together
+            conn.execute("BEGIN")
+            snapshot = _Snapshot(data_version(conn))
+            hidden = hidden_duplicates(conn)
+            snapshot.bits = cuisine_bits(conn)
+            cursor = conn.execute(f"SELECT {', '.join(INDEX_COLUMNS)}, cuisine_mask FROM restaurants ORDER BY id")
+            for pos, (rest_id, name, address, postal, region, category, cuisine, price_range, lat, lon, mask) in enumerate(cursor):
+                snapshot.ids.append(rest_id)
+                snapshot.masks.append(mask)
+                columns["name"].append(name)
+                columns["address"].append(address)
+                columns["postal"].append(postal)
+                #the same few labels repeat on every row, interning keeps one copy of each string
+                region = intern(region) if region else region
+                category = intern(category) if category else category
+                cuisine = intern(cuisine) if cuisine else cuisine
+                price_range = intern(price_range) if price_range else price_range
+                columns["region"].append(region)
+                columns["category"].append(category)
+                columns["cuisine"].append(cuisine)
+                columns["price_range"].append(price_range)
+                columns["latitude"].append(lat if lat is not None else float("nan"))
+                columns["longitude"].append(lon if lon is not None else float("nan"))
+                if rest_id in hidden: #another record of the same outlet is the one shown
+                    continue
+                if lat is not None and lon is not None:
+                    cell = grid_cell(lat, lon)
+                    if cell not in snapshot.grid:
+                        snapshot.grid[cell] = array("I")
+                    snapshot.grid[cell].append(pos)
+
+                #same filter as the sql: a row without any cuisine bit (NULL, 'unknown') can never be recommended
+                if not mask or region is None or category is None:
+                    continue
+                key = (region, category)
+                if key not in snapshot.postings:
+                    snapshot.postings[key] = array("I")
+                snapshot.postings[key].append(pos)
+                if price_range is not None:
+                    snapshot.by_price.setdefault(price_range, set()).add(pos)
+            conn.rollback()
+        finally:
+            conn.close()
+
+        snapshot.columns = columns
+        if snapshot.grid:
+            cells = list(snapshot.grid)
+            snapshot.extent = (min(y for y, _ in cells), min(x for _, x in cells),
+                               max(y for y, _ in cells), max(x for _, x in cells))
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def reload(self):
+        """Reload hook, call after the enrichment scripts have rewritten the database."""
+        return self.load()
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.stamp if snapshot is not None else None
+
+    def is_stale(self, version):
+        snapshot = self._snapshot
+        return snapshot is None or snapshot.stamp != version
+
+    def refresh_if_stale(self, version):
+        #version is the current data_version(), bumped by the enrichment scripts when they rewrite restaurants
+        #requests that see the new version at the same time wait for the first one's load instead of each loading
+        if self.is_stale(version):
+            with self._lock:
+                if self.is_stale(version):
+                    self.reload()
+
+    def recommend(self, region, cuisines, category, budget, limit=50):
+        return list(islice(self.iter_recommendations(region, cuisines, category, budget), limit))
+
+    def iter_recommendations(self, region, cuisines, category, budget, after=None):
+        """Yields the ranked rows one at a time, best score first, then by id.
+
+        after=(score, id) resumes right behind that row (keyset pagination),
+        so a deep page costs the same as the first one. The generator keeps
+        the snapshot it started on even if the index is reloaded meanwhile.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+
+        #one AND per row in the region/category, a "chinese;japanese" row matches either checkbox
+        wanted = mask_for(snapshot.bits, cuisines)
+        masks = snapshot.masks
+        candidates = {pos for pos in snapshot.postings.get((region, category), ()) if masks[pos] & wanted}
+        if wanted & OVERFLOW: #some of the cuisines have no bit of their own, check those rows by name
+            overflow = overflow_names(snapshot.bits, cuisines)
+            texts = snapshot.columns["cuisine"]
+            candidates = {pos for pos in candidates if mask_matches(masks[pos], wanted, overflow, texts[pos])}
+
+        #rows matching the budget score 7, the rest of the candidates score 5
+        boosted = candidates & snapshot.by_price.get(budget, set())
+        rest = candidates - boosted
+
+        for positions, score in ((boosted, CUISINE_MATCH_SCORE + BUDGET_MATCH_SCORE), (rest, CUISINE_MATCH_SCORE)):
+            start = 0
+            if after is not None:
+                after_score, after_id = after
+                if score > after_score: #whole score group was on earlier pages
+                    continue
+                if score == after_score:
+                    start = bisect_right(snapshot.ids, after_id) #positions follow ids, skip everything up to after_id
+            #row positions follow id order, so sorting positions gives the id tie-break
+            for pos in sorted(positions):
+                if pos >= start:
+                    yield snapshot.row(pos, score=score)
+
+    def rows_for(self, ranked):
+        """[(id, score), ...] -> rows, ids no longer in the table are dropped."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+        ids = snapshot.ids
+        rows = []
+        for rest_id, score in ranked:
+            pos = bisect_left(ids, rest_id) #ids are sorted, no id -> position dict needed
+            if pos < len(ids) and ids[pos] == rest_id:
+                rows.append(snapshot.row(pos, score=score))
+        return rows
+
+    def nearby(self, lat, lon, radius_m, limit=50, category=None, cuisines=None):
+        """Restaurants within radius_m metres of (lat, lon), closest first.
+
+        Only the grid cells overlapping the circle are visited, so the cost
+        depends on how many restaurants are around the point, not on the table size.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+        if snapshot.extent is None or not all(math.isfinite(v) for v in (lat, lon, radius_m)):
+            return []
+        wanted = mask_for(snapshot.bits, cuisines) if cuisines else None
+        overflow = overflow_names(snapshot.bits, cuisines) if wanted is not None and wanted & OVERFLOW else None
+        texts = snapshot.columns["cuisine"]
+        categories = snapshot.columns["category"]
+        masks = snapshot.masks
+        lats = snapshot.columns["latitude"]
+        lons = snapshot.columns["longitude"]
+
+        reach_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+        #cos(lat) goes to 0 towards the poles, half a turn of longitude either way already covers everything
+        cos_lat = math.cos(math.radians(lat))
+        reach_lon = min(180.0, reach_lat / cos_lat) if cos_lat > 0 else 180.0
+        y0, x0 = grid_cell(lat - reach_lat, lon - reach_lon)
+        y1, x1 = grid_cell(lat + reach_lat, lon + reach_lon)
+        #never loop over cells outside the ones that hold restaurants, a point far from Singapore costs nothing
+        min_y, min_x, max_y, max_x = snapshot.extent
+        y0, x0, y1, x1 = max(y0, min_y), max(x0, min_x), min(y1, max_y), min(x1, max_x)
+
+        found = []
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                for pos in snapshot.grid.get((y, x), ()):
+                    if category is not None and categories[pos] != category:
+                        continue
+                    if wanted is not None and not masks[pos] & wanted:
+                        continue
+                    if overflow is not None and not mask_matches(masks[pos], wanted, overflow, texts[pos]):
+                        continue
+                    d = distance_m(lat, lon, lats[pos], lons[pos])
+                    if d <= radius_m:
+                        found.append((d, pos))
+
+        #ties on distance fall back to id order like recommend(), positions follow ids
+        closest = heapq.nsmallest(limit, found)
+        return [snapshot.row(pos, distance=round(d, 1)) for d, pos in closest]
+
+
+def grid_cell(lat, lon):
+    return math.floor(lat / GRID_CELL_DEG), math.floor(lon / GRID_CELL_DEG)
+
+
+def data_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError: #database from before migration 3
+        return 0
+    return row[0] if row else 0
+
+
+def hidden_duplicates(conn):
+    #ids that scripts/resolve_entities.py clustered under another record of the same outlet
+    try:
+        return {r[0] for r in conn.execute("SELECT restaurant_id FROM restaurant_clusters WHERE restaurant_id != cluster_id")}
+    except sqlite3.OperationalError: #database from before migration 6
+        return set()
+
+
+def recommendation_key(region, cuisines, category, budget):
+    #same preferences in a different checkbox order or case give the same key
+    return (region, tuple(sorted({c.lower() for c in cuisines})), category, budget)
+
+
+def recommendation_key_text(key):
+    #("North", ("chinese", "thai"), "Hawker", "cheap") -> "North|chinese,thai|Hawker|cheap"
+    #scripts/precompute_recommendations.py writes recommendation_cache keys in this exact format
+    region, cuisines, category, budget = key
+    return f"{region}|{','.join(cuisines)}|{category}|{budget}"
+
+
+def precomputed_recommendations(db, key, version):
+    #[(id, score), ...] from recommendation_cache, None if the combination wasn't precomputed for this data_version
+    try:
+        row = db.execute("SELECT data_version, ids FROM recommendation_cache WHERE key = ?",
+                         (recommendation_key_text(key),)).fetchone()
+    except sqlite3.OperationalError: #database from before migration 4
+        return None
+    if row is None or row[0] != version:
+        return None
+    return json.loads(row[1])
+
+
+def sql_recommendations_query(region, cuisines, category, budget, limit=50):
+    #reference implementation the index has to agree with, ties are broken by id
+    #score >= 5 only happens when cuisine and category both match, so those go straight into WHERE
+    #and sqlite can search idx_restaurants_region_category_mask instead of scoring every row in the region,
+    #the cuisine test is one AND against the index entry's cuisine_mask, no table row is read for it,
+    #only rows with the shared overflow bit (cuisines past the first 62) are looked up in restaurant_cuisines
+    placeholders = ",".join(["?"] * len(cuisines))
+    q = f"""
+    SELECT *,
+        (5 + CASE WHEN price_range = ? THEN 2 ELSE 0 END) AS score
+    FROM restaurants
+    WHERE region = ?
+    AND category = ?
+    AND ((cuisine_mask & (SELECT coalesce(sum(1 << bit), 0) FROM cuisines WHERE name IN ({placeholders}))) != 0
+         OR (cuisine_mask & {OVERFLOW}) != 0
+            AND EXISTS (SELECT 1 FROM restaurant_cuisines rc JOIN cuisines ON cuisines.id = rc.cuisine_id
+                        WHERE rc.restaurant_id = restaurants.id AND cuisines.bit IS NULL AND cuisines.name IN ({placeholders})))
+    AND NOT EXISTS (SELECT 1 FROM restaurant_clusters c
+                    WHERE c.restaurant_id = restaurants.id AND c.cluster_id != restaurants.id)
+    ORDER BY score DESC, id
+    LIMIT ?;
+        """
+    #max score is 7, the budget match is the only part that can still change per row
+    params = [budget, region, category] + [c.lower() for c in cuisines] * 2 + [limit]
+    return q, params
+
+
+def sql_recommendations(db, region, cuisines, category, budget, limit=50):
+    q, params = sql_recommendations_query(region, cuisines, category, budget, limit)
+    return db.execute(q, params).fetchall()
+
+
+if __name__ == "__main__":
+    #parity check: python recommender.py [path/to/copy.db]
+    database = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "copy.db")
+    index = RestaurantIndex(database)
+    index.load()
+
+    conn = sqlite3.connect(database)
+    regions = [r[0] for r in conn.execute("SELECT DISTINCT region FROM restaurants WHERE region IS NOT NULL")]
+    categories = [r[0] for r in conn.execute("SELECT DISTINCT category FROM restaurants WHERE category IS NOT NULL")]
+    cuisines = [r[0] for r in conn.execute("SELECT name FROM cuisines ORDER BY bit IS NULL, bit, id")] #overflow ones last
+    #every cuisine on its own, then a few checkbox combinations
+    selections = [[c] for c in cuisines] + [cuisines[i:i + 3] for i in range(0, len(cuisines), 3)]
+    budgets = ["cheap", "medium", "expensive"]
+
+    checked = mismatches = 0
+    for region in regions:
+        for category in categories:
+            for budget in budgets:
+                for selection in selections:
+                    expected = [(r[0], r[-1]) for r in sql_recommendations(conn, region, selection, category, budget)]
+                    got = [(r["id"], r["score"]) for r in index.recommend(region, selection, category, budget)]
+                    checked += 1
+                    if expected != got:
+                        mismatches += 1
+                        print(f"mismatch for {region}/{category}/{budget}/{','.join(selection)}")
+
+                    #walking every page by (score, id) cursor has to give the full unlimited ranking
+                    expected = [(r[0], r[-1]) for r in sql_recommendations(conn, region, selection, category, budget, limit=-1)]
+                    paged, after = [], None
+                    while True:
+                        page = list(islice(index.iter_recommendations(region, selection, category, budget, after=after), 10))
+                        if not page:
+                            break
+                        paged += [(r["id"], r["score"]) for r in page]
+                        after = (page[-1]["score"], page[-1]["id"])
+                    if expected != paged:
+                        mismatches += 1
+                        print(f"paging mismatch for {region}/{category}/{budget}/{','.join(selection)}")
+    conn.close()
+    print(f"{checked} combinations checked, {mismatches} mismatches")
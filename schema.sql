@@ -26,7 +26,11 @@ CREATE TABLE IF NOT EXISTS restaurants (
     -- Classification / metadata
     type TEXT DEFAULT 'Restaurant',          -- e.g., 'Restaurant', 'Hawker Centre', 'Cafe'
     is_hawker INTEGER DEFAULT 0,             -- 0 = Restaurant, 1 = Hawker
+    hawker_centre_id INTEGER,                -- hawker centre the stall is in (scripts/import_hawker.py)
     cuisine TEXT,                            -- from GeoJSON or APIs
+    cuisine_mask INTEGER NOT NULL DEFAULT 0, -- 1 << cuisines.bit for every cuisine in it (cuisines.py)
+    category TEXT,                           -- e.g., 'Restaurant', 'Cafe', 'Hawker' (scripts/assign_categories.py)
+    region TEXT,                             -- 'North', 'South', 'East', 'West', 'Central' (scripts/assign_region.py)
     price_range TEXT,                        -- $, $$, $$$ etc.
     average_cost REAL,                       -- numerical version (optional)
     rating REAL,                             -- average rating from APIs or reviews
@@ -40,12 +44,16 @@ CREATE TABLE IF NOT EXISTS restaurants (
     latitude REAL,
     longitude REAL,
     raw_properties TEXT,                     -- store full GeoJSON properties for reference
-    osm_id TEXT;                             -- store OSM id as text
-    osm_type TEXT;                           -- 'node'|'way'|'relation'
-    osm_checked INTEGER DEFAULT 0;
+    osm_id TEXT,                             -- store OSM id as text
+    osm_type TEXT,                           -- 'node'|'way'|'relation'
+    osm_checked INTEGER DEFAULT 0,
+
+    -- Deduplication (scripts/import_ee.py upserts on it, normalized name|address|postal from migrations.dedup_key)
+    dedup_key TEXT,
 
     -- Foreign key relationships
-    FOREIGN KEY (neighborhood_id) REFERENCES neighborhoods(id)
+    FOREIGN KEY (neighborhood_id) REFERENCES neighborhoods(id),
+    FOREIGN KEY (hawker_centre_id) REFERENCES hawker_centres(id)
 );
 
 -- ===========================================================
@@ -53,7 +61,8 @@ CREATE TABLE IF NOT EXISTS restaurants (
 -- ===========================================================
 CREATE TABLE IF NOT EXISTS cuisines (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT UNIQUE
+    name TEXT UNIQUE,                        -- lowercase, one per value of restaurants.cuisine ("chinese;japanese" is two)
+    bit INTEGER UNIQUE                       -- position in cuisine_mask, 0..61, NULL once those are taken (bit 62 is shared then)
 );
 
 CREATE TABLE IF NOT EXISTS restaurant_cuisines (
@@ -137,8 +146,35 @@ CREATE TABLE IF NOT EXISTS preferences (
     budget TEXT,
     occasion TEXT,
     cuisine TEXT,
+    cuisine_mask INTEGER NOT NULL DEFAULT 0, -- same bits as restaurants.cuisine_mask
+    category TEXT,
     dietary_restrictions TEXT,
     vibe TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
-);
\ No newline at end of file
+);
+
+-- ===========================================================
+-- 9. HAWKER CENTRES (NEA dataset, scripts/import_hawker.py)
+-- ===========================================================
+CREATE TABLE IF NOT EXISTS hawker_centres (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    object_id INTEGER UNIQUE,                -- OBJECTID in the NEA dataset
+    name TEXT NOT NULL,
+    building_name TEXT,
+    address TEXT,
+    postal TEXT,
+    status TEXT,                             -- 'Existing', 'Existing (new)', 'Under Construction', ...
+    cooked_food_stalls INTEGER,
+    latitude REAL,
+    longitude REAL
+);
+
+-- ===========================================================
+-- 10. RESTAURANT CLUSTERS (near-duplicates, scripts/resolve_entities.py)
+-- ===========================================================
+CREATE TABLE IF NOT EXISTS restaurant_clusters (
+    restaurant_id INTEGER PRIMARY KEY,       -- one row per member of a cluster of 2 or more
+    cluster_id INTEGER NOT NULL,             -- id of the member that is shown, restaurant_id = cluster_id for it
+    similarity REAL                          -- name similarity of the match that joined it to the cluster
+);
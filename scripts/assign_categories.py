@@ -1,10 +1,14 @@
 import os
 import sqlite3
+import sys
+from collections import Counter
+from db_utils import bump_data_version, fetch_by_ids
+from keyword_matcher import KeywordMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # migrations.py is in the repo root
+from migrations import migrate
 
 DB_PATH = os.path.join("..","data","copy.db")
-conn = sqlite3.connect(DB_PATH)
-conn.row_factory = sqlite3.Row
-db = conn.cursor()
 
 def normalize(text):
     if not text:
@@ -93,47 +97,80 @@ CATEGORY_KEYWORDS = {
 }
 
 
+def build_category_matcher():
+    #every keyword tagged with (category, position in its list), so a keyword listed twice still counts twice like `kw in text` did
+    return KeywordMatcher(
+        (kw, (category, i))
+        for category, keywords in CATEGORY_KEYWORDS.items()
+        for i, kw in enumerate(keywords)
+    )
+
+
+CATEGORY_MATCHER = build_category_matcher() #built once, one pass over the name instead of ~150 `kw in text` checks
+
+
+def category_scores(text):
+    #number of different keywords of each category found in the (normalized) text
+    return Counter(category for category, _ in CATEGORY_MATCHER.values(text))
+
+
 def classify_category(name):
     if not name:
         return None
 
-    text = normalize(name)
+    scores = category_scores(normalize(name))
     best_category = None
     best_score = 0
 
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        score = 0
-        for kw in keywords:
-            if kw in text:
-                score += 1
-
-        # Keep highest score
-        if score > best_score:
-            best_score = score
+    for category in CATEGORY_KEYWORDS:
+        # Keep highest score, ties go to the category listed first
+        if scores[category] > best_score:
+            best_score = scores[category]
             best_category = category
-        
-        if best_category is None:
-            best_category = "Restaurant"
-
-    return best_category
-
 
-rows = db.execute("SELECT id, name FROM restaurants").fetchall()
+    if best_category is None: #no keyword at all
+        best_category = "Restaurant"
 
-for row in rows:
-    rest_id = row["id"]
-    name = row["name"]
-
-    category = classify_category(name)
-
-    if category is None:
-        continue
+    return best_category
 
-    db.execute(
-        "UPDATE restaurants SET category = ? WHERE id = ?",
-        (category, rest_id)
-    )
 
-conn.commit()
-conn.close()
-print("Completed assigning categories")
\ No newline at end of file
+def assign_categories(conn, ids=None, full=False):
+    #ids: only these rows (the pipeline's dirty rows), otherwise rows never classified or renamed since, or all with full
+    if ids is not None or full:
+        rows = fetch_by_ids(conn, "SELECT id, name, is_hawker FROM restaurants WHERE 1", ids)
+    else:
+        rows = conn.execute("""SELECT id, name, is_hawker FROM restaurants
+                               WHERE category IS NULL OR category_name IS NOT name""").fetchall()
+
+    updates = []
+    totals = Counter()
+    for rest_id, name, is_hawker in rows:
+        #stalls linked to a hawker centre by import_hawker.py are Hawker whatever their name says
+        category = "Hawker" if is_hawker else classify_category(name)
+        if category is None:
+            continue
+        updates.append((category, name, rest_id))
+        totals[category] += 1
+
+    #one transaction for every row instead of one UPDATE statement round trip each
+    with conn:
+        conn.executemany("UPDATE restaurants SET category = ?, category_name = ? WHERE id = ?", updates)
+        if updates:
+            bump_data_version(conn)
+    return len(rows), totals
+
+
+def main(full=False):
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn) #category_name (migration 11)
+    checked, totals = assign_categories(conn, full=full)
+    conn.close()
+
+    updated = sum(totals.values())
+    for category, count in totals.most_common():
+        print(f"{category}: {count}")
+    print(f"Completed assigning categories ({updated} updated, {checked - updated} without a name)")
+
+
+if __name__ == "__main__":
+    main(full="--full" in sys.argv)
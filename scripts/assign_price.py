@@ -1,10 +1,8 @@
 import sqlite3
 import os
+from db_utils import bump_data_version, fetch_by_ids
 
 DB_PATH = os.path.join("..", "data","copy.db")
-conn = sqlite3.connect(DB_PATH)
-conn.row_factory = sqlite3.Row
-db = conn.cursor()
 
 
 budget_map = {
@@ -45,50 +43,45 @@ def normalize(text):
     text = text.replace("/", " ").replace("-", " ")
     return text
 
-def main():
+def price_for(cuisine_raw):
+    #price range of the first price_map cuisine found in the cuisine text, None when there's none
+    if cuisine_raw is None:
+        return None
+    cuisine_clean = normalize(cuisine_raw)
+    for key in cuisine_budget:
+        if key in cuisine_clean:
+            return cuisine_budget[key] #get price range
+    return None
+
+def ensure_columns(conn):
     try:
-        db.execute("ALTER TABLE restaurants ADD COLUMN price_range TEXT")
+        conn.execute("ALTER TABLE restaurants ADD COLUMN price_range TEXT")
     except sqlite3.OperationalError:
         pass
-    
-    rows = db.execute("SELECT name, id, cuisine FROM restaurants").fetchall()
-    count = 0
-
-    for row in rows:
-        name = row["name"]
-        cuisine_raw = row["cuisine"]
-        restaurant_id = row["id"]
-
-        if cuisine_raw is None:
-            continue
-
-        cuisine_clean = normalize(cuisine_raw)
-        matched = None
-
-        for key in cuisine_budget:
-            if key in cuisine_clean:
-                matched = cuisine_budget[key] #get price range 
-                break
-        
-        if not matched:
-            continue 
-
-        count += 1
-
-        db.execute("UPDATE restaurants SET price_range = ? WHERE id = ?", (matched, restaurant_id))
-        print(f"{name} has been updated with a price range of {matched}")
 
-    print(f"{count} restaurants have been enriched with prices")
+def assign_prices(conn, ids=None):
+    #ids=None does every restaurant, the pipeline passes only the rows whose cuisine changed
+    #only rows that get a price are written, a price set some other way survives a cuisine with no price_map entry
+    rows = fetch_by_ids(conn, "SELECT id, cuisine, price_range FROM restaurants WHERE 1", ids)
+    updates = []
+    for restaurant_id, cuisine_raw, current in rows:
+        matched = price_for(cuisine_raw)
+        if matched is not None and matched != current:
+            updates.append((matched, restaurant_id))
+
+    with conn:
+        conn.executemany("UPDATE restaurants SET price_range = ? WHERE id = ?", updates)
+        if updates:
+            bump_data_version(conn)
+    return len(rows), len(updates)
 
-    conn.commit()
+def main():
+    conn = sqlite3.connect(DB_PATH)
+    ensure_columns(conn)
+    checked, updated = assign_prices(conn)
     conn.close()
+    print(f"{updated} of {checked} restaurants have been enriched with prices")
 
 
 if __name__ == "__main__":
     main()
-
-       
-
-
-
-
@@ -1,10 +1,10 @@
+import argparse
 import sqlite3
 import os
+import numpy as np
+from db_utils import bump_data_version, fetch_by_ids
 
 DB_path = os.path.join("..","data","copy.db")
-conn = sqlite3.connect(DB_path)
-conn.row_factory = sqlite3.Row
-db = conn.cursor()
 
 SG_BOUND = {
     "lat_min": 1.13,
@@ -32,24 +32,97 @@ def assign_region(lat,lon):
     
     return "Unknown"
 
-def main():
-    try:
-        db.execute("ALTER TABLE restaurants ADD COLUMN region TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    rows = db.execute("SELECT id, latitude, longitude FROM restaurants").fetchall()
-    for row in rows:    
-        id = row["id"]
-        lat = row["latitude"]
-        lon = row["longitude"]
-        region = assign_region(lat, lon)
-        db.execute("UPDATE restaurants SET region = ? WHERE id = ?", (region, id))
-        conn.commit()
-    print("Region assigning complete")
+def assign_regions(lats, lons):
+    #vectorized assign_region() for whole columns at once, NULL coordinates come out as "Unknown"
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    regions = np.full(len(lats), "Unknown", dtype=object)
+
+    def inside(bound):
+        return (bound["lat_min"] <= lats) & (lats <= bound["lat_max"]) & (bound["lon_min"] <= lons) & (lons <= bound["lon_max"])
+
+    regions[inside(SG_BOUND)] = "Singapore"
+    #the boxes overlap and assign_region() returns the first one that matches,
+    #so paint them last to first and let the earlier boxes overwrite the later ones
+    for region, bound in reversed(list(REGION_BOXES.items())):
+        regions[inside(bound)] = region
+    return regions
+
+
+def dashboard_region(label):
+    #polygon label -> the dashboard's region name, "CENTRAL REGION" (URA's REGION_N) -> "Central"
+    #None for labels the dashboard has no choice for, e.g. "NORTH-EAST REGION"
+    name = str(label).strip().upper()
+    if name.endswith(" REGION"):
+        name = name[:-len(" REGION")]
+    return {region.upper(): region for region in REGION_BOXES}.get(name)
+
+
+def load_region_polygons(path, label_property):
+    #load_polygons() with the labels mapped to dashboard regions, a region no preference can ask for is never written
+    #polygons with other labels are left out and their points fall back to the boxes
+    from polygon_index import load_polygons
+
+    polygons, skipped = [], set()
+    for label, rings in load_polygons(path, label_property):
+        region = dashboard_region(label)
+        if region is None:
+            skipped.add(label)
+        else:
+            polygons.append((region, rings))
+    if skipped:
+        print(f"Ignoring polygons labelled {', '.join(sorted(map(str, skipped)))}: not a dashboard region, the boxes cover them")
+    if not polygons:
+        raise SystemExit(f"No {label_property} label in {path} is one of {', '.join(REGION_BOXES)}")
+    return polygons
+
+
+def ensure_columns(conn):
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(restaurants);")]
+    if "region" not in cols:
+        conn.execute("ALTER TABLE restaurants ADD COLUMN region TEXT")
+
+
+def assign_region_rows(conn, ids=None, polygon_index=None):
+    #ids=None does every restaurant, the pipeline passes only the rows whose coordinates changed
+    rows = fetch_by_ids(conn, "SELECT id, latitude, longitude, region FROM restaurants WHERE 1", ids)
+    ids = [r[0] for r in rows]
+    lats = np.array([r[1] for r in rows], dtype=float) #None becomes NaN
+    lons = np.array([r[2] for r in rows], dtype=float)
+
+    regions = assign_regions(lats, lons)
+    if polygon_index is not None:
+        #real boundaries where we have them, the boxes are only the fallback for points outside every polygon
+        labels = polygon_index.lookup(lats, lons)
+        found = np.array([label is not None for label in labels], dtype=bool)
+        regions[found] = labels[found]
+        print(f"{int(found.sum())} of {len(rows)} restaurants found in a polygon")
+
+    #only rows whose region actually changes are written, all in one transaction
+    updates = [(region, rest_id) for rest_id, region, row in zip(ids, regions, rows) if region != row[3]]
+    with conn:
+        conn.executemany("UPDATE restaurants SET region = ? WHERE id = ?", updates)
+        if updates:
+            bump_data_version(conn)
+    return len(rows), len(updates)
+
+
+def main(polygons_path=None, label_property=None):
+    conn = sqlite3.connect(DB_path)
+    ensure_columns(conn)
+    polygon_index = None
+    if polygons_path:
+        from polygon_index import PolygonIndex
+        polygon_index = PolygonIndex(load_region_polygons(polygons_path, label_property))
+    checked, changed = assign_region_rows(conn, polygon_index=polygon_index)
     conn.close()
+    print(f"Region assigning complete ({changed} of {checked} restaurants changed)")
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Assign a region to every restaurant")
+    parser.add_argument("--polygons", help="GeoJSON of boundaries to use instead of the boxes, e.g. URA planning areas")
+    parser.add_argument("--property", default="REGION_N", help="feature property holding the region name")
+    args = parser.parse_args()
+    main(args.polygons, args.property)
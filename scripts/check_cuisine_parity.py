@@ -0,0 +1,60 @@
+#checks the precompiled infer_cuisine_from_name() against the original keyword loops, over every name in restaurants
+#python check_cuisine_parity.py [path/to/copy.db]
+
+import re, sqlite3, sys, time
+
+from overpass import DB, MULTI_WORD_KEYWORDS, SINGLE_WORD_KEYWORDS, infer_cuisines
+
+
+def reference_infer_cuisine(name):
+    #the original implementation, one re.search per keyword
+    name_lower = name.lower()
+
+    for cuisine, phrases in MULTI_WORD_KEYWORDS.items():
+        for phrase in phrases:
+            if phrase in name_lower:
+                return cuisine
+
+    for cuisine, words in SINGLE_WORD_KEYWORDS.items():
+        for word in words:
+            pattern = r'(?<!\w)' + re.escape(word) + r'(?!\w)'
+            if re.search(pattern, name_lower):
+                return cuisine
+
+    for cuisine, words in SINGLE_WORD_KEYWORDS.items():
+        if any(word in name_lower for word in words):
+            return cuisine
+
+    return "unknown"
+
+
+#edge cases on top of the real names: overlapping keywords, word boundaries, punctuation
+EXTRA_NAMES = [
+    "", "Hamburger Hut", "The Burger Co", "Burger_King", "ramenya", "Chicken Rice Kopitiam", "Toast Box",
+    "toast boxkopi", "Din Tai Fung", "Pizza Hut", "Stuff'd", "STUFF'D", "Pho-Hanoi", "Korean Hotpot",
+    "Mr. Coconut", "Teh Tarik Cafe", "Kopi & Toast", "Nasi Lemak Ayam Goreng", "Café Kaya", "curry-puff",
+]
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB
+    conn = sqlite3.connect(db_path)
+    names = [r[0] for r in conn.execute("SELECT name FROM restaurants WHERE name IS NOT NULL")]
+    conn.close()
+    names += EXTRA_NAMES
+
+    started = time.perf_counter()
+    expected = [reference_infer_cuisine(name) for name in names]
+    reference_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    got = infer_cuisines(names)
+    matcher_time = time.perf_counter() - started
+
+    mismatches = [(name, e, g) for name, e, g in zip(names, expected, got) if e != g]
+    for name, e, g in mismatches[:20]:
+        print(f"mismatch: {name!r} expected {e}, got {g}")
+
+    print(f"{len(names)} names, {len(mismatches)} mismatches")
+    print(f"reference {reference_time:.3f}s, matcher {matcher_time:.3f}s")
+    sys.exit(1 if mismatches else 0)
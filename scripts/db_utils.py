@@ -0,0 +1,38 @@
+# helpers shared by the enrichment scripts
+
+import os, sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+
+
+def bump_data_version(conn):
+    #tells the running app that restaurants changed, it drops its cached recommendations and reloads its index
+    #the table is normally created by migrations.py, IF NOT EXISTS covers databases that were never migrated
+    conn.execute("""CREATE TABLE IF NOT EXISTS data_version (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL DEFAULT 0)""")
+    conn.execute("""INSERT INTO data_version (id, version) VALUES (1, 1)
+                    ON CONFLICT(id) DO UPDATE SET version = version + 1""")
+
+
+def sync_cuisines(conn, ids):
+    #restaurants.cuisine was rewritten for these rows, keeps restaurant_cuisines and cuisine_mask in step with it
+    #(cuisines.py sits in the repo root next to migrations.py), returns how many masks changed
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    from cuisines import sync_restaurant_cuisines
+    return sync_restaurant_cuisines(conn, ids)
+
+
+def fetch_by_ids(conn, select_sql, ids, chunk_size=500, params=()):
+    #select_sql ends with a WHERE clause it can extend, e.g. "SELECT id, cuisine FROM restaurants WHERE 1"
+    #params are select_sql's own placeholders, they go before the ids
+    #ids=None means every row, otherwise the ids go in chunks that stay under sqlite's bound variable limit
+    if ids is None:
+        return conn.execute(select_sql, params).fetchall()
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows += conn.execute(f"{select_sql} AND id IN ({','.join('?' * len(chunk))})", [*params, *chunk]).fetchall()
+    return rows
@@ -0,0 +1,114 @@
+#runs the cleanup rules in seed.sql one at a time and reports how many restaurants each one removed,
+#rows of other tables that belonged to them are moved to the duplicate that is kept or deleted in the same transaction
+#python dedupe.py [--db path/to/copy.db] [--dry-run]
+
+import argparse, os, re, sqlite3, sys, time
+
+from db_utils import bump_data_version
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+sys.path.insert(0, BASE_DIR)
+
+from migrations import dedup_index, fill_dedup_keys, migrate, table_columns
+
+DB_PATH = os.path.join(BASE_DIR, "data", "copy.db")
+SEED_PATH = os.path.join(BASE_DIR, "seed.sql")
+
+RULE_RE = re.compile(r"^-- rule: (.+)$", re.M)
+
+# tables with rows that belong to a restaurant. what users wrote moves to the copy of a duplicate that is kept,
+# the rest is derived (by cuisines.py, resolve_entities.py, the pipeline and overpass_pipeline.py) and is just dropped
+MOVED_TABLES = ("reviews", "menu_items", "recommended_items", "restaurant_vibes")
+DROPPED_TABLES = ("restaurant_cuisines", "pipeline_state", "overpass_checkpoint")
+
+
+def load_rules(path=SEED_PATH):
+    #[(rule name, DELETE statement)] in file order, the file's header comments are skipped
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    parts = RULE_RE.split(text)[1:] #[name, sql, name, sql, ...]
+    return [(name.strip(), sql.strip()) for name, sql in zip(parts[::2], parts[1::2])]
+
+
+def snapshot_duplicates(conn):
+    #id and key of every row sharing its key with another, taken before the rules run so removed rows can be followed
+    conn.execute("DROP TABLE IF EXISTS temp.duplicate_rows")
+    conn.execute("""CREATE TEMP TABLE duplicate_rows AS
+                        SELECT id, dedup_key FROM restaurants
+                        WHERE dedup_key IN (SELECT dedup_key FROM restaurants GROUP BY dedup_key HAVING count(*) > 1)""")
+
+
+def remove_dependents(conn):
+    #rows of MOVED_TABLES are repointed from a removed duplicate to the row kept for its key,
+    #everything else that refers to a removed restaurant is deleted
+    conn.execute("DROP TABLE IF EXISTS temp.moved_rows")
+    conn.execute("""CREATE TEMP TABLE moved_rows AS
+                        SELECT gone.id AS old_id, kept.id AS new_id
+                        FROM duplicate_rows AS gone JOIN restaurants AS kept ON kept.dedup_key = gone.dedup_key
+                        WHERE gone.id NOT IN (SELECT id FROM restaurants)""")
+    for table in MOVED_TABLES:
+        if table_columns(conn, table):
+            #OR IGNORE: a restaurant_vibes row the kept restaurant already has stays behind and is deleted below
+            conn.execute(f"""UPDATE OR IGNORE {table}
+                             SET restaurant_id = (SELECT new_id FROM moved_rows WHERE old_id = {table}.restaurant_id)
+                             WHERE restaurant_id IN (SELECT old_id FROM moved_rows)""")
+    for table in MOVED_TABLES + DROPPED_TABLES:
+        if table_columns(conn, table):
+            conn.execute(f"DELETE FROM {table} WHERE restaurant_id NOT IN (SELECT id FROM restaurants)")
+    if table_columns(conn, "restaurant_clusters"):
+        #a cluster that lost a member is found again by resolve_entities.py
+        conn.execute("""DELETE FROM restaurant_clusters
+                        WHERE cluster_id IN (SELECT cluster_id FROM restaurant_clusters
+                                             WHERE restaurant_id NOT IN (SELECT id FROM restaurants)
+                                                OR cluster_id NOT IN (SELECT id FROM restaurants))""")
+    if table_columns(conn, "recommendation_cache"):
+        conn.execute("DELETE FROM recommendation_cache") #its id lists may name removed restaurants
+    conn.execute("DROP TABLE temp.moved_rows")
+
+
+def clean(conn, rules=None, dry_run=False):
+    #{rule name: rows removed}, every rule in one transaction (rolled back again with dry_run)
+    #together with what belonged to the removed rows and, once no duplicates are left, the unique dedup_key index
+    rules = load_rules() if rules is None else rules
+    removed = {}
+    conn.execute("BEGIN")
+    try:
+        #with foreign keys on (schema.sql's connection) the rows pointing at removed restaurants are only fixed after the rules
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        fill_dedup_keys(conn) #rows some other script inserted without a key
+        snapshot_duplicates(conn)
+        for name, sql in rules:
+            removed[name] = conn.execute(sql).rowcount
+        if any(removed.values()):
+            remove_dependents(conn)
+        conn.execute("DROP TABLE temp.duplicate_rows")
+        dedup_index(conn)
+        if dry_run:
+            conn.rollback()
+        else:
+            if any(removed.values()):
+                bump_data_version(conn)
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove unusable and duplicate restaurants, with counts per rule")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="only count, delete nothing")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None) #transactions are handled by clean()
+    migrate(conn) #the duplicate rule needs restaurants.dedup_key
+    started = time.perf_counter()
+    removed = clean(conn, dry_run=args.dry_run)
+    remaining = conn.execute("SELECT count(*) FROM restaurants").fetchone()[0]
+    conn.close()
+
+    for name, count in removed.items():
+        print(f"{name}: {count}")
+    verb = "would be removed" if args.dry_run else "removed"
+    print(f"{sum(removed.values())} restaurants {verb} in {time.perf_counter() - started:.2f}s, {remaining} left")
@@ -0,0 +1,84 @@
+#local stand-in for overpass-api.de so the enrichment scripts can be run without touching the real API
+#answers "around:" and bbox queries with the restaurants from a database, and can be told to fail/slow down like the real one
+#python fake_overpass.py --db ../data/copy.db --error-rate 0.2
+#OVERPASS_URL=http://127.0.0.1:8765/api/interpreter python overpass_pipeline.py 500
+
+import argparse, json, os, random, re, sqlite3, sys, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # geo.py is in the repo root, shared with the app
+from geo import distance_m
+
+AROUND = re.compile(r"around:\s*([\d.]+),\s*([-\d.]+),\s*([-\d.]+)")
+BBOX = re.compile(r"node\(\s*([-\d.]+),\s*([-\d.]+),\s*([-\d.]+),\s*([-\d.]+)\)")
+
+
+def load_places(db_path):
+    conn = sqlite3.connect(db_path)
+    places = conn.execute("""SELECT id, name, latitude, longitude FROM restaurants
+                             WHERE latitude IS NOT NULL AND longitude IS NOT NULL""").fetchall()
+    conn.close()
+    return places
+
+
+def element(place_id, name, lat, lon):
+    return {"type": "node", "id": place_id, "lat": lat, "lon": lon,
+            "tags": {"amenity": "restaurant", "name": name, "cuisine": random.choice(["chinese", "japanese", "local", ""])}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        query = parse_qs(body).get("data", [""])[0]
+        server.hits += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            self.send_response(random.choice([429, 504]))
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+
+        elements = []
+        m = AROUND.search(query)
+        b = BBOX.search(query)
+        if m:
+            radius, lat, lon = float(m.group(1)), float(m.group(2)), float(m.group(3))
+            elements = [element(*p) for p in server.places if distance_m(lat, lon, p[2], p[3]) <= radius]
+        elif b:
+            south, west, north, east = (float(v) for v in b.groups())
+            elements = [element(*p) for p in server.places if south <= p[2] <= north and west <= p[3] <= east]
+
+        payload = json.dumps({"elements": elements}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass #keep the terminal quiet, the hit counter is printed on exit
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Overpass API for local testing")
+    parser.add_argument("--db", default=os.path.join("..", "data", "copy.db"), help="restaurants to answer with")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429/504")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    server.places = load_places(args.db)
+    server.error_rate = args.error_rate
+    server.latency = args.latency
+    server.hits = 0
+    print(f"Fake Overpass with {len(server.places)} places on http://127.0.0.1:{args.port}/api/interpreter")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"{server.hits} requests served")
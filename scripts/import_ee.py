@@ -1,44 +1,116 @@
 import sqlite3
 import json
 import os
-from bs4 import BeautifulSoup
+import re
+import sys
+import time
+from html import unescape
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+sys.path.insert(0, BASE_DIR)
+
+from migrations import dedup_index, dedup_key
 
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # one level up from /scripts/
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 DB_PATH = os.path.join(DATA_DIR, "restaurants.db")
 EATING_PATH = os.path.join(DATA_DIR, "eatingestablishments.geojson")
-HAWKER_PATH = os.path.join(DATA_DIR, "hawker_centers.geojson")
 
-# Connect to database
-conn = sqlite3.connect(DB_PATH)
-db = conn.cursor()
+CHUNK_SIZE = 5000          # rows per executemany
+PROGRESS_EVERY = 10000     # features between progress lines
+READ_SIZE = 1 << 16        # bytes read from the file at a time
 
-# Load each GeoJSON
-with open(EATING_PATH, "r", encoding="utf-8") as f:
-    eating_data = json.load(f)
+INSERT_SQL = """INSERT INTO restaurants (name, license_name, address, unit_no, level, postal, longitude, latitude, dedup_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
 
-with open(HAWKER_PATH, "r", encoding="utf-8") as f:
-    hawker_data = json.load(f)
+#re-importing the export updates the establishments we already have (same dedup_key, see migrations.py) instead of
+#adding a duplicate of each, and leaves rows whose licence, unit and position are unchanged untouched
+UPSERT_SQL = INSERT_SQL + """
+                ON CONFLICT(dedup_key) DO UPDATE SET
+                    license_name = excluded.license_name, unit_no = excluded.unit_no, level = excluded.level,
+                    longitude = excluded.longitude, latitude = excluded.latitude
+                WHERE license_name IS NOT excluded.license_name OR unit_no IS NOT excluded.unit_no
+                   OR level IS NOT excluded.level OR longitude IS NOT excluded.longitude
+                   OR latitude IS NOT excluded.latitude"""
+
+# the Description is a small HTML table, one <tr><th>KEY</th><td>VALUE</td></tr> per attribute
+ROW_RE = re.compile(r"<tr\b[^>]*>(.*?)</tr>", re.S | re.I)
+TH_RE = re.compile(r"<th\b[^>]*>(.*?)</th>", re.S | re.I)
+TD_RE = re.compile(r"<td\b[^>]*>(.*?)</td>", re.S | re.I)
+TAG_RE = re.compile(r"<[^>]+>")
 
-for feature in eating_data["features"]: #for each restaurant
-    props = feature["properties"] #incudes name, address, postal code, type of cuisine
-    geom = feature.get("geometry", {}) #includes coordinates
-    coords = geom.get("coordinates", [None,None])  # [longitude, latitude]
-    description = props.get("Description", "")
 
-    # Clean HTML tags from description
-    soup = BeautifulSoup(description, "html.parser")
+def cell_text(html):
+    #same as BeautifulSoup's get_text(strip=True) for these cells: drop tags, decode &amp; etc, trim
+    return unescape(TAG_RE.sub("", html)).strip()
+
+
+def parse_description(description):
     attributes = {}
+    for row in ROW_RE.findall(description or ""): #all possible rows for ONE restaurant
+        headers = TH_RE.findall(row)
+        cols = TD_RE.findall(row)
+        if len(headers) == 1 and len(cols) == 1: #filters out the ATTRIBUTE tr as it has no tds, filters out malformed rows that has 2 tds
+            attributes[cell_text(headers[0])] = cell_text(cols[0])
+    return attributes
+
+
+def iter_features(path):
+    #yields one feature at a time instead of json.load-ing the whole file
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
 
-    rows = soup.find_all("tr") #all possible rows for ONE restaurant
-    for row in rows: #for each row in that ONE restaurant's description like LIC_NAME, BLK_HOUSE etc
-        headers = row.find_all("th")
-        cols = row.find_all("td")
-        if len(headers) == 1 and len(cols) ==1: #filters out the ATTRIBUTE tr as it has no tds, filters out malformed rows that has 2 tds
-            key = headers[0].get_text(strip=True) #strip = TRUE removes leading/trailing whitespace
-            value = cols[0].get_text(strip=True)
-            attributes[key] = value #assign key-value pairs to attributes dict
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "features.item", use_float=True)
+        return
+
+    #no ijson: find the "features" array and raw_decode one object at a time from a rolling buffer
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = -1
+        while pos < 0:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                return
+            buf += chunk
+            m = re.search(r'"features"\s*:\s*\[', buf)
+            if m:
+                pos = m.end()
+        buf = buf[pos:]
+        pos = 0
+        eof = False
+        while True:
+            #skip the whitespace and commas between features
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                feature, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_SIZE)
+                eof = not chunk
+                buf = buf[pos:] + chunk #feature cut off by the chunk boundary, read more and retry
+                pos = 0
+                continue
+            yield feature
+            pos = end
+            if pos > READ_SIZE: #drop what has been parsed so the buffer stays small
+                buf = buf[pos:]
+                pos = 0
+
+
+def feature_row(feature):
+    props = feature["properties"] #incudes name, address, postal code, type of cuisine
+    geom = feature.get("geometry") or {} #includes coordinates
+    coords = geom.get("coordinates", [None, None])  # [longitude, latitude]
+    attributes = parse_description(props.get("Description", ""))
 
     name = attributes.get("BUSINESS_NAME", "N.A")
     license_name = attributes.get("LIC_NAME", "N.A")
@@ -54,14 +126,43 @@ for feature in eating_data["features"]: #for each restaurant
     postal = attributes.get("POSTCODE", "N.A")
     longitude = coords[0]
     latitude = coords[1]
+    return (name, license_name, address, unit_no, level, postal, longitude, latitude)
+
+
+def keyed(row):
+    #feature_row() plus its dedup_key, the last INSERT_SQL / UPSERT_SQL parameter
+    return (*row, dedup_key(row[0], row[2], row[5]))
+
 
-    db.execute("INSERT INTO restaurants (name, license_name, address, unit_no, level, postal, longitude, latitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-               (name, license_name, address, unit_no, level, postal, longitude, latitude))
-    
-conn.commit()
+def import_establishments(conn, path=EATING_PATH, chunk_size=CHUNK_SIZE, progress_every=PROGRESS_EVERY):
+    started = time.perf_counter()
+    count = 0
+    batch = []
+    #until scripts/dedupe.py has removed the duplicates already in the table there is no unique index to upsert on,
+    #plain inserts then, the seed stage removes the new duplicates with the old ones
+    sql = UPSERT_SQL if dedup_index(conn) else INSERT_SQL
+    with conn: #one transaction for the whole file, rolled back if anything fails half way
+        for feature in iter_features(path):
+            batch.append(keyed(feature_row(feature)))
+            count += 1
+            if len(batch) >= chunk_size:
+                conn.executemany(sql, batch)
+                batch.clear()
+            if progress_every and count % progress_every == 0:
+                print(f"{count} establishments imported ({count / (time.perf_counter() - started):.0f}/s)")
+        if batch:
+            conn.executemany(sql, batch)
+    return count
 
 
-print("Imported eating establishments.")
+if __name__ == "__main__":
+    from migrations import migrate
 
-    
-        
+    path = sys.argv[1] if len(sys.argv) > 1 else EATING_PATH
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn) #the upsert needs restaurants.dedup_key
+    before = conn.total_changes
+    count = import_establishments(conn, path)
+    changed = conn.total_changes - before
+    conn.close()
+    print(f"Imported {count} eating establishments ({changed} new or updated).")
@@ -0,0 +1,98 @@
+#loads the NEA hawker centres and links every establishment inside one to it
+#a stall belongs to a centre when it shares the centre's postal code, otherwise when it is within MAX_DISTANCE_M of it
+#python import_hawker.py [--db path/to/copy.db] [--max-distance 80]
+
+import argparse, json, os, sqlite3, sys
+
+from db_utils import bump_data_version, fetch_by_ids
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # geo.py is in the repo root, shared with the app
+from geo import GridIndex
+from migrations import migrate
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+DB_PATH = os.path.join(DATA_DIR, "copy.db")
+HAWKER_PATH = os.path.join(DATA_DIR, "hawker_centers.geojson")
+
+MAX_DISTANCE_M = 80   # a hawker centre building is roughly this far from its centre point to the furthest stall
+CELL_M = 100          # grid cell size for the nearest centre search
+
+
+def centre_row(feature):
+    props = feature["properties"]
+    lon, lat = feature["geometry"]["coordinates"][:2]
+    address = " ".join(part for part in [props.get("ADDRESSBLOCKHOUSENUMBER"), props.get("ADDRESSSTREETNAME")] if part)
+    return (props.get("OBJECTID"), props.get("NAME"), props.get("ADDRESSBUILDINGNAME"), address,
+            props.get("ADDRESSPOSTALCODE"), props.get("STATUS"), props.get("NUMBER_OF_COOKED_FOOD_STALLS"), lat, lon)
+
+
+def import_centres(conn, path=HAWKER_PATH):
+    with open(path, "r", encoding="utf-8") as f: #small file (~130 centres), no need to stream it
+        features = json.load(f)["features"]
+    rows = [centre_row(feature) for feature in features]
+    with conn:
+        conn.executemany("""INSERT INTO hawker_centres (object_id, name, building_name, address, postal, status,
+                                                        cooked_food_stalls, latitude, longitude)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(object_id) DO UPDATE SET
+                                name = excluded.name, building_name = excluded.building_name,
+                                address = excluded.address, postal = excluded.postal, status = excluded.status,
+                                cooked_food_stalls = excluded.cooked_food_stalls,
+                                latitude = excluded.latitude, longitude = excluded.longitude""", rows)
+    return len(rows)
+
+
+def link_establishments(conn, max_distance=MAX_DISTANCE_M, ids=None):
+    #ids=None relinks every restaurant, the pipeline passes only rows whose postal code or coordinates changed
+    #a centre without a status in the dataset is taken to be open, only the ones still being built are left out
+    centres = conn.execute("""SELECT id, postal, latitude, longitude FROM hawker_centres
+                              WHERE (status IS NULL OR status != 'Under Construction') AND latitude IS NOT NULL""").fetchall()
+    by_postal = {postal: centre_id for centre_id, postal, _, _ in centres if postal}
+    grid = GridIndex(CELL_M)
+    for centre_id, _, lat, lon in centres:
+        grid.insert(lat, lon, centre_id)
+
+    links = []
+    by_postal_count = 0
+    rows = fetch_by_ids(conn, "SELECT id, postal, latitude, longitude, hawker_centre_id FROM restaurants WHERE 1", ids)
+    for rest_id, postal, lat, lon, _ in rows:
+        centre_id = by_postal.get(postal)
+        if centre_id is not None:
+            by_postal_count += 1
+        elif lat is not None and lon is not None:
+            nearest = grid.nearest(lat, lon, max_distance)
+            centre_id = nearest[1] if nearest else None
+        if centre_id is not None:
+            links.append((centre_id, rest_id))
+
+    #recompute the flags from scratch in one transaction, stalls that moved out lose them again
+    #(category goes back to NULL so assign_categories.py classifies them by name on its next run)
+    reset = "UPDATE restaurants SET is_hawker = 0, type = 'Restaurant', category = NULL, hawker_centre_id = NULL"
+    with conn:
+        if ids is None:
+            conn.execute(reset + " WHERE hawker_centre_id IS NOT NULL")
+        else:
+            conn.executemany(reset + " WHERE id = ?", [(r[0],) for r in rows if r[4] is not None])
+        conn.executemany("""UPDATE restaurants SET is_hawker = 1, type = 'Hawker Centre', category = 'Hawker',
+                                                   hawker_centre_id = ?
+                            WHERE id = ?""", links)
+        bump_data_version(conn)
+    return len(links), by_postal_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import hawker centres and flag the establishments inside them")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--geojson", default=HAWKER_PATH)
+    parser.add_argument("--max-distance", type=float, default=MAX_DISTANCE_M, help="metres from a centre's point")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrate(conn) #hawker_centres and restaurants.hawker_centre_id are migration 10
+    count = import_centres(conn, args.geojson)
+    print(f"Imported {count} hawker centres")
+    linked, by_postal = link_establishments(conn, args.max_distance)
+    conn.close()
+    print(f"{linked} establishments linked to a hawker centre ({by_postal} by postal code, {linked - by_postal} by distance)")
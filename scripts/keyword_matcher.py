@@ -0,0 +1,76 @@
+from collections import deque
+
+# Aho-Corasick automaton: finds every keyword occurring in a text in one pass over the text,
+# instead of one `kw in text` / re.search per keyword. Built once, then reused for every name.
+
+
+class KeywordMatcher:
+    def __init__(self, keywords=()):
+        #keywords: iterable of (keyword, value), the same keyword may be given several values
+        self._goto = [{}]     # state -> {char: next state}
+        self._fail = [0]      # state -> longest proper suffix state
+        self._out = [[]]      # state -> [(keyword length, value), ...] ending at this state
+        self._built = False
+        for keyword, value in keywords:
+            self.add(keyword, value)
+        self.build()
+
+    def add(self, keyword, value):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(keyword), value))
+        self._built = False
+
+    def build(self):
+        #breadth first, so a state's fail link is always finished before its children need it
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text):
+        #yields (start, end, value) for every occurrence, overlapping ones included
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in out[state]:
+                yield i - length + 1, i + 1, value
+
+    def values(self, text):
+        #set of the values of every keyword found in text
+        return {value for _, _, value in self.iter_matches(text)}
+
+
+def is_word_char(ch):
+    #same as \w in a python regex on a str
+    return ch.isalnum() or ch == "_"
+
+
+def standalone(text, start, end):
+    #same as wrapping the keyword in (?<!\w) ... (?!\w)
+    return (start == 0 or not is_word_char(text[start - 1])) and (end == len(text) or not is_word_char(text[end]))
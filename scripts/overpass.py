@@ -2,61 +2,92 @@
 #way --> collection of nodes, ie restaurants that are in a single building 
 #relation --> can group ways/nodes, ie restaurants in food court etc 
 
-import requests, sqlite3, time, json, math, sys, os, re
+import requests, sqlite3, time, json, sys, os, threading
 from typing import Optional
 from difflib import SequenceMatcher
+from functools import lru_cache
+from db_utils import bump_data_version, sync_cuisines
+from overpass_cache import ResponseCache
+from keyword_matcher import KeywordMatcher, standalone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # geo.py is in the repo root, shared with the app
+from geo import distance_m
 
 DB = os.path.join("..", "data", "copy.db")
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+OVERPASS_URL = os.environ.get("OVERPASS_URL", "https://overpass-api.de/api/interpreter") #point at a local fake server for testing
 RADIUS_METERS = 75
 BATCH_SIZE = 200
 SLEEP_BETWEEN_REQUESTS = 2.5
 
+response_cache = None #a ResponseCache from overpass_cache.py, post_query() answers from it when set
+
+MULTI_WORD_KEYWORDS = {
+    "hawker": ["food court", "kopitiam", "canteen", "chicken rice", "mee hoon", "ban mian"],
+    "local": ["koufu","kueh", "toast box", "kopi","toastbox", "toast box" "kopi", "teh tarik", "kaya toast", "prata", "chicken rice"],
+    "bubble_tea": ["liho","koi","mixue","hitea","chi cha","playmade","cup"]
+}
+
+SINGLE_WORD_KEYWORDS = {
+    "japanese": ["ramen", "sushi", "japan", "donburi", "yakitori", "udon", "sashimi", "tempura", "tonkatsu", "teppanyaki","maki", "izakaya", "bento", "matcha", "ramenya", "niku","tokyo","teppei","syokudo","shokudo","japanese"],
+    "korean": ["korean", "korea","bibimbap", "kimchi", "bulgogi", "tteokbokki", "soju", "jjigae", "galbi", "samgyeopsal", "hotpot", "seoul", "mandu"],
+    "chinese": ["din", "claypot","chinese", "dimsum", "noodle", "dumpling", "wok", "cantonese", "sichuan", "peking", "bao", "springroll", "wonton", "friedrice", "hotpot", "chow", "cuisine","canton"],
+    "thai": ["thai", "bangkok", "padthai", "tomyum",  "basil", "mango", "coconut", "lemongrass", "seafood", "spicy"],
+    "indian": ["indian", "tandoori", "curry", "masala", "biryani", "naan", "samosa", "tikka", "paneer", "roti", "dal", "chaat", "sizzler", "korma"],
+    "italian": ["italian", "pasta", "pizza", "spaghetti", "risotto", "ristorante", "lasagna", "gelato", "penne", "bruschetta", "carbonara", "focaccia", "mozzarella", "parmigiana", "tiramisu"],
+    "western": ["cow","steak", "burger", "grill", "bbq", "fries", "ribs", "meat", "club", "smokehouse", "bacon", "chicken", "pizza", "sandwichbar"],
+    "malay": ["penyet","geprek","goreng","malay", "nasi", "lemak", "satay", "kampong", "mee", "laksa", "rojak" , "ayam", "rendang", "sambal", "cendol", "goreng"],
+    "vietnamese": ["pho", "vietnamese", "banh",  "springroll",   "buncha", "lemongrass", "saigon", "hanoi"],
+    "cafe": ["coffee", "cafe", "espresso", "latte", "cappuccino", "mocha", "brew", "bakery", "toast", "smoothie", "waffle", "donut", "tea", "bakery", "brunch","starbucks"],
+    "mexican": ["mexican","guzman","stuff'd","taco", "burrito", "quesadilla", "enchilada", "fajita", "nachos", "guacamole","churro", "salsa", "tamale", "carnitas", "jalapeno", "hacienda", "taqueria", "mexico"]
+}
+
+
+def build_cuisine_matcher():
+    #one automaton for all three passes of infer_cuisine_from_name, every keyword tagged with (pass, priority, cuisine)
+    #so the smallest tag found in a name is exactly what the old loops would have returned first
+    keywords = []
+    priority = 0
+    for cuisine, phrases in MULTI_WORD_KEYWORDS.items():
+        for phrase in phrases:
+            keywords.append((phrase, (1, priority, cuisine)))
+            priority += 1
+    for cuisine, words in SINGLE_WORD_KEYWORDS.items():
+        for word in words:
+            keywords.append((word, (2, priority, cuisine))) #standalone word only
+            priority += 1
+    for rank, (cuisine, words) in enumerate(SINGLE_WORD_KEYWORDS.items()):
+        for word in words:
+            keywords.append((word, (3, rank, cuisine))) #anywhere in the name, first cuisine in dict order wins
+    return KeywordMatcher(keywords)
+
+
+CUISINE_MATCHER = build_cuisine_matcher() #built once at import, reused for every name
+
+
 def infer_cuisine_from_name(name: str) -> str:
     name_lower = name.lower()
 
-    multi_word_keywords = {
-        "hawker": ["food court", "kopitiam", "canteen", "chicken rice", "mee hoon", "ban mian"],
-        "local": ["koufu","kueh", "toast box", "kopi","toastbox", "toast box" "kopi", "teh tarik", "kaya toast", "prata", "chicken rice"],
-        "bubble_tea": ["liho","koi","mixue","hitea","chi cha","playmade","cup"]
-    }
-
-    single_word_keywords = {
-        "japanese": ["ramen", "sushi", "japan", "donburi", "yakitori", "udon", "sashimi", "tempura", "tonkatsu", "teppanyaki","maki", "izakaya", "bento", "matcha", "ramenya", "niku","tokyo","teppei","syokudo","shokudo","japanese"],
-        "korean": ["korean", "korea","bibimbap", "kimchi", "bulgogi", "tteokbokki", "soju", "jjigae", "galbi", "samgyeopsal", "hotpot", "seoul", "mandu"],
-        "chinese": ["din", "claypot","chinese", "dimsum", "noodle", "dumpling", "wok", "cantonese", "sichuan", "peking", "bao", "springroll", "wonton", "friedrice", "hotpot", "chow", "cuisine","canton"],
-        "thai": ["thai", "bangkok", "padthai", "tomyum",  "basil", "mango", "coconut", "lemongrass", "seafood", "spicy"],
-        "indian": ["indian", "tandoori", "curry", "masala", "biryani", "naan", "samosa", "tikka", "paneer", "roti", "dal", "chaat", "sizzler", "korma"],
-        "italian": ["italian", "pasta", "pizza", "spaghetti", "risotto", "ristorante", "lasagna", "gelato", "penne", "bruschetta", "carbonara", "focaccia", "mozzarella", "parmigiana", "tiramisu"],
-        "western": ["cow","steak", "burger", "grill", "bbq", "fries", "ribs", "meat", "club", "smokehouse", "bacon", "chicken", "pizza", "sandwichbar"],
-        "malay": ["penyet","geprek","goreng","malay", "nasi", "lemak", "satay", "kampong", "mee", "laksa", "rojak" , "ayam", "rendang", "sambal", "cendol", "goreng"],
-        "vietnamese": ["pho", "vietnamese", "banh",  "springroll",   "buncha", "lemongrass", "saigon", "hanoi"],
-        "cafe": ["coffee", "cafe", "espresso", "latte", "cappuccino", "mocha", "brew", "bakery", "toast", "smoothie", "waffle", "donut", "tea", "bakery", "brunch","starbucks"],
-        "mexican": ["mexican","guzman","stuff'd","taco", "burrito", "quesadilla", "enchilada", "fajita", "nachos", "guacamole","churro", "salsa", "tamale", "carnitas", "jalapeno", "hacienda", "taqueria", "mexico"]
-    }
-
-
-    for cuisine, phrases in multi_word_keywords.items():
-        for phrase in phrases:
-            if phrase in name_lower:
-                return cuisine
+    #1. multi word phrases anywhere in the name, in dict order
+    #2. single words standing on their own ie burger matches "the burger co" but not "hamburger", in dict order
+    #3. single words anywhere in the name
+    best = None
+    for start, end, tag in CUISINE_MATCHER.iter_matches(name_lower):
+        if tag[0] == 2 and not standalone(name_lower, start, end):
+            continue
+        if best is None or tag < best:
+            best = tag
 
-    # then check single words using word boundaries
-    for cuisine, words in single_word_keywords.items():
-        for word in words:
-            pattern = r'(?<!\w)' + re.escape(word) + r'(?!\w)'
-            if re.search(pattern, name_lower):
-                #'\b' is string boundary, re.escape(word) is to ensure special characters get converted to alphabets 
-                #if word is standalone will get back \bburgerb and match, but if is not standalone like hamburger will get back diff value and not match
-                return cuisine
+    if best is None:
+        return "unknown" #return unknown if don't have any matches
+    return best[2]
 
-    for cuisine, words in single_word_keywords.items():
-        if any(word in name_lower for word in words):
-            return cuisine
 
-    return "unknown" #return unknown if don't have any matches
+def infer_cuisines(names) -> list:
+    #batch version for classifying a whole table of names
+    return [infer_cuisine_from_name(name) for name in names]
 
-def overpass_query(lat: float, lon: float, radius: int = (RADIUS_METERS)) -> dict: #takes 3 parameters and returns a dict
+
+def build_query(lat: float, lon: float, radius: int = RADIUS_METERS) -> str:
     q = f"""
     [out:json][timeout:25]; 
     (
@@ -66,58 +97,108 @@ def overpass_query(lat: float, lon: float, radius: int = (RADIUS_METERS)) -> dic
     );
     out center tags;
     """
+    return q
+
+
+def build_bbox_query(south: float, west: float, north: float, east: float) -> str:
+    #every restaurant inside a box, used to fetch a whole tile at once instead of one around: query per restaurant
+    q = f"""
+    [out:json][timeout:60];
+    (
+    node({south}, {west}, {north}, {east})["amenity"="restaurant"];
+    way({south}, {west}, {north}, {east})["amenity"="restaurant"];
+    relation({south}, {west}, {north}, {east})["amenity"="restaurant"];
+    );
+    out center tags;
+    """
+    return q
+
+
+def post_query(q: str, session=None) -> dict:
+    if response_cache is not None:
+        return response_cache.fetch(q, lambda q: http_post(q, session))
+    return http_post(q, session)
 
-    r = requests.post(OVERPASS_URL, data = {"data": q}, timeout = 60) #sends http post request to overpass api, query must be passed under "data" field
+
+def http_post(q: str, session=None) -> dict:
+    http = session or requests #a requests.Session reuses the same TCP/TLS connection
+    r = http.post(OVERPASS_URL, data = {"data": q}, timeout = 60) #sends http post request to overpass api, query must be passed under "data" field
     r.raise_for_status() #checks for HTTP errors 
     return r.json()
+
+
+def overpass_query(lat: float, lon: float, radius: int = (RADIUS_METERS), post=post_query) -> dict: #takes 3 parameters and returns a dict
+    return post(build_query(lat, lon, radius))
     
     
 #out:json means return in json format, easier for python to parse, timeout:25 means if query takes >25s ignore it
 #retrieve 3 objects, node way and relation
 #out center tags is a formatting instruction: output directive, geometric center, tags (metadeta like "name", "cuisine" etc)
 
-def overpass_query_dynamic(lat: float, lon: float, base_radius=50, max_radius=200, step=50):
+def overpass_query_dynamic(lat: float, lon: float, base_radius=50, max_radius=200, step=50, post=post_query, pause=1):
     radius = base_radius
     while radius <= max_radius:
-        data = overpass_query(lat, lon, radius)
+        data = overpass_query(lat, lon, radius, post=post)
         elements = data.get("elements", [])
         if elements:
             return data
         radius += step
         print(f"No results at {radius - step}m, increasing radius to {radius}m...")
-        time.sleep(1)
+        time.sleep(pause)
     return {"elements": []}
 
 
+def element_position(el: dict) -> Optional[tuple]:
+    #formatting, if it returns a node it will have lat and lon, if it returns a way the lat at lon are stored in a dict called center ie "center" :{"lat" : 123", "lon": 123}
+    if "center" in el:
+        return el["center"]["lat"], el["center"]["lon"]
+    if "lat" in el and "lon" in el:
+        return el["lat"], el["lon"]
+    return None
+
+
 def closest_element(elements: list, lat: float, lon: float, name: str, min_name_ratio: float = 0.65) -> Optional[dict]:
     #overpass returns dicts within a list, Optional[dict] --> return closest match or None
-    #picks the closest matching place from a list of Overpass API results given a set of coordinates
-    best = None #hold the closest restaurant found      
-    best_d = float("inf") #set initial best distance to be infinity then slowly narrow down
-    
-    for el in elements: #formatting, if it returns a node it will have lat and lon, if it returns a way the lat at lon are stored in a dict called center ie "center" :{"lat" : 123", "lon": 123}
-        if "center" in el:
-            el_lat = el["center"]["lat"]
-            el_lon = el["center"]["lon"]
-        elif "lat" in el and "lon" in el:
-            el_lat = el["lat"]
-            el_lon = el["lon"]
-        else:
+    #picks the closest place (in metres) whose name is at least min_name_ratio similar
+    #elements are already limited to the search radius (the around: query, or elements_near() for tiles)
+    #candidates are tried closest first, so the name comparison stops at the first one that is similar enough
+    candidates = []
+    for i, el in enumerate(elements):
+        position = element_position(el)
+        if position is None:
             continue
-        
-    
-    #when we enter a given lat and lon into overpass_query, 
-    #the list that overpass returns contains multiple nearby places and we are looping through lat and lon of each of the places to find the closest match
+        candidates.append((distance_m(lat, lon, position[0], position[1]), i))
+    candidates.sort() #ties keep the element order, like the old strict d < best_d did
+
+    name = name.lower()
+    for _, i in candidates:
+        el = elements[i]
+        matcher = element_matcher(el.get("tags", {}).get("name", "").lower())
+        matcher.set_seq1(name)
+        #real_quick_ratio() and quick_ratio() are cheap upper bounds of ratio(), most names fail on them already
+        if (matcher.real_quick_ratio() >= min_name_ratio and matcher.quick_ratio() >= min_name_ratio
+                and matcher.ratio() >= min_name_ratio):
+            return el
+    return None
+
+
+class ElementMatchers(threading.local):
+    #SequenceMatcher indexes its second sequence, keeping one per element name means a tile's elements are only
+    #indexed once however many restaurants are matched against them. closest_element() calls set_seq1() on the
+    #shared matcher, so every thread gets its own cache instead of two threads comparing against each other's name
+    def __init__(self, maxsize=8192):
+        self.get = lru_cache(maxsize=maxsize)(self.build)
 
-        d = (el_lat - lat) ** 2 + (el_lon - lon) ** 2
+    @staticmethod
+    def build(el_name):
+        return SequenceMatcher(None, "", el_name)
 
-        el_name = el.get("tags", {}).get("name", "")
-        ratio = SequenceMatcher(None, name.lower(), el_name.lower()).ratio()
-                                         
-        if d < best_d and ratio >= min_name_ratio:
-            best, best_d = el, d
 
-    return best
+element_matchers = ElementMatchers()
+
+
+def element_matcher(el_name: str) -> SequenceMatcher:
+    return element_matchers.get(el_name)
 
 
 def ensure_columns(conn):
@@ -157,27 +238,109 @@ def ensure_columns(conn):
     conn.commit()
 
 
-def enrich_batch(limit = BATCH_SIZE):
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
+def apply_match(conn, row, elements: list) -> bool:
+    #writes what overpass returned for one restaurant, returns whether an OSM element matched
     db = conn.cursor()
-    ensure_columns(conn)
-    rows = db.execute("""SELECT id, name, latitude, longitude 
+    id, name, lat, lon = row["id"], row["name"], row["latitude"], row["longitude"]
+    match = closest_element(elements, lat, lon, name)
+
+    if not match:
+        print(f"[{id}] No OSM match found.")
+
+        inferred_cuisine = infer_cuisine_from_name(name)
+        cuisine_confidence = "medium" if inferred_cuisine != "unknown" else "low"
+        db.execute("""
+            UPDATE restaurants
+            SET osm_checked = 1,
+                osm_status = 'no_match',
+                cuisine = ?,
+                cuisine_confidence = ?
+            WHERE id = ?
+            """, (inferred_cuisine, cuisine_confidence, id))
+        print(f"[{id}] {name} enriched with inferred cuisine={inferred_cuisine}, cuisine_confidence={cuisine_confidence}")
+        conn.commit()
+        return False
+
+    if match:
+        tags = match.get("tags",{})
+        cuisine = tags.get("cuisine")
+        if not cuisine or cuisine.strip() == "":
+            cuisine = infer_cuisine_from_name(name)
+        opening_hours = tags.get("opening_hours")
+        phone_number = tags.get("phone")
+        website = tags.get("website")
+        raw_json = json.dumps(tags, ensure_ascii= False) #save the whole tag dict as JSON
+        osm_id = str(match.get("id")) 
+        osm_type = match.get("type")
+
+        amenities_list= []
+        for field in ["wheelchair", "takeaway", "delivery", "diet:halal"]:
+            if tags.get(field) == "yes":
+                amenities_list.append(field)
+        amenities = ", ".join(amenities_list)
+        prev_raw = db.execute("SELECT raw_properties FROM restaurants WHERE id = ?", (id,)).fetchone()[0] #Gets value of raw_properties
+        new_raw = (prev_raw or "") + raw_json if raw_json not in (prev_raw or "") else prev_raw #re-running over cached answers shouldn't append the same tags twice
+        update_fields = {
+            "raw_properties": new_raw,
+            "osm_id": osm_id,
+            "osm_type": osm_type,
+            "osm_status": "matched",
+        }
+
+        if cuisine:
+            update_fields["cuisine"] = cuisine
+
+        if tags.get("cuisine"):
+            update_fields["cuisine_confidence"] = "high"
+        elif cuisine and cuisine != "unknown":
+            update_fields["cuisine_confidence"] = "medium"
+        else:
+            update_fields["cuisine_confidence"] = "low"
+
+        if opening_hours:
+            update_fields["opening_hours"] = opening_hours
+        if phone_number:
+            update_fields["phone_number"] = phone_number
+        if website:
+            update_fields["website"] = website
+        if amenities:
+            update_fields["amenities"] = amenities
+
+        set_clause = ", ".join(f"{key} = ?" for key in update_fields.keys())
+        values = list(update_fields.values()) + [id]
+
+        db.execute(f"UPDATE restaurants SET {set_clause} WHERE id = ?", values)
+        db.execute("UPDATE restaurants SET osm_checked = 1 WHERE id = ?", (id,))
+        conn.commit()
+
+        confidence = update_fields["cuisine_confidence"]
+        print(f"[{id}] {name} enriched with cuisine={cuisine} ({osm_type}/{osm_id}), cuisine_confidence: {confidence}")
+        return True
+
+
+PENDING_ROWS_SQL = """SELECT id, name, latitude, longitude 
                       FROM restaurants
                       WHERE (cuisine is NULL OR cuisine = '')
                       AND latitude is NOT NULL
                       AND longitude is NOT NULL
                       AND (osm_checked is NULL OR osm_checked = 0)
                       AND (osm_status is NULL OR osm_status is 'no_match')
-                      LIMIT ?
-                      """, (limit,)).fetchall()
+                      """
+
+
+def enrich_batch(limit = BATCH_SIZE):
+    conn = sqlite3.connect(DB)
+    conn.row_factory = sqlite3.Row
+    db = conn.cursor()
+    ensure_columns(conn)
+    rows = db.execute(PENDING_ROWS_SQL + " LIMIT ?", (limit,)).fetchall()
     if not rows:
         print("No rows to enrich")
         conn.close()
         return
     
     for row in rows:
-        id, name, lat, lon = row["id"], row["name"],row["latitude"],row["longitude"]
+        id, lat, lon = row["id"], row["latitude"], row["longitude"]
         if lat is None or lon is None:
             continue
 
@@ -188,88 +351,19 @@ def enrich_batch(limit = BATCH_SIZE):
             time.sleep(5)
             continue
 
-        elements = data.get("elements", [])
-        match = closest_element(elements, lat, lon, name)
-
-        if not match:
-            print(f"[{id}] No OSM match found.")
-
-            inferred_cuisine = infer_cuisine_from_name(name)
-            cuisine_confidence = "medium" if inferred_cuisine != "unknown" else "low"
-            db.execute("""
-                UPDATE restaurants
-                SET osm_checked = 1,
-                    osm_status = 'no_match',
-                    cuisine = ?,
-                    cuisine_confidence = ?
-                WHERE id = ?
-                """, (inferred_cuisine, cuisine_confidence, id))
-            print(f"[{id}] {name} enriched with inferred cuisine={inferred_cuisine}, cuisine_confidence={cuisine_confidence}")
-            conn.commit()
-            continue
-
-        if match:
-            tags = match.get("tags",{})
-            cuisine = tags.get("cuisine")
-            if not cuisine or cuisine.strip() == "":
-                cuisine = infer_cuisine_from_name(name)
-            opening_hours = tags.get("opening_hours")
-            phone_number = tags.get("phone")
-            website = tags.get("website")
-            raw_json = json.dumps(tags, ensure_ascii= False) #save the whole tag dict as JSON
-            osm_id = str(match.get("id")) 
-            osm_type = match.get("type")
-
-            amenities_list= []
-            for field in ["wheelchair", "takeaway", "delivery", "diet:halal"]:
-                if tags.get(field) == "yes":
-                    amenities_list.append(field)
-            amenities = ", ".join(amenities_list)
-            prev_raw = db.execute("SELECT raw_properties FROM restaurants WHERE id = ?", (id,)).fetchone()[0] #Gets value of raw_properties
-            new_raw = (prev_raw or "") +raw_json
-            update_fields = {
-                "raw_properties": new_raw,
-                "osm_id": osm_id,
-                "osm_type": osm_type,
-                "osm_status": "matched",
-            }
-
-            if cuisine:
-                update_fields["cuisine"] = cuisine
-
-            if tags.get("cuisine"):
-                update_fields["cuisine_confidence"] = "high"
-            elif cuisine and cuisine != "unknown":
-                update_fields["cuisine_confidence"] = "medium"
-            else:
-                update_fields["cuisine_confidence"] = "low"
-
-            if opening_hours:
-                update_fields["opening_hours"] = opening_hours
-            if phone_number:
-                update_fields["phone_number"] = phone_number
-            if website:
-                update_fields["website"] = website
-            if amenities:
-                update_fields["amenities"] = amenities
-
-            set_clause = ", ".join(f"{key} = ?" for key in update_fields.keys())
-            values = list(update_fields.values()) + [id]
-
-            db.execute(f"UPDATE restaurants SET {set_clause} WHERE id = ?", values)
-            db.execute("UPDATE restaurants SET osm_checked = 1 WHERE id = ?", (id,))
-            conn.commit()
-
-            confidence = update_fields["cuisine_confidence"]
-            print(f"[{id}] {name} enriched with cuisine={cuisine} ({osm_type}/{osm_id}), cuisine_confidence: {confidence}")
+        if apply_match(conn, row, data.get("elements", [])):
             time.sleep(SLEEP_BETWEEN_REQUESTS)
     
+    sync_cuisines(conn, [row["id"] for row in rows])
+    bump_data_version(conn)
+    conn.commit()
     conn.close()
     print("Batch Complete")
 
 
 
 if __name__ == "__main__":
+    response_cache = ResponseCache()
     if len(sys.argv) > 1:
         try:
             batch = int(sys.argv[1])
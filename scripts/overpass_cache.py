@@ -0,0 +1,81 @@
+import hashlib, json, os, sqlite3, threading, time, zlib
+
+#raw Overpass answers stored on disk, so re-running the matching/cuisine logic doesn't refetch from overpass-api.de
+#the key is a hash of the query text, which already contains the coordinates and radius (or the tile's bbox)
+
+CACHE_PATH = os.path.join("..", "data", "overpass_cache.db")
+MAX_AGE = 30 * 24 * 3600 # seconds before an answer is fetched again
+
+
+class CacheMiss(Exception):
+    #raised in replay only mode when a query was never fetched
+    pass
+
+
+def query_key(q):
+    #whitespace differences in the query templates shouldn't make a new entry
+    normalized = " ".join(q.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_age=MAX_AGE, replay_only=False):
+        self.path = path
+        self.max_age = max_age
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() #the pipeline's worker threads share this connection
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                  key TEXT PRIMARY KEY,
+                                  query TEXT NOT NULL,
+                                  body BLOB NOT NULL,        -- zlib compressed JSON
+                                  fetched_at REAL NOT NULL)""")
+        self._conn.commit()
+        if not replay_only: #replay keeps everything, an old answer still beats no answer there
+            self.purge_expired()
+
+    def get(self, q):
+        with self._lock:
+            row = self._conn.execute("SELECT body, fetched_at FROM responses WHERE key = ?", (query_key(q),)).fetchone()
+        if row is None:
+            return None
+        body, fetched_at = row
+        #in replay mode anything we have is better than going to the network
+        if not self.replay_only and time.time() - fetched_at > self.max_age:
+            return None
+        return json.loads(zlib.decompress(body))
+
+    def put(self, q, data):
+        body = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, query, body, fetched_at) VALUES (?, ?, ?, ?)",
+                               (query_key(q), q, body, time.time()))
+            self._conn.commit()
+
+    def fetch(self, q, fetcher):
+        #cached answer if there is a fresh one, otherwise fetcher(q) and remember the result
+        data = self.get(q)
+        with self._lock: #fetch() runs on the pipeline's worker threads
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is not None:
+            return data
+        if self.replay_only:
+            raise CacheMiss("query not in the Overpass cache")
+        data = fetcher(q)
+        self.put(q, data)
+        return data
+
+    def purge_expired(self):
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.max_age,)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        self._conn.close()
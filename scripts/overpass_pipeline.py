@@ -0,0 +1,308 @@
+#concurrent version of overpass.enrich_batch()
+#requests go out from a small thread pool, a token bucket keeps us under the public API's rate limit,
+#429/504 answers are retried with exponential backoff, and every result is committed as soon as it arrives
+#so a crash or ctrl-c resumes where it stopped
+#--tiles groups the restaurants into geohash tiles and fetches each tile once
+
+import argparse, os, random, sqlite3, sys, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import overpass
+from overpass import (DB, BATCH_SIZE, PENDING_ROWS_SQL, apply_match, build_bbox_query, element_position,
+                      ensure_columns, overpass_query_dynamic, http_post)
+from overpass_cache import CACHE_PATH, MAX_AGE, CacheMiss, ResponseCache
+from db_utils import bump_data_version, fetch_by_ids, sync_cuisines
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # geo.py and migrations.py are in the repo root, shared with the app
+from geo import distance_m, expand_bbox, geohash, geohash_bbox
+from migrations import migrate
+
+RATE = 1.0            # requests per second on average
+BURST = 2             # requests allowed back to back after an idle period
+WINDOW = 4            # restaurants in flight at once (= worker threads)
+MAX_RETRIES = 5       # per HTTP request
+BACKOFF_BASE = 2.0    # seconds, doubled on every retry
+BACKOFF_MAX = 60.0
+MAX_ATTEMPTS = 3      # runs a restaurant may fail before it is skipped
+RETRY_STATUSES = {429, 502, 503, 504}
+
+TILE_PRECISION = 6    # geohash length, 6 = ~1.2km x 0.6km tiles
+BASE_RADIUS, MAX_RADIUS, RADIUS_STEP = 50, 200, 50  # same steps as overpass_query_dynamic()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self.lock = threading.Lock() #also guards OverpassClient's counters, += from several workers isn't atomic
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay) #sleep outside the lock so other threads can check too
+
+
+class OverpassClient:
+    #one pooled session shared by the workers, every request waits for a token first
+    def __init__(self, bucket, pool_size=WINDOW, max_retries=MAX_RETRIES):
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.requests = 0
+        self.retries = 0
+
+    def post(self, q):
+        #cache hits don't use up a token, in replay only mode nothing here touches the network
+        if overpass.response_cache is not None:
+            return overpass.response_cache.fetch(q, self.post_network)
+        return self.post_network(q)
+
+    def post_network(self, q):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self.bucket.lock:
+                self.requests += 1
+            status = retry_after = None
+            try:
+                return http_post(q, session=self.session)
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                retry_after = e.response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0) #jitter so the workers don't retry in lockstep
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            attempt += 1
+            with self.bucket.lock:
+                self.retries += 1
+            print(f"Overpass busy ({status or 'connection error'}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def record_failure(conn, row, error):
+    conn.execute("""INSERT INTO overpass_checkpoint (restaurant_id, attempts, last_error) VALUES (?, 1, ?)
+                    ON CONFLICT(restaurant_id) DO UPDATE SET attempts = attempts + 1,
+                                                             last_error = excluded.last_error,
+                                                             updated_at = CURRENT_TIMESTAMP""",
+                 (row["id"], str(error)[:500]))
+    conn.commit()
+
+
+def pending_rows(conn, limit, max_attempts=MAX_ATTEMPTS, everything=False, ids=None):
+    if ids is not None:
+        #exactly these restaurants (scripts/pipeline.py's dirty rows) whatever their cuisine is now,
+        #it is only replaced once Overpass has answered for them
+        return fetch_by_ids(conn, """SELECT id, name, latitude, longitude FROM restaurants
+                                     WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                                     AND id NOT IN (SELECT restaurant_id FROM overpass_checkpoint WHERE attempts >= ?)""",
+                            ids, params=(max_attempts,))
+    if everything:
+        #re-run the matching over every restaurant, meant for replaying cached answers after changing the logic
+        return conn.execute("""SELECT id, name, latitude, longitude FROM restaurants
+                               WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                               ORDER BY id LIMIT ?""", (limit,)).fetchall()
+    return conn.execute(PENDING_ROWS_SQL + """
+                      AND id NOT IN (SELECT restaurant_id FROM overpass_checkpoint WHERE attempts >= ?)
+                      ORDER BY id
+                      LIMIT ?""", (max_attempts, limit)).fetchall()
+
+
+def enrich_concurrent(limit=BATCH_SIZE, window=WINDOW, rate=RATE, burst=BURST, max_attempts=MAX_ATTEMPTS, db_path=DB,
+                      everything=False):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    ensure_columns(conn)
+    migrate(conn) #overpass_checkpoint (migration 13)
+
+    rows = pending_rows(conn, limit, max_attempts, everything)
+    if not rows:
+        print("No rows to enrich")
+        conn.close()
+        return
+
+    client = OverpassClient(TokenBucket(rate, burst), pool_size=window)
+
+    def fetch(row):
+        #runs on a worker thread, only network here, all db writes stay on the main thread
+        return overpass_query_dynamic(row["latitude"], row["longitude"], post=client.post, pause=0)
+
+    matched = no_match = failed = not_cached = 0
+    started = time.monotonic()
+    remaining = iter(rows)
+    with ThreadPoolExecutor(max_workers=window) as pool:
+        in_flight = {}
+
+        def submit_next():
+            row = next(remaining, None)
+            if row is not None:
+                in_flight[pool.submit(fetch, row)] = row
+
+        for _ in range(window):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = in_flight.pop(future)
+                try:
+                    data = future.result()
+                except CacheMiss:
+                    not_cached += 1 #replay only, nothing was fetched so it isn't a failure either
+                except Exception as e:
+                    print(f"[{row['id']}] Overpass Error {e}, will retry on the next run")
+                    record_failure(conn, row, e)
+                    failed += 1
+                else:
+                    if apply_match(conn, row, data.get("elements", [])):
+                        matched += 1
+                    else:
+                        no_match += 1
+                submit_next()
+
+    sync_cuisines(conn, [row["id"] for row in rows])
+    bump_data_version(conn)
+    conn.commit()
+    conn.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Batch Complete: {matched} matched, {no_match} no match, {failed} failed, {not_cached} not cached "
+          f"in {elapsed:.1f}s ({client.requests} requests, {client.retries} retries)")
+
+
+def elements_near(elements, lat, lon, base_radius=BASE_RADIUS, max_radius=MAX_RADIUS, step=RADIUS_STEP):
+    #what overpass_query_dynamic() would have returned for this point: the elements within the first radius that has any
+    distances = []
+    for el in elements:
+        position = element_position(el)
+        if position is not None:
+            distances.append((distance_m(lat, lon, position[0], position[1]), el))
+
+    radius = base_radius
+    while radius <= max_radius:
+        nearby = [el for d, el in distances if d <= radius]
+        if nearby:
+            return nearby
+        radius += step
+    return []
+
+
+def enrich_tiles(limit=BATCH_SIZE, precision=TILE_PRECISION, window=WINDOW, rate=RATE, burst=BURST,
+                 max_attempts=MAX_ATTEMPTS, db_path=DB, everything=False, ids=None):
+    #one bbox query per geohash tile instead of up to 4 around: queries per restaurant,
+    #thousands of restaurants share the same malls and HDB blocks so most tiles hold many of them
+    #ids: only these restaurants (limit is ignored), instead of the next pending ones
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    ensure_columns(conn)
+    migrate(conn) #overpass_checkpoint (migration 13)
+
+    rows = pending_rows(conn, limit, max_attempts, everything, ids)
+    if not rows:
+        print("No rows to enrich")
+        conn.close()
+        return
+
+    tiles = defaultdict(list)
+    for row in rows:
+        tiles[geohash(row["latitude"], row["longitude"], precision)].append(row)
+    print(f"{len(rows)} restaurants in {len(tiles)} tiles")
+
+    client = OverpassClient(TokenBucket(rate, burst), pool_size=window)
+
+    def fetch_tile(cell):
+        #the margin makes sure restaurants on the edge of a tile still see everything within MAX_RADIUS
+        south, west, north, east = expand_bbox(geohash_bbox(cell), MAX_RADIUS)
+        return client.post(build_bbox_query(south, west, north, east)).get("elements", [])
+
+    tile_cache = {} # geohash -> elements, every restaurant in the tile is matched against this
+    matched = no_match = failed = not_cached = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=window) as pool:
+        futures = {pool.submit(fetch_tile, cell): cell for cell in tiles}
+        for future in as_completed(futures):
+            cell = futures[future]
+            try:
+                tile_cache[cell] = future.result()
+            except CacheMiss:
+                not_cached += len(tiles[cell])
+                continue
+            except Exception as e:
+                print(f"[tile {cell}] Overpass Error {e}, will retry on the next run")
+                for row in tiles[cell]:
+                    record_failure(conn, row, e)
+                failed += len(tiles[cell])
+                continue
+
+            for row in tiles[cell]:
+                nearby = elements_near(tile_cache[cell], row["latitude"], row["longitude"])
+                if apply_match(conn, row, nearby):
+                    matched += 1
+                else:
+                    no_match += 1
+
+    sync_cuisines(conn, [row["id"] for row in rows])
+    bump_data_version(conn)
+    conn.commit()
+    conn.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Batch Complete: {matched} matched, {no_match} no match, {failed} failed, {not_cached} not cached "
+          f"in {elapsed:.1f}s ({client.requests} requests for {len(rows)} restaurants, {client.retries} retries)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich restaurants from Overpass with concurrent, rate limited requests")
+    parser.add_argument("limit", nargs="?", type=int, default=BATCH_SIZE, help="restaurants to process")
+    parser.add_argument("--window", type=int, default=WINDOW, help="restaurants in flight at once")
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second")
+    parser.add_argument("--burst", type=int, default=BURST, help="token bucket size")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="skip rows that already failed this many runs")
+    parser.add_argument("--db", default=DB)
+    parser.add_argument("--url", help="Overpass endpoint, e.g. a local fake_overpass.py")
+    parser.add_argument("--tiles", action="store_true", help="one bbox query per geohash tile instead of one per restaurant")
+    parser.add_argument("--precision", type=int, default=TILE_PRECISION, help="geohash length of a tile")
+    parser.add_argument("--cache", default=CACHE_PATH, help="sqlite file for the raw Overpass answers")
+    parser.add_argument("--no-cache", action="store_true", help="always go to the network")
+    parser.add_argument("--max-age", type=float, default=MAX_AGE / 86400, help="days before a cached answer is refetched")
+    parser.add_argument("--replay", action="store_true", help="only use cached answers, no network at all")
+    parser.add_argument("--all", action="store_true", help="re-run the matching for every restaurant, not just pending ones")
+    args = parser.parse_args()
+
+    if args.url:
+        overpass.OVERPASS_URL = args.url
+    if not args.no_cache:
+        overpass.response_cache = ResponseCache(args.cache, max_age=args.max_age * 86400, replay_only=args.replay)
+
+    if args.tiles:
+        enrich_tiles(limit=args.limit, precision=args.precision, window=args.window, rate=args.rate,
+                     burst=args.burst, max_attempts=args.max_attempts, db_path=args.db, everything=args.all)
+    else:
+        enrich_concurrent(limit=args.limit, window=args.window, rate=args.rate, burst=args.burst,
+                          max_attempts=args.max_attempts, db_path=args.db, everything=args.all)
+
+    if overpass.response_cache is not None:
+        cache = overpass.response_cache
+        print(f"Overpass cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
@@ -0,0 +1,305 @@
+#one entry point for the whole data refresh, instead of running import_ee.py, seed.sql, overpass, assign_region.py,
+#assign_price.py and assign_categories.py by hand in that order
+#every row stage remembers a hash of the columns it reads (plus its own source code and data files) per restaurant,
+#so a run only recomputes the rows whose inputs changed since that stage last saw them
+#python pipeline.py [--db path/to/copy.db] [--overpass] [--force STAGE] [--dry-run]
+
+import argparse, hashlib, os, sqlite3, sys, time
+from graphlib import TopologicalSorter
+
+import assign_categories
+import assign_price
+import assign_region
+import import_hawker
+from db_utils import bump_data_version, fetch_by_ids
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+SCRIPTS_DIR = os.path.join(BASE_DIR, "scripts")
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+DB_PATH = os.path.join(DATA_DIR, "copy.db")
+EATING_PATH = os.path.join(DATA_DIR, "eatingestablishments.geojson")
+SEED_PATH = os.path.join(BASE_DIR, "seed.sql")
+
+sys.path.insert(0, BASE_DIR)
+from migrations import migrate
+import cuisines
+
+
+class Stage:
+    """One step of the refresh.
+
+    Row stages (`inputs` set) get the ids of the restaurants whose input columns changed and return the ids they
+    could not finish, if any, which stay dirty for the next run. Table stages (no `inputs`) run as a whole when
+    their files changed or when a stage they depend on changed something this run. A whole stage (`whole=True`,
+    with `inputs`) is a table stage that also runs when any row's inputs changed, e.g. clustering compares rows
+    with each other so one new or moved restaurant means running it over the whole table.
+    """
+
+    def __init__(self, name, run, deps=(), inputs=None, files=(), prepare=None, optional=False, whole=False):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.inputs = inputs
+        self.files = tuple(files)
+        self.prepare = prepare   # idempotent column/table setup, runs before the inputs are read
+        self.optional = optional # only runs when asked for on the command line
+        self.whole = whole
+
+    def salt(self):
+        #code and data the stage depends on besides the row itself, changing any of them makes every row dirty
+        h = hashlib.blake2b(self.name.encode(), digest_size=16)
+        for path in self.files:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        h.update(chunk)
+        return h
+
+
+def row_hashes(conn, stage):
+    salt = stage.salt()
+    hashes = {}
+    for row in conn.execute(f"SELECT id, {', '.join(stage.inputs)} FROM restaurants"):
+        h = salt.copy()
+        h.update(repr(row[1:]).encode())
+        hashes[row[0]] = h.digest()
+    return hashes
+
+
+def dirty_rows(conn, stage, force=False):
+    #(ids whose inputs changed, their new hashes, ids that had a previous hash)
+    current = row_hashes(conn, stage)
+    stored = {} if force else dict(conn.execute("SELECT restaurant_id, input_hash FROM pipeline_state WHERE stage = ?",
+                                                (stage.name,)))
+    dirty = [rest_id for rest_id, h in current.items() if stored.get(rest_id) != h]
+    return dirty, current, {rest_id for rest_id in dirty if rest_id in stored}
+
+
+def save_row_hashes(conn, stage, ids, current):
+    with conn:
+        conn.executemany("""INSERT INTO pipeline_state (stage, restaurant_id, input_hash) VALUES (?, ?, ?)
+                            ON CONFLICT(stage, restaurant_id) DO UPDATE SET input_hash = excluded.input_hash""",
+                         [(stage.name, rest_id, current[rest_id]) for rest_id in ids])
+        #restaurants deleted since (seed.sql, deduplication) don't need their hashes any more
+        conn.execute("""DELETE FROM pipeline_state WHERE stage = ?
+                        AND restaurant_id NOT IN (SELECT id FROM restaurants)""", (stage.name,))
+
+
+def stage_is_stale(conn, stage, changed, force=False):
+    if force or any(changed.get(dep) for dep in stage.deps):
+        return True
+    stored = conn.execute("SELECT input_hash FROM pipeline_runs WHERE stage = ?", (stage.name,)).fetchone()
+    return stored is None or stored[0] != stage.salt().digest()
+
+
+def restaurant_count(conn):
+    return conn.execute("SELECT count(*) FROM restaurants").fetchone()[0]
+
+
+#stages
+
+def run_import(conn, options):
+    from import_ee import import_establishments
+
+    if not os.path.exists(options.geojson):
+        print(f"  {options.geojson} not found, skipping")
+        return 0
+    #the import upserts on dedup_key, only new establishments and changed licence/unit/position count
+    before = conn.total_changes
+    import_establishments(conn, options.geojson, progress_every=0)
+    return conn.total_changes - before
+
+
+def run_seed(conn, options):
+    #seed.sql rules (unusable rows, duplicates keeping the oldest id so enriched rows keep their state)
+    from dedupe import clean
+
+    removed = clean(conn)
+    for name, count in removed.items():
+        print(f"  {name}: {count}")
+    return sum(removed.values())
+
+
+def prepare_overpass(conn):
+    from overpass import ensure_columns
+    ensure_columns(conn)
+
+
+def run_overpass(conn, ids, previously_seen, options):
+    import overpass
+    from overpass_cache import CACHE_PATH, ResponseCache
+    from overpass_pipeline import enrich_tiles
+
+    #restaurants that were checked before but whose name or position changed since are checked again,
+    #their cuisine stays until Overpass answers (osm_checked = 0 is how an unanswered row is told apart below)
+    #rows without coordinates can't be looked up at all, they are marked as such instead of staying dirty
+    with conn:
+        conn.executemany("UPDATE restaurants SET osm_checked = 0 WHERE id = ?", [(rest_id,) for rest_id in previously_seen])
+        for (rest_id,) in fetch_by_ids(conn, "SELECT id FROM restaurants WHERE (latitude IS NULL OR longitude IS NULL)", ids):
+            conn.execute("UPDATE restaurants SET osm_checked = 1, osm_status = 'no_location' WHERE id = ?", (rest_id,))
+    #new rows enriched some other way already (overpass_pipeline.py on its own) need no second lookup
+    todo = [rest_id for rest_id, checked in fetch_by_ids(conn, "SELECT id, osm_checked FROM restaurants WHERE 1", ids)
+            if not checked]
+    if not todo:
+        return []
+    if options.url:
+        overpass.OVERPASS_URL = options.url
+    overpass.response_cache = ResponseCache(CACHE_PATH, replay_only=options.replay)
+    try:
+        enrich_tiles(db_path=options.db, ids=todo)
+    finally:
+        overpass.response_cache.close()
+    #rows Overpass couldn't answer for stay dirty and are tried again next run
+    return [rest_id for rest_id, checked in fetch_by_ids(conn, "SELECT id, osm_checked FROM restaurants WHERE 1", ids)
+            if not checked]
+
+
+def run_hawker(conn, ids, previously_seen, options):
+    import_hawker.import_centres(conn, options.hawker_geojson)
+    import_hawker.link_establishments(conn, ids=ids)
+
+
+def run_region(conn, ids, previously_seen, options):
+    assign_region.assign_region_rows(conn, ids, options.polygon_index)
+
+
+def run_price(conn, ids, previously_seen, options):
+    assign_price.assign_prices(conn, ids)
+
+
+def run_categories(conn, ids, previously_seen, options):
+    assign_categories.assign_categories(conn, ids)
+
+
+def run_cuisines(conn, ids, previously_seen, options):
+    if cuisines.sync_restaurant_cuisines(conn, ids):
+        with conn:
+            bump_data_version(conn)
+
+
+def run_clusters(conn, options):
+    from resolve_entities import main as resolve_entities
+    return resolve_entities(options.db)
+
+
+def run_precompute(conn, options):
+    from precompute_recommendations import main as precompute
+
+    if conn.execute("SELECT 1 FROM preferences LIMIT 1").fetchone() is None and not options.precompute_all:
+        return 0
+    precompute(options.db, everything=options.precompute_all)
+    return conn.execute("SELECT count(*) FROM recommendation_cache").fetchone()[0]
+
+
+def script(name):
+    return os.path.join(SCRIPTS_DIR, name)
+
+
+def build_stages(options):
+    return [
+        Stage("import", run_import, files=[options.geojson, script("import_ee.py")]),
+        Stage("seed", run_seed, deps=["import"], files=[SEED_PATH, script("dedupe.py")]),
+        Stage("overpass", run_overpass, deps=["seed"], inputs=["name", "latitude", "longitude"],
+              files=[script("overpass.py")], prepare=prepare_overpass, optional=True),
+        Stage("hawker", run_hawker, deps=["seed"], inputs=["postal", "latitude", "longitude"],
+              files=[options.hawker_geojson, script("import_hawker.py"), os.path.join(BASE_DIR, "geo.py")]),
+        Stage("region", run_region, deps=["seed"], inputs=["latitude", "longitude"],
+              files=[script("assign_region.py"), options.polygons or ""], prepare=assign_region.ensure_columns),
+        Stage("price", run_price, deps=["overpass"], inputs=["cuisine"],
+              files=[script("assign_price.py")], prepare=assign_price.ensure_columns),
+        Stage("cuisines", run_cuisines, deps=["overpass"], inputs=["cuisine"],
+              files=[os.path.join(BASE_DIR, "cuisines.py")], prepare=cuisines.ensure_tables),
+        Stage("categories", run_categories, deps=["hawker"], inputs=["name", "is_hawker"],
+              files=[script("assign_categories.py"), script("keyword_matcher.py")]),
+        Stage("clusters", run_clusters, deps=["seed", "overpass"], inputs=["name", "latitude", "longitude", "cuisine"],
+              files=[script("resolve_entities.py"), os.path.join(BASE_DIR, "geo.py")], whole=True),
+        Stage("precompute", run_precompute, deps=["hawker", "region", "price", "cuisines", "categories", "clusters"],
+              files=[script("precompute_recommendations.py")]),
+    ]
+
+
+def order(stages):
+    #dependency order, graphlib raises CycleError if somebody wires a loop
+    by_name = {stage.name: stage for stage in stages}
+    graph = {stage.name: [dep for dep in stage.deps if dep in by_name] for stage in stages}
+    return [by_name[name] for name in TopologicalSorter(graph).static_order()]
+
+
+def run(options):
+    conn = sqlite3.connect(options.db)
+    migrate(conn) #import and seed need restaurants.dedup_key, pipeline_state/pipeline_runs are migration 12
+    stages = order(build_stages(options))
+    unknown = set(options.force) - {stage.name for stage in stages}
+    if unknown:
+        sys.exit(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    changed = {} # stage name -> rows it touched this run
+    started = time.perf_counter()
+    for stage in stages:
+        if stage.optional and not getattr(options, stage.name):
+            continue
+        t = time.perf_counter()
+        force = stage.name in options.force
+        if stage.prepare is not None:
+            stage.prepare(conn)
+
+        if stage.inputs is None or stage.whole:
+            dirty, current, _ = dirty_rows(conn, stage, force) if stage.whole else ([], None, None)
+            if not dirty and not stage_is_stale(conn, stage, changed, force):
+                print(f"{stage.name}: up to date")
+                continue
+            if options.dry_run:
+                print(f"{stage.name}: would run" + (f" ({len(dirty)} rows changed)" if dirty else ""))
+                continue
+            changed[stage.name] = stage.run(conn, options)
+            with conn:
+                conn.execute("""INSERT INTO pipeline_runs (stage, input_hash) VALUES (?, ?)
+                                ON CONFLICT(stage) DO UPDATE SET input_hash = excluded.input_hash,
+                                                                 finished_at = CURRENT_TIMESTAMP""",
+                             (stage.name, stage.salt().digest()))
+            if current is not None:
+                save_row_hashes(conn, stage, dirty, current)
+            print(f"{stage.name}: {changed[stage.name]} rows changed in {time.perf_counter() - t:.2f}s")
+            continue
+
+        dirty, current, previously_seen = dirty_rows(conn, stage, force)
+        if options.dry_run:
+            print(f"{stage.name}: {len(dirty)} of {len(current)} rows dirty")
+            continue
+        if dirty:
+            unfinished = set(stage.run(conn, dirty, previously_seen, options) or ())
+            save_row_hashes(conn, stage, [rest_id for rest_id in dirty if rest_id not in unfinished], current)
+        else:
+            save_row_hashes(conn, stage, [], current)
+        changed[stage.name] = len(dirty)
+        print(f"{stage.name}: {len(dirty)} of {len(current)} rows recomputed in {time.perf_counter() - t:.2f}s")
+
+    conn.close()
+    print(f"Pipeline finished in {time.perf_counter() - started:.2f}s")
+
+
+def parse_options(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the restaurant data, recomputing only rows whose inputs changed")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--geojson", default=EATING_PATH, help="eating establishments export for the import stage")
+    parser.add_argument("--hawker-geojson", default=import_hawker.HAWKER_PATH)
+    parser.add_argument("--polygons", help="region boundaries for assign_region.py, see its --polygons")
+    parser.add_argument("--property", default="REGION_N", help="feature property holding the region name")
+    parser.add_argument("--overpass", action="store_true", help="also enrich new and moved restaurants from Overpass")
+    parser.add_argument("--url", help="Overpass endpoint, e.g. a local fake_overpass.py")
+    parser.add_argument("--replay", action="store_true", help="Overpass answers from the cache only, no network")
+    parser.add_argument("--precompute-all", action="store_true", help="precompute every dashboard combination")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE", help="recompute every row of STAGE")
+    parser.add_argument("--dry-run", action="store_true", help="only report what is dirty")
+    options = parser.parse_args(argv)
+
+    options.polygon_index = None
+    if options.polygons:
+        from polygon_index import PolygonIndex
+        options.polygon_index = PolygonIndex(assign_region.load_region_polygons(options.polygons, options.property))
+    return options
+
+
+if __name__ == "__main__":
+    run(parse_options())
@@ -0,0 +1,87 @@
+import json
+import math
+from collections import defaultdict
+
+import numpy as np
+
+# point-in-polygon lookups against GeoJSON boundaries (e.g. URA planning areas)
+# polygons are bucketed into a grid of cell_size degrees, so a point is only tested against the few polygons
+# whose bounding box touches its cell instead of every polygon
+
+
+def load_polygons(path, label_property):
+    #returns [(label, [ring, ...]), ...] with each ring an (N, 2) array of lon, lat
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    polygons = []
+    for feature in data["features"]:
+        label = feature.get("properties", {}).get(label_property)
+        geom = feature.get("geometry") or {}
+        if label is None or not geom:
+            continue
+        if geom["type"] == "Polygon":
+            parts = [geom["coordinates"]]
+        elif geom["type"] == "MultiPolygon":
+            parts = geom["coordinates"]
+        else:
+            continue
+        for rings in parts:
+            polygons.append((label, [np.asarray(ring, dtype=float)[:, :2] for ring in rings]))
+    return polygons
+
+
+def points_in_polygon(lons, lats, rings):
+    #even-odd ray casting, vectorized over points x edges, holes flip the result back because they're rings too
+    inside = np.zeros(len(lons), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for ring in rings:
+            xi, yi = ring[:, 0][:, None], ring[:, 1][:, None]
+            xj, yj = np.roll(ring[:, 0], 1)[:, None], np.roll(ring[:, 1], 1)[:, None]
+            crosses = ((yi > lats) != (yj > lats)) & (lons < (xj - xi) * (lats - yi) / (yj - yi) + xi)
+            inside ^= (crosses.sum(axis=0) % 2 == 1)
+    return inside
+
+
+class PolygonIndex:
+    def __init__(self, polygons, cell_size=0.02):
+        self.polygons = polygons
+        self.cell_size = cell_size
+        self.cells = defaultdict(list) # (cell x, cell y) -> polygon numbers, in file order
+        for i, (_, rings) in enumerate(polygons):
+            outer = rings[0]
+            x0, y0 = self._cell(outer[:, 0].min(), outer[:, 1].min())
+            x1, y1 = self._cell(outer[:, 0].max(), outer[:, 1].max())
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self.cells[(cx, cy)].append(i)
+
+    def _cell(self, lon, lat):
+        return math.floor(lon / self.cell_size), math.floor(lat / self.cell_size)
+
+    def lookup(self, lats, lons):
+        #label of the first polygon containing each point, None when no polygon does (or lat/lon is NaN)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        labels = np.full(len(lats), None, dtype=object)
+
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        idx = np.nonzero(valid)[0]
+        cx = np.floor(lons[idx] / self.cell_size).astype(np.int64)
+        cy = np.floor(lats[idx] / self.cell_size).astype(np.int64)
+
+        #points sharing a cell share their candidate polygons, test them together
+        #one stable argsort over the group numbers splits idx into per-cell runs, instead of a mask per cell
+        cells, group = np.unique(np.stack([cx, cy], axis=1), axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        order = np.argsort(group, kind="stable")
+        runs = np.split(idx[order], np.flatnonzero(np.diff(group[order])) + 1)
+        for (x, y), pending in zip(cells, runs):
+            for i in self.cells.get((int(x), int(y)), ()):
+                if len(pending) == 0:
+                    break
+                label, rings = self.polygons[i]
+                hit = points_in_polygon(lons[pending], lats[pending], rings)
+                labels[pending[hit]] = label
+                pending = pending[~hit]
+        return labels
@@ -0,0 +1,133 @@
+#fills recommendation_cache with the top N restaurants for every preference combination, so recommend() only has to
+#look its key up instead of scoring anything
+#python precompute_recommendations.py [--all] [--max-cuisines 2] [--top 50] [--db path/to/copy.db]
+#   default: every (region, cuisines, category, budget) combination that appears in preferences
+#   --all:   every dashboard combination with up to --max-cuisines cuisines ticked (plus the ones in preferences)
+
+import argparse, json, os, sqlite3, sys, time
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+DB_PATH = os.path.join("..", "data", "copy.db")
+
+sys.path.insert(0, BASE_DIR)
+from cuisines import DASHBOARD_CUISINES, OVERFLOW, cuisine_bits, mask_for, mask_matches, overflow_names
+from migrations import migrate
+from recommender import BUDGET_MATCH_SCORE, CUISINE_MATCH_SCORE, recommendation_key, recommendation_key_text
+
+#the dashboard form's choices, see templates/dashboard.html
+REGIONS = ["North", "South", "East", "West", "Central"]
+CUISINES = list(DASHBOARD_CUISINES)
+CATEGORIES = ["Restaurant", "Cafe", "Hawker", "Fast Food", "Bakery", "Dessert", "Bubble Tea", "Supermarket Food", "Food Court"]
+BUDGETS = ["cheap", "medium"]
+
+TOP_N = 50  # recommend() shows 50
+
+
+def load_groups(conn):
+    #one pass over restaurants: (region, category) -> (ids, price_range, cuisine_mask, cuisine arrays), ids ascending
+    #the duplicates scripts/resolve_entities.py put in restaurant_clusters are left out
+    grouped = defaultdict(lambda: ([], [], [], []))
+    rows = conn.execute("""SELECT id, region, category, price_range, cuisine_mask, cuisine FROM restaurants
+                           WHERE region IS NOT NULL AND category IS NOT NULL AND cuisine_mask != 0
+                           AND NOT EXISTS (SELECT 1 FROM restaurant_clusters c
+                                           WHERE c.restaurant_id = restaurants.id AND c.cluster_id != restaurants.id)
+                           ORDER BY id""")
+    for rest_id, region, category, price_range, mask, cuisine in rows:
+        ids, prices, masks, texts = grouped[(region, category)]
+        ids.append(rest_id)
+        prices.append(price_range)
+        masks.append(mask)
+        texts.append(cuisine)
+    return {key: (np.array(ids, dtype=np.int64), np.array(prices, dtype=object), np.array(masks, dtype=np.int64),
+                  np.array(texts, dtype=object))
+            for key, (ids, prices, masks, texts) in grouped.items()}
+
+
+def rank(groups, bits, region, cuisines, category, budget, top=TOP_N):
+    #vectorized version of RestaurantIndex.recommend(): budget matches first, then the rest, each in id order
+    #bits is cuisines.cuisine_bits(), the cuisine test is one AND over the whole group's masks
+    group = groups.get((region, category))
+    wanted = mask_for(bits, cuisines)
+    if group is None or not wanted:
+        return []
+    ids, prices, masks, texts = group
+    selected = (masks & wanted) != 0
+    if wanted & OVERFLOW: #some of the cuisines have no bit of their own, check those rows by name
+        overflow = overflow_names(bits, cuisines)
+        for i in np.flatnonzero(selected):
+            selected[i] = mask_matches(int(masks[i]), wanted, overflow, texts[i])
+    matches = prices == budget
+    boosted = ids[selected & matches][:top] #ids are ascending already
+    rest = ids[selected & ~matches][:top - len(boosted)]
+    high, low = CUISINE_MATCH_SCORE + BUDGET_MATCH_SCORE, CUISINE_MATCH_SCORE
+    return [[int(i), high] for i in boosted] + [[int(i), low] for i in rest]
+
+
+def seen_combinations(conn):
+    combos = set()
+    try:
+        rows = conn.execute("SELECT DISTINCT region, cuisine, category, budget FROM preferences").fetchall()
+    except sqlite3.OperationalError: #no preferences table in this database
+        return combos
+    for region, cuisine, category, budget in rows:
+        if region and cuisine and category and budget:
+            combos.add(recommendation_key(region, cuisine.split(","), category, budget))
+    return combos
+
+
+def dashboard_combinations(max_cuisines):
+    for k in range(1, max_cuisines + 1):
+        for cuisines in combinations(sorted(CUISINES), k):
+            for region in REGIONS:
+                for category in CATEGORIES:
+                    for budget in BUDGETS:
+                        yield recommendation_key(region, cuisines, category, budget)
+
+
+def main(db_path=DB_PATH, everything=False, max_cuisines=2, top=TOP_N):
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    migrate(conn) #recommendation_cache, restaurant_clusters and cuisine_mask all come from migrations.py
+
+    #data_version and the rows are read in one transaction, so the stamp always matches what was scored
+    conn.execute("BEGIN")
+    try:
+        version = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError: #database from before migration 3
+        version = None
+    version = version[0] if version else 0
+    groups = load_groups(conn)
+    bits = cuisine_bits(conn)
+    conn.rollback()
+
+    combos = seen_combinations(conn)
+    if everything:
+        combos.update(dashboard_combinations(max_cuisines))
+
+    rows = []
+    #keys come from recommender.py itself, so they can't drift from what the app looks up
+    for key in combos:
+        region, cuisines, category, budget = key
+        ranked = rank(groups, bits, region, cuisines, category, budget, top)
+        rows.append((recommendation_key_text(key), version, json.dumps(ranked)))
+
+    #results from an older data_version are useless, replace the whole table in one transaction
+    with conn:
+        conn.execute("DELETE FROM recommendation_cache")
+        conn.executemany("INSERT INTO recommendation_cache (key, data_version, ids) VALUES (?, ?, ?)", rows)
+    conn.close()
+    print(f"Precomputed {len(rows)} combinations at data_version {version} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute recommendations into the recommendation_cache table")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--all", action="store_true", help="every dashboard combination, not just the ones in preferences")
+    parser.add_argument("--max-cuisines", type=int, default=2, help="largest set of ticked cuisines precomputed with --all")
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args()
+    main(args.db, args.all, args.max_cuisines, args.top)
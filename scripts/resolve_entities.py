@@ -0,0 +1,183 @@
+#finds near-duplicate establishments ("Toast Box" and "TOAST BOX (Tampines)" at the same spot) and clusters them
+#so /recommend only shows one of each. Comparing every pair would be O(n^2), so restaurants are blocked by geohash
+#cell + the first 3 letters of their normalized name and only pairs within a block (or the 8 cells around it) are scored
+#python resolve_entities.py [--db path/to/copy.db] [--max-distance 50] [--min-similarity 0.9] [--dry-run]
+
+import argparse, os, re, sqlite3, sys, time
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from db_utils import bump_data_version
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # geo.py and migrations.py are in the repo root
+from geo import distance_m, geohash, geohash_neighbours
+from migrations import migrate
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # one level up from /scripts/
+DB_PATH = os.path.join(BASE_DIR, "data", "copy.db")
+
+PRECISION = 7          # geohash length, 7 = ~150m x 150m cells, bigger than MAX_DISTANCE_M so neighbours are enough
+MAX_DISTANCE_M = 50    # further apart than this they are different outlets, whatever the name
+MIN_SIMILARITY = 0.9   # SequenceMatcher ratio of the normalized names
+PREFIX_SIMILARITY = 0.9 # "toast box" vs "toast box tampines": one name is the start of the other
+PREFIX_LEN = 3         # name trigram used for blocking
+
+BRACKETS_RE = re.compile(r"\([^)]*\)|\[[^\]]*\]")   # "(Tampines)", "[Halal]"
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+NUMBER_RE = re.compile(r"\d+")
+STOPWORDS = {"the", "pte", "ltd", "llp", "private", "limited", "singapore"}
+
+
+def normalize_name(name):
+    #"TOAST BOX (Tampines) Pte. Ltd." -> "toast box"
+    text = BRACKETS_RE.sub(" ", name.lower())
+    return " ".join(word for word in NON_WORD_RE.sub(" ", text).split() if word not in STOPWORDS)
+
+
+def name_similarity(a, b):
+    if a == b:
+        return 1.0
+    if NUMBER_RE.findall(a) != NUMBER_RE.findall(b): #"stall 12" and "stall 112", "kopitiam 2": numbered outlets differ
+        return 0.0
+    short, long = sorted((a, b), key=len)
+    if long.startswith(short + " "): #whole words only, "toast" doesn't prefix "toasty"
+        return max(PREFIX_SIMILARITY, SequenceMatcher(None, a, b).ratio())
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class UnionFind:
+    #disjoint sets over restaurant ids, path halving + union by size keeps every operation near O(1)
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        #root -> [members], only sets with 2 or more members
+        members = defaultdict(list)
+        for x in self.parent:
+            members[self.find(x)].append(x)
+        return {root: ids for root, ids in members.items() if len(ids) > 1}
+
+
+def load_records(conn, precision=PRECISION):
+    #id -> (normalized name, lat, lon, has a usable cuisine), plus (geohash, name prefix) -> [ids]
+    records = {}
+    blocks = defaultdict(list)
+    rows = conn.execute("""SELECT id, name, latitude, longitude, cuisine FROM restaurants
+                           WHERE name IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+                           ORDER BY id""")
+    for rest_id, name, lat, lon, cuisine in rows:
+        norm = normalize_name(name)
+        if len(norm) < PREFIX_LEN:
+            continue
+        records[rest_id] = (norm, lat, lon, bool(cuisine) and cuisine != "unknown")
+        blocks[(geohash(lat, lon, precision), norm[:PREFIX_LEN])].append(rest_id)
+    return records, blocks
+
+
+def resolve(records, blocks, max_distance=MAX_DISTANCE_M, min_similarity=MIN_SIMILARITY):
+    #returns (UnionFind of matched ids, {id: best similarity}, pairs compared)
+    uf = UnionFind()
+    best = {}
+    compared = 0
+    neighbours = {} # geohash -> itself + the 8 around it, many blocks share a cell
+    for (cell, prefix), ids in blocks.items():
+        if cell not in neighbours:
+            neighbours[cell] = geohash_neighbours(cell)
+        #every pair is seen from exactly one side: same block i < j, other blocks only when they sort after this one
+        for other in neighbours[cell]:
+            if other < cell:
+                continue
+            others = ids if other == cell else blocks.get((other, prefix))
+            if not others:
+                continue
+            for i, a in enumerate(ids):
+                name_a, lat_a, lon_a, _ = records[a]
+                for b in (others[i + 1:] if other == cell else others):
+                    name_b, lat_b, lon_b, _ = records[b]
+                    compared += 1
+                    if distance_m(lat_a, lon_a, lat_b, lon_b) > max_distance:
+                        continue
+                    score = name_similarity(name_a, name_b)
+                    if score >= min_similarity:
+                        uf.union(a, b)
+                        best[a] = max(best.get(a, 0.0), score)
+                        best[b] = max(best.get(b, 0.0), score)
+    return uf, best, compared
+
+
+def cluster_rows(records, uf, best):
+    #(restaurant_id, cluster_id, similarity) for every member, the shown member is the oldest one with a cuisine
+    #(a cluster fronted by a row the recommender can't match would hide the outlet completely), else the oldest
+    rows = []
+    for members in uf.groups().values():
+        shown = min(members, key=lambda rest_id: (not records[rest_id][3], rest_id))
+        rows += [(rest_id, shown, round(best[rest_id], 3)) for rest_id in sorted(members)]
+    rows.sort()
+    return rows
+
+
+def main(db_path=DB_PATH, max_distance=MAX_DISTANCE_M, min_similarity=MIN_SIMILARITY, precision=PRECISION, dry_run=False):
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    migrate(conn) #restaurant_clusters is migration 6
+    records, blocks = load_records(conn, precision)
+    uf, best, compared = resolve(records, blocks, max_distance, min_similarity)
+    rows = cluster_rows(records, uf, best)
+
+    clusters = len({cluster_id for _, cluster_id, _ in rows})
+    hidden = len(rows) - clusters
+    all_pairs = len(records) * (len(records) - 1) // 2
+    print(f"{len(records)} restaurants in {len(blocks)} blocks, {compared} pairs scored "
+          f"(instead of {all_pairs}), {clusters} clusters hiding {hidden} duplicates")
+
+    if dry_run:
+        names = dict(conn.execute("SELECT id, name FROM restaurants"))
+        by_cluster = defaultdict(list)
+        for rest_id, cluster_id, _ in rows:
+            by_cluster[cluster_id].append(rest_id)
+        for cluster_id, members in list(by_cluster.items())[:20]:
+            print(f"  {names[cluster_id]!r} <- " + ", ".join(repr(names[m]) for m in members if m != cluster_id))
+    else:
+        old = conn.execute("SELECT restaurant_id, cluster_id, similarity FROM restaurant_clusters ORDER BY restaurant_id").fetchall()
+        #the whole table is rebuilt in one transaction, data_version only moves when the clusters actually changed
+        with conn:
+            conn.execute("DELETE FROM restaurant_clusters")
+            conn.executemany("INSERT INTO restaurant_clusters (restaurant_id, cluster_id, similarity) VALUES (?, ?, ?)", rows)
+            if [(r, c) for r, c, _ in old] != [(r, c) for r, c, _ in rows]:
+                bump_data_version(conn)
+    conn.close()
+    print(f"Entity resolution finished in {time.perf_counter() - started:.2f}s")
+    return hidden
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate restaurants into restaurant_clusters")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--max-distance", type=float, default=MAX_DISTANCE_M, help="metres between two records of one outlet")
+    parser.add_argument("--min-similarity", type=float, default=MIN_SIMILARITY, help="name similarity needed, 0..1")
+    parser.add_argument("--precision", type=int, default=PRECISION, help="geohash length of a block")
+    parser.add_argument("--dry-run", action="store_true", help="print some clusters instead of writing them")
+    args = parser.parse_args()
+    main(args.db, args.max_distance, args.min_similarity, args.precision, args.dry_run)
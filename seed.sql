@@ -1,29 +1,37 @@
+-- cleanup after importing the eating establishments export
+-- one DELETE per rule so scripts/dedupe.py can report how many rows each one removed,
+-- every statement starts with a "-- rule: <name>" line (dedupe.py splits on it)
+
+-- rule: unusable name
+-- LIKE already ignores case for ASCII, no LOWER() needed
 DELETE FROM restaurants
     WHERE name IS NULL
-    OR id NOT IN (
-        SELECT MIN(id)
-        FROM restaurants
-        GROUP BY name,address
-    )
-    OR lower(NAME) LIKE '%nil'
-    OR lower(NAME) LIKE '-%'
     OR LENGTH(name) < 3
-    OR LOWER(name) LIKE 'halal%'
+    OR name LIKE '%nil'
     OR name LIKE '-%'
-    OR LOWER(name) LIKE 'vegetarian%'
-    OR unit_no = ''
-    OR unit_no = '0'
-    OR unit_no IS NULL
-    OR level = ''
-    OR level = '0'
-    OR level IS NULL
-    OR latitude IS NULL
-    OR longitude IS NULL
-    OR address is NULL
-    OR address = '';
-
-
-
+    OR name LIKE 'halal%'
+    OR name LIKE 'vegetarian%';
 
+-- rule: missing unit or level
+DELETE FROM restaurants
+    WHERE unit_no IS NULL OR unit_no IN ('', '0')
+    OR level IS NULL OR level IN ('', '0');
 
+-- rule: missing location
+DELETE FROM restaurants
+    WHERE latitude IS NULL
+    OR longitude IS NULL
+    OR address IS NULL
+    OR address = '';
 
+-- rule: duplicate
+-- same normalized name, address and postal code (restaurants.dedup_key), the oldest row is kept
+DELETE FROM restaurants
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY dedup_key ORDER BY id) AS rn
+            FROM restaurants
+            WHERE dedup_key IS NOT NULL
+        )
+        WHERE rn > 1
+    );
@@ -0,0 +1,213 @@
+import marshal
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+
+from cache import LRUCache
+
+# server-side sessions: the cookie only carries a random session id, the data stays on the server
+# values are marshal'ed (str/int/list/tuple/dict only, which is all the routes and flash() store),
+# marshal is safe here because the bytes never come from the client
+
+SESSION_LIFETIME = 7 * 24 * 3600 # seconds a session survives without being used
+PURGE_INTERVAL = 600             # seconds between bulk deletes of expired sessions
+ROTATE_KEYS = {"user_id"}        # logging in or out moves the session to a new id (no session fixation)
+
+
+class ServerSession(SessionMixin): #SessionMixin is already a MutableMapping
+    """Session that only reads its data from the store the first time it is used.
+
+    Requests that never touch `session` (static files, /nearby, /api/..., /metrics)
+    never hit the store or unmarshal anything.
+    """
+
+    def __init__(self, sid, loader):
+        self.sid = sid
+        self.had_cookie = sid is not None
+        self.expires = None
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.rotate = False #a ROTATE_KEYS value changed, save_session() issues a new sid and drops the old one
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.accessed = True
+            self._data = self._loader(self) if self.sid else {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+        self.rotate = self.rotate or key in ROTATE_KEYS
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+        self.rotate = self.rotate or key in ROTATE_KEYS
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class SQLiteSessionStore:
+    #one row per session in its own database file, so session writes never wait on copy.db's writer
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local() #sqlite connections stay on the thread that opened them
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, isolation_level=None) #autocommit, one statement each
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;")
+            conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                sid TEXT PRIMARY KEY,
+                                data BLOB NOT NULL,
+                                expires REAL NOT NULL) WITHOUT ROWID""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)")
+        return conn
+
+    def load(self, sid):
+        #(data, expires) or None
+        return self._conn().execute("SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?",
+                                    (sid, time.time())).fetchone()
+
+    def save(self, sid, data, expires):
+        self._conn().execute("""INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?)
+                                ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires = excluded.expires""",
+                             (sid, data, expires))
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def purge_expired(self):
+        return self._conn().execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+
+
+class MemorySessionStore:
+    #per-process LRU, the least recently used sessions are dropped past maxsize (their users get logged out)
+    def __init__(self, maxsize=10000, lifetime=SESSION_LIFETIME):
+        self.cache = LRUCache(maxsize=maxsize, ttl=lifetime)
+
+    def load(self, sid):
+        entry = self.cache.get(sid)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry
+
+    def save(self, sid, data, expires):
+        self.cache.set(sid, (data, expires))
+
+    def delete(self, sid):
+        self.cache.delete(sid)
+
+    def purge_expired(self):
+        return self.cache.expire()
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store, lifetime=SESSION_LIFETIME, purge_interval=PURGE_INTERVAL):
+        self.store = store
+        self.lifetime = lifetime
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    def _load(self, session):
+        entry = self.store.load(session.sid)
+        if entry is None: #expired, purged or made up by the client: start over with a new id
+            session.sid = None
+            session.new = True
+            return {}
+        data, session.expires = entry
+        try:
+            return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            session.sid = None
+            session.new = True
+            return {}
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        return ServerSession(sid or None, self._load)
+
+    def save_session(self, app, session, response):
+        self._maybe_purge()
+        if not session.loaded: #nothing read, nothing to write
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        response.vary.add("Cookie")
+
+        if not session: #logged out (or never had anything): forget it on both ends
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            if session.had_cookie:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.rotate and session.sid is not None:
+            #an id planted before login must not become the logged in session, move the data to a fresh id
+            self.store.delete(session.sid)
+            session.sid = None
+            session.new = True
+
+        now = time.time()
+        #unchanged sessions are only written back once half their lifetime is used up, to slide the expiry
+        if not session.modified and session.expires is not None and session.expires - now > self.lifetime / 2:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires = now + self.lifetime
+        self.store.save(session.sid, marshal.dumps(dict(session)), session.expires)
+
+        if session.new or session.modified:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def _maybe_purge(self):
+        #bulk delete of expired sessions, at most once per purge_interval and never by two threads at once
+        now = time.monotonic()
+        if now < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = now + self.purge_interval
+            self.store.purge_expired()
+        finally:
+            self._purge_lock.release()
+
+
+def create_session_interface(backend, path=None, maxsize=10000, lifetime=SESSION_LIFETIME):
+    #backend: "sqlite" (shared by every worker on the machine) or "memory" (per process, gone on restart)
+    if backend == "memory":
+        return ServerSessionInterface(MemorySessionStore(maxsize, lifetime), lifetime)
+    if backend == "sqlite":
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return ServerSessionInterface(SQLiteSessionStore(path), lifetime)
+    raise ValueError(f"unknown session backend {backend!r}")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import their siblings directly (they are run from scripts/), the app modules live in the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
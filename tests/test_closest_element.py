@@ -0,0 +1,37 @@
+#closest_element() has to pick the same element as the original loop over every element (compared in metres,
+#benchmarks/bench_closest_element.py runs the same comparison with throughput numbers), also when threads share the module
+
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from bench_closest_element import reference_closest_element
+from overpass import closest_element
+from synthetic import overpass_tile
+
+
+def tiles(count=4, elements=300, restaurants=100, seed=0):
+    rnd = random.Random(seed)
+    return [overpass_tile(rnd, elements, restaurants) for _ in range(count)]
+
+
+def ids(answers):
+    return [el["id"] if el is not None else None for el in answers]
+
+
+def test_matches_reference_loop():
+    for elements, queries in tiles():
+        expected = [reference_closest_element(elements, lat, lon, name, metres=True) for lat, lon, name in queries]
+        assert ids([closest_element(elements, lat, lon, name) for lat, lon, name in queries]) == ids(expected)
+
+
+def test_same_answers_from_several_threads():
+    work = [(elements, query) for elements, queries in tiles(seed=1) for query in queries]
+    expected = ids([closest_element(elements, *query) for elements, query in work])
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        answers = list(pool.map(lambda item: closest_element(item[0], *item[1]), work * 4))
+    assert ids(answers) == expected * 4
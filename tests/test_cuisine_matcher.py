@@ -0,0 +1,35 @@
+#the precompiled infer_cuisine_from_name() has to give the same answer as the original keyword loops
+#(scripts/check_cuisine_parity.py runs the same comparison over every name in a real copy.db)
+
+from check_cuisine_parity import EXTRA_NAMES, reference_infer_cuisine
+from overpass import MULTI_WORD_KEYWORDS, SINGLE_WORD_KEYWORDS, infer_cuisine_from_name, infer_cuisines
+
+
+def keyword_names():
+    #every keyword standalone, glued to other words, capitalized and behind punctuation
+    keywords = [k for phrases in MULTI_WORD_KEYWORDS.values() for k in phrases]
+    keywords += [k for words in SINGLE_WORD_KEYWORDS.values() for k in words]
+    names = []
+    for keyword in keywords:
+        names += [keyword, keyword.title(), f"The {keyword} House", f"{keyword}ery", f"super{keyword}",
+                  f"{keyword}-{keyword}", f"Mr. {keyword.upper()}!"]
+    #two keywords from different cuisines in one name, the priority order decides
+    names += [f"{a} {b}" for a, b in zip(keywords, reversed(keywords))]
+    return names
+
+
+def test_matches_reference_on_keywords_and_edge_cases():
+    names = keyword_names() + EXTRA_NAMES
+    mismatches = [(name, reference_infer_cuisine(name), infer_cuisine_from_name(name)) for name in names
+                  if reference_infer_cuisine(name) != infer_cuisine_from_name(name)]
+    assert mismatches == []
+
+
+def test_bulk_version_matches_single_name():
+    names = keyword_names()
+    assert infer_cuisines(names) == [infer_cuisine_from_name(name) for name in names]
+
+
+def test_unknown_without_keywords():
+    assert infer_cuisine_from_name("") == "unknown"
+    assert infer_cuisine_from_name("Zzyzx 123") == "unknown"
@@ -0,0 +1,45 @@
+#cuisines past the first MAX_BITS share OVERFLOW_BIT, they still have to match exactly (and only) their own restaurants
+
+import os
+import sqlite3
+
+from conftest import ROOT
+from cuisines import MAX_BITS, OVERFLOW, cuisine_bits
+from migrations import migrate
+from precompute_recommendations import load_groups, rank
+from recommender import RestaurantIndex, sql_recommendations
+
+NAMES = [f"cuisine{i:02d}" for i in range(MAX_BITS + 8)]
+
+
+def database(tmp_path):
+    #one restaurant per cuisine, plus one serving two of the overflow ones
+    path = os.path.join(tmp_path, "copy.db")
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "schema.sql"), "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+    rows = [(f"Stall {name}", "North", "Hawker", name, "cheap", 1.4, 103.8) for name in NAMES]
+    rows.append(("Stall both", "North", "Hawker", f"{NAMES[-1]};{NAMES[-2]}", "medium", 1.4, 103.8))
+    conn.executemany("""INSERT INTO restaurants (name, region, category, cuisine, price_range, latitude, longitude)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+    conn.commit()
+    migrate(conn)
+    return path, conn
+
+
+def test_overflow_cuisines_match_by_name(tmp_path):
+    path, conn = database(tmp_path)
+    bits = cuisine_bits(conn)
+    assert NAMES[-1] not in bits
+    assert conn.execute("SELECT count(*) FROM restaurants WHERE cuisine_mask & ? != 0", (OVERFLOW,)).fetchone()[0] > 2
+
+    index = RestaurantIndex(path)
+    groups = load_groups(conn)
+    for wanted in ([NAMES[-1]], [NAMES[-3]], [NAMES[0], NAMES[-2]]):
+        expected = sorted(r[0] for r in conn.execute("SELECT restaurant_id FROM restaurant_cuisines JOIN cuisines ON id = cuisine_id "
+                                                    "WHERE name IN (%s)" % ",".join("?" * len(wanted)), wanted))
+        sql = [(r[0], r[-1]) for r in sql_recommendations(conn, "North", wanted, "Hawker", "cheap")]
+        assert sorted(rest_id for rest_id, _ in sql) == expected
+        assert [(r["id"], r["score"]) for r in index.recommend("North", wanted, "Hawker", "cheap")] == sql
+        assert [tuple(pair) for pair in rank(groups, bits, "North", wanted, "Hawker", "cheap")] == sql
+        assert sorted(r["id"] for r in index.nearby(1.4, 103.8, 100, cuisines=wanted)) == expected
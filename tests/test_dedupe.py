@@ -0,0 +1,53 @@
+#migration 5 only adds the key, scripts/dedupe.py removes the duplicates and takes what belonged to them along
+
+import os
+import sqlite3
+
+from conftest import ROOT
+from dedupe import clean
+from migrations import dedup_key, migrate
+
+ROW = ("Ah Hock Chicken Rice", "123 ANG MO KIO AVE 3", "01", "02", "560123", 1.37, 103.85)
+
+
+def database(tmp_path, rows):
+    #schema.sql at user_version 0, so migrate() runs every migration on rows that are already there
+    conn = sqlite3.connect(os.path.join(tmp_path, "copy.db"), isolation_level=None)
+    with open(os.path.join(ROOT, "schema.sql"), "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.executemany("""INSERT INTO restaurants (name, address, unit_no, level, postal, latitude, longitude)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+    return conn
+
+
+def test_key_collapses_case_and_any_whitespace():
+    key = dedup_key("Ah Hock Chicken Rice", "123 ANG MO KIO AVE 3", "560123")
+    assert dedup_key(" ah  hock\tchicken   rice ", "123\n ANG MO KIO    AVE 3", " 560123 ") == key
+    assert dedup_key("Ah Hock", None, "560123") is None
+
+
+def test_migration_keeps_duplicates_and_dedupe_moves_their_rows(tmp_path):
+    conn = database(tmp_path, [ROW, ("AH HOCK   CHICKEN\tRICE",) + ROW[1:], ("Another Stall",) + ROW[1:]])
+    migrate(conn)
+    assert conn.execute("SELECT count(*) FROM restaurants").fetchone()[0] == 3
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_restaurants_dedup_key'").fetchone() is None
+
+    conn.execute("INSERT INTO users (id, username, password_hash, security_question, security_answer) VALUES (1, 'u', 'x', 'q', 'a')")
+    conn.execute("INSERT INTO reviews (user_id, restaurant_id, rating) VALUES (1, 2, 5)")
+    conn.execute("INSERT INTO restaurant_cuisines (restaurant_id, cuisine_id) VALUES (2, 1)")
+    conn.execute("INSERT INTO restaurant_clusters (restaurant_id, cluster_id) VALUES (2, 2), (3, 2)")
+    removed = clean(conn)
+
+    assert removed["duplicate"] == 1
+    assert [r[0] for r in conn.execute("SELECT id FROM restaurants ORDER BY id")] == [1, 3]
+    assert conn.execute("SELECT restaurant_id FROM reviews").fetchall() == [(1,)]
+    assert conn.execute("SELECT count(*) FROM restaurant_cuisines WHERE restaurant_id = 2").fetchone()[0] == 0
+    assert conn.execute("SELECT count(*) FROM restaurant_clusters").fetchone()[0] == 0
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_restaurants_dedup_key'").fetchone() is not None
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    conn = database(tmp_path, [ROW, ROW])
+    migrate(conn)
+    assert clean(conn, dry_run=True)["duplicate"] == 1
+    assert conn.execute("SELECT count(*) FROM restaurants").fetchone()[0] == 2
@@ -0,0 +1,43 @@
+#stages only rerun when something they read changed, and do rerun when it did
+
+import os
+import sqlite3
+import sys
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from synthetic import build_database
+from pipeline import parse_options, run
+
+
+def pipeline(path, *args):
+    run(parse_options(["--db", path, "--geojson", os.path.join(os.path.dirname(path), "missing.geojson"), *args]))
+
+
+def stage_lines(output):
+    return {line.split(":")[0]: line for line in output.splitlines() if ":" in line and not line.startswith(" ")}
+
+
+def test_clusters_rerun_for_a_new_near_duplicate(tmp_path, capsys):
+    path = build_database(os.path.join(tmp_path, "copy.db"), restaurants=300)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE restaurants SET unit_no = '01', level = '01'") #synthetic rows have none, seed.sql drops those
+    pipeline(path)
+    pipeline(path)
+    assert stage_lines(capsys.readouterr().out)["clusters"] == "clusters: up to date"
+
+    #the same outlet again under a branch suffix, nothing for seed.sql to remove
+    with conn:
+        new_id = conn.execute("""INSERT INTO restaurants (name, address, postal, unit_no, level, region, category, cuisine,
+                                                          price_range, latitude, longitude)
+                                 SELECT name || ' (Tampines)', address, postal, unit_no, level, region, category, cuisine,
+                                        price_range, latitude, longitude
+                                 FROM restaurants WHERE name = 'Restaurant 99'""").lastrowid
+    pipeline(path)
+    lines = stage_lines(capsys.readouterr().out)
+    assert lines["seed"] == "seed: up to date"
+    assert lines["clusters"] != "clusters: up to date"
+    assert conn.execute("SELECT cluster_id FROM restaurant_clusters WHERE restaurant_id = ?", (new_id,)).fetchone() is not None
+    conn.close()
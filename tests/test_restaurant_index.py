@@ -0,0 +1,28 @@
+#a data_version bump seen by many requests at once reloads the index once, not once per request
+
+import os
+import sys
+import threading
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from synthetic import build_database
+from recommender import RestaurantIndex
+
+
+def test_concurrent_refresh_loads_once(tmp_path):
+    index = RestaurantIndex(build_database(os.path.join(tmp_path, "copy.db"), restaurants=500))
+    version = index.load().stamp
+    index._snapshot.stamp = version - 1 #as if the scripts bumped data_version since
+
+    loads = []
+    load = index.load
+    index.load = lambda: loads.append(1) or load()
+    threads = [threading.Thread(target=index.refresh_if_stale, args=(version,)) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert not index.is_stale(version)